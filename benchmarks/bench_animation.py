@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""棋子动画的每帧开销: 每个棋子各自的 LerpFunc 区间与 gamegui.PieceAnimationScheduler 对比
+
+Usage:
+    python benchmarks/bench_animation.py [--pieces 64,512,2048] [--frames 200]
+
+离屏窗口中创建若干个没有模型的节点(只测量动画本身), 每个节点循环播放悬停动画, 报告每帧 taskMgr.step() 的
+平均耗时(毫秒). lerp 为改动之前的做法: 每个棋子一个 LerpFunc, 每帧由区间管理器为每个区间调用一次 Python 回调;
+scheduler 为一个任务每帧遍历全部动画. idle 行为没有任何动画播放时的帧耗时.
+"""
+from __future__ import print_function
+
+import argparse
+import math
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import panda3d.core
+
+panda3d.core.loadPrcFileData('', 'load-display p3tinydisplay\naudio-library-name null\nwin-size 64 64')
+
+import direct.interval.LerpInterval
+import direct.showbase.ShowBase
+
+import gamegui
+
+
+def frame_time(base, frames):
+    """:return: 每帧平均毫秒数"""
+    base.taskMgr.step()
+    started = time.perf_counter()
+    for k in range(frames):
+        base.taskMgr.step()
+    return (time.perf_counter() - started) / frames * 1e3
+
+
+def run_lerp(base, nodes, frames):
+    intervals = []
+    for node in nodes:
+        interval = direct.interval.LerpInterval.LerpFunc(
+            gamegui.CustomizedPiece._vertical_oscillating_motion, duration=0.4, fromData=0, toData=math.pi,
+            extraArgs=[node, gamegui.CustomizedPiece.HEIGHT])
+        interval.loop()
+        intervals.append(interval)
+    elapsed = frame_time(base, frames)
+    for interval in intervals:
+        interval.finish()
+    return elapsed
+
+
+def run_scheduler(base, nodes, frames):
+    scheduler = gamegui.PieceAnimationScheduler(base.taskMgr)
+    duration, fromValue, toValue = gamegui.CustomizedPiece.ANIMATIONS['hovering']
+    for node in nodes:
+        scheduler.start(node, node, duration, fromValue, toValue, gamegui.CustomizedPiece.HEIGHT, loop=True)
+    elapsed = frame_time(base, frames)
+    for node in nodes:
+        scheduler.stop(node)
+    assert not scheduler.isRunning()
+    return elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pieces', default='64,512,2048')
+    parser.add_argument('--frames', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    base = direct.showbase.ShowBase.ShowBase(fStartDirect=False, windowType='offscreen')
+    print('{:>8} {:>10} {:>10} {:>12}'.format('pieces', 'idle ms', 'lerp ms', 'scheduler ms'))
+    for count in [int(n) for n in args.pieces.split(',')]:
+        root = base.render.attachNewNode('pieces')
+        nodes = [root.attachNewNode('piece') for k in range(count)]
+        idle = frame_time(base, args.frames)
+        lerp = run_lerp(base, nodes, args.frames)
+        scheduler = run_scheduler(base, nodes, args.frames)
+        print('{:>8} {:>10.3f} {:>10.3f} {:>12.3f}'.format(count, idle, lerp, scheduler))
+        root.removeNode()
+
+
+if '__main__' == __name__:
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""批量走法生成(gamebatch)与逐个对局调用 GameArena.retrieve_all_valid_moves() 的对比
+
+Usage:
+    python benchmarks/bench_batch.py [--games 100,1000,5000] [--repeat 5]
+
+局面来自随机对局的不同阶段, 每个局面都是新建的竞技场(走法缓存为空), 相当于服务器上每个对局刚走过一步棋.
+报告每个局面的平均微秒数(取 --repeat 次中最快的一次):
+    arena      逐个对局 retrieve_all_valid_moves(), 不含新建竞技场的时间
+    encode     encode_arenas() 把竞技场叠成 NumPy 数组
+    moves      generate_moves() 计算全部单位的走法掩码
+    squares    valid_moves_of_game() 把全部对局的结果转换成 Square 元组
+并核对两种方式的结果是否一致.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import gamearena
+import gamebatch
+import gameengine
+
+WHITE = gamearena.GameArena.PlayerID(1)
+BLACK = gamearena.GameArena.PlayerID(2)
+
+
+def random_fens(count, seed=48):
+    rng = random.Random(seed)
+    fens = []
+    while len(fens) < count:
+        arena = gamearena.new_standard_chess_arena()
+        side, other = WHITE, BLACK
+        for ply in range(120):
+            legal = arena.retrieve_packed_legal_moves(side)
+            if not legal:
+                break
+            gameengine.apply_move(arena, rng.choice(legal))
+            side, other = other, side
+            if ply % 6 == 0:
+                fens.append(gamearena.fen_of_arena(arena, WHITE, side))
+    return fens[:count]
+
+
+def best_of(repeat, setup, function):
+    """:return: 最快一次的秒数, 最后一次的结果"""
+    best, result = None, None
+    for k in range(repeat):
+        argument = setup()
+        started = time.perf_counter()
+        result = function(argument)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', default='100,1000,5000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    print('{:>7} {:>10} {:>10} {:>10} {:>10} {:>10} {:>9}'.format(
+        'games', 'arena us', 'encode us', 'moves us', 'squares us', 'speedup', 'mismatch'))
+    for count in [int(n) for n in args.games.split(',')]:
+        fens = random_fens(count)
+
+        def fresh_arenas():
+            return [gamearena.new_arena_from_fen(fen) for fen in fens]
+
+        arena_time, expected = best_of(args.repeat, fresh_arenas,
+                                       lambda arenas: [arena.retrieve_all_valid_moves() for arena in arenas])
+        arenas = fresh_arenas()
+        encode_time, boards = best_of(args.repeat, lambda: arenas, gamebatch.encode_arenas)
+        generate_time, batch = best_of(args.repeat, lambda: boards, gamebatch.generate_moves)
+        squares_time, moves = best_of(args.repeat, lambda: batch,
+                                      lambda batch: [batch.valid_moves_of_game(g) for g in range(len(batch))])
+
+        mismatches = 0
+        for arena, expected_moves, game_moves in zip(arenas, expected, moves):
+            got = dict((arena.find_unit_id_on_index(index), destinations) for index, destinations in game_moves.items())
+            mismatches += got != expected_moves
+        batch_time = encode_time + generate_time + squares_time
+        print('{:>7} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>9.1f}x {:>9}'.format(
+            count, arena_time / count * 1e6, encode_time / count * 1e6, generate_time / count * 1e6,
+            squares_time / count * 1e6, arena_time / batch_time, mismatches))
+
+
+if '__main__' == __name__:
+    main()
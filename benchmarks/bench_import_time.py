@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""各个入口模块的导入开销: 在子进程中运行 python -X importtime -c "import X", 解析 stderr
+
+Usage:
+    python benchmarks/bench_import_time.py [--repeat 5] [--top 5] [MODULE ...]
+
+每个模块先导入一次填充 __pycache__(去掉 PYTHONDONTWRITEBYTECODE), 之后的测量不包含编译时间.
+报告(取 --repeat 次中位数):
+    import ms   -X importtime 记录的顶层导入累计时间之和, 包括解释器启动时的 site 等模块, 对照行 (startup) 只有这部分
+    wall ms     子进程从启动到退出的时间(包括解释器自身的启动)
+    modules     导入的模块数量
+    panda3d     是否导入了 panda3d; 规则入口不应该出现 yes
+最后列出每个模块自身耗时(cumulative)最多的几个依赖.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_MODULES = ['(startup)', 'rules', 'gamearena', 'gameengine', 'uci', 'gameshm', 'gametournament', 'gameserver',
+                 'main', 'gamegui']
+
+
+def child_env():
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env['PYTHONPATH'] = ROOT_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    return env
+
+
+def parse_importtime(stderr):
+    """:return: [(名称, 自身微秒, 累计微秒, 缩进层数)]"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((name.strip(), int(self_us), int(cumulative_us), (len(name) - len(name.lstrip())) // 2))
+    return rows
+
+
+def measure(module, env):
+    """:return: 导入累计毫秒, 进程墙钟毫秒, 模块数量, 是否导入 panda3d, 逐项记录; 导入失败时返回 None"""
+    started = time.perf_counter()
+    code = 'pass' if module == '(startup)' else 'import ' + module
+    process = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', code],
+                               cwd=ROOT_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               universal_newlines=True)
+    out, err = process.communicate()
+    wall = (time.perf_counter() - started) * 1e3
+    if process.returncode != 0:
+        return None
+    rows = parse_importtime(err)
+    top_level = sum(cumulative for name, self_us, cumulative, depth in rows if depth == 0) / 1e3
+    panda = any(name.split('.')[0] in ('panda3d', 'direct') for name, self_us, cumulative, depth in rows)
+    return top_level, wall, len(rows), panda, rows
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=5, help='每个模块列出的最重依赖数量')
+    parser.add_argument('modules', nargs='*', default=ENTRY_MODULES)
+    args = parser.parse_args(argv)
+
+    env = child_env()
+    results = []
+    for module in args.modules:
+        if measure(module, env) is None:  # 填充 __pycache__
+            print('{}: import failed, skipped'.format(module), file=sys.stderr)
+            continue
+        samples = [measure(module, env) for k in range(args.repeat)]
+        samples = [sample for sample in samples if sample is not None]
+        results.append((module, samples))
+
+    print('{:>16} {:>10} {:>10} {:>8} {:>8}'.format('module', 'import ms', 'wall ms', 'modules', 'panda3d'))
+    for module, samples in results:
+        print('{:>16} {:>10.1f} {:>10.1f} {:>8} {:>8}'.format(
+            module, median(s[0] for s in samples), median(s[1] for s in samples), samples[0][2],
+            'yes' if samples[0][3] else 'no'))
+
+    if args.top:
+        for module, samples in results:
+            rows = samples[len(samples) // 2][4]
+            own = [row for row in rows if row[0] != module]
+            heaviest = sorted(own, key=lambda row: row[2], reverse=True)[:args.top]
+            print('{}: {}'.format(module, ', '.join(
+                '{} {:.1f}'.format(name, cumulative / 1e3) for name, self_us, cumulative, depth in heaviest)))
+
+
+if '__main__' == __name__:
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""走棋日志(gamejournal)的开销: 每步棋的写日志开销和长对局的恢复时间
+
+Usage:
+    python benchmarks/bench_journal.py [--plies 2000] [--windows none,0,0.005,0.05] [--lengths 100,1000,10000]
+                                       [--dir DIR]
+
+每步棋的开销: 预先生成一局随机对局, 在同一个初始局面上按相同的走法调用 move_unit_to_index(),
+分别不挂日志和挂上不同组提交间隔(window)的日志交替运行, 各取最快的一次, 两者之差除以步数即为每步的日志开销(微秒).
+    none    只 write() 不 fsync, 即日志本身的编码和系统调用开销
+    0       每步都 fsync
+    其他    组提交, 同时报告每次 fsync 平均覆盖的走法数量
+
+恢复时间: 写出若干长度的日志, 测量 read_journal() 读取校验和 replay() 重放各自的时间.
+对局由随机的开局和之后双方的马来回跳组成, 日志重放不检查走法是否合法, 只关心步数.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import gamearena
+import gamejournal
+
+WHITE = gamearena.GameArena.PlayerID(1)
+BLACK = gamearena.GameArena.PlayerID(2)
+
+# b1c3 b8c6 c3b1 c6b8, 从开局的任意偶数步之后都可以无限重复
+KNIGHT_SHUFFLE = [(1, 18), (57, 42), (18, 1), (42, 57)]
+
+
+def random_game(plies, seed=47, opening_plies=100):
+    """随机开局之后双方的马在 b1/c3 和 b8/c6 之间往返, 可以生成任意长度的对局
+
+    :return: 从标准开局开始的走法 [(起点, 终点)], 长度为 plies
+    """
+    rng = random.Random(seed)
+    arena = gamearena.new_standard_chess_arena()
+    side, other = WHITE, BLACK
+    shuffle_squares = set(fr for fr, to in KNIGHT_SHUFFLE)
+    moves = []
+    while len(moves) < min(plies, opening_plies):
+        legal = arena.retrieve_packed_legal_moves(side)
+        if not legal:
+            break
+        fr, to, flags = gamearena.unpack_move(rng.choice(legal))
+        if fr in shuffle_squares or to in shuffle_squares:
+            continue  # 留给马往返的格子保持原样
+        moves.append((fr, to))
+        arena.move_unit_to_index(arena.find_unit_id_on_index(fr), to)
+        side, other = other, side
+    del moves[len(moves) // 2 * 2:]  # 往返从白方开始
+    k = 0
+    while len(moves) < plies:
+        moves.append(KNIGHT_SHUFFLE[k % 4])
+        k += 1
+    return moves
+
+
+def play(moves, journal=None):
+    """:return: 走完全部走法的秒数"""
+    arena = gamearena.new_standard_chess_arena()
+    if journal is not None:
+        arena.attach_journal(journal)
+    find = arena.find_unit_id_on_index
+    move = arena.move_unit_to_index
+    started = time.perf_counter()
+    for fr, to in moves:
+        move(find(fr), to)
+    elapsed = time.perf_counter() - started
+    if journal is not None:
+        journal.close()  # 最后一批 fsync 不计入每步开销
+    return elapsed
+
+
+def parse_window(text):
+    return None if text == 'none' else float(text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--plies', type=int, default=2000)
+    parser.add_argument('--windows', default='none,0,0.005,0.05')
+    parser.add_argument('--lengths', default='100,1000,10000')
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--dir', help='日志目录, 默认为临时目录; fsync 的开销取决于这里的文件系统')
+    args = parser.parse_args(argv)
+
+    directory = args.dir or tempfile.mkdtemp(prefix='bench_journal_')
+    path = os.path.join(directory, 'bench.journal')
+    fen = gamearena.STANDARD_CHESS_FEN
+    moves = random_game(args.plies)
+
+    print('{} plies, journal in {}'.format(len(moves), directory))
+    print('{:>8} {:>10} {:>12} {:>10} {:>14}'.format('window', 'us/move', 'overhead us', 'fsyncs', 'moves/fsync'))
+    for text in args.windows.split(','):
+        window = parse_window(text)
+        baseline = best = None
+        fsyncs = 0
+        for k in range(args.repeat):
+            # 不挂日志的对照组与每一轮交替运行, 减少机器负载变化的影响
+            elapsed = play(moves)
+            baseline = elapsed if baseline is None else min(baseline, elapsed)
+            journal = gamejournal.GameJournal(path, fen=fen, window=window)
+            elapsed = play(moves, journal)
+            if best is None or elapsed < best:
+                best, fsyncs = elapsed, journal.fsyncs - 1  # 不计创建文件时的一次
+        print('{:>8} {:>10.2f} {:>12.2f} {:>10} {:>14}'.format(
+            text, best / len(moves) * 1e6, (best - baseline) / len(moves) * 1e6, fsyncs,
+            '{:.1f}'.format(len(moves) / float(fsyncs)) if fsyncs else '-'))
+
+    print()
+    print('{:>8} {:>10} {:>10} {:>10} {:>10}'.format('moves', 'bytes', 'read ms', 'replay ms', 'total ms'))
+    for length in [int(n) for n in args.lengths.split(',')]:
+        journal = gamejournal.GameJournal(path, fen=fen, window=None)
+        play(random_game(length), journal)
+        size = os.path.getsize(path)
+        read_ms = replay_ms = None
+        for k in range(args.repeat):
+            started = time.perf_counter()
+            contents = gamejournal.read_journal(path)
+            read = time.perf_counter() - started
+            arena = gamearena.new_arena_from_fen(contents.fen)
+            started = time.perf_counter()
+            gamejournal.replay(arena, contents.moves)
+            replay = time.perf_counter() - started
+            read_ms = read * 1e3 if read_ms is None else min(read_ms, read * 1e3)
+            replay_ms = replay * 1e3 if replay_ms is None else min(replay_ms, replay * 1e3)
+        print('{:>8} {:>10} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+            len(contents.moves), size, read_ms, replay_ms, read_ms + replay_ms))
+    os.remove(path)
+    if not args.dir:
+        os.rmdir(directory)
+
+
+if '__main__' == __name__:
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""合法走法过滤(LegalityFilter)相对于伪合法走法生成的额外开销
+
+Usage:
+    python benchmarks/bench_legal_moves.py [--games 20] [--plies 80]
+
+用随机对局(只走合法走法)产生的局面, 对走棋一方分别测量:
+    pseudo   计算全部单位的伪合法走法(清空走法缓存后 retrieve_packed_moves)
+    legal    同上, 再加上计算将军/牵制信息并过滤(清空走法缓存后 retrieve_packed_legal_moves)
+    naive    对每一步伪合法走法试走, 重新计算全部敌方火力, 检查己方王是否被攻击
+同时核对 legal 与 naive 的结果完全一致.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import gamearena
+
+WHITE = gamearena.GameArena.PlayerID(1)
+BLACK = gamearena.GameArena.PlayerID(2)
+
+
+def collect_positions(games, plies):
+    """:return: [(arena, 走棋一方)], 每个局面各自一个 arena"""
+    rng = random.Random(40)
+    positions = []
+    for g in range(games):
+        moves = []
+        for ply in range(plies):
+            arena = gamearena.new_standard_chess_arena()
+            for unit_id, index in moves:
+                arena.move_unit_to_index(unit_id, index)
+            player = WHITE if ply % 2 == 0 else BLACK
+            positions.append((arena, player))
+            legal = arena.retrieve_packed_legal_moves(player)
+            if not legal:
+                break
+            fr, to, flags = gamearena.unpack_move(rng.choice(legal))
+            moves.append((arena.find_unit_id_on_index(fr), to))
+    return positions
+
+
+def naive_legal_moves(arena, player):
+    """逐一试走并重新计算敌方火力"""
+    snapshot = arena._GameArena__take_snapshot()
+    result = []
+    for move in arena.retrieve_packed_moves(player):
+        fr, to, flags = gamearena.unpack_move(move)
+        trial = snapshot.copy()
+        trial[to] = trial.pop(fr)
+        king = None
+        for index, node in trial.items():
+            if node.unit.royal and node.unit.owner == player:
+                king = index
+        attacked = False
+        for index, node in trial.items():
+            if king is not None and node.unit.owner != player and \
+                    king in node.unit.retrieve_indices_within_shooting_range(index, trial):
+                attacked = True
+                break
+        if not attacked:
+            result.append(move)
+    return result
+
+
+def timed(positions, query):
+    elapsed = 0.0
+    results = []
+    for arena, player in positions:
+        arena._GameArena__valid_moves.clear()
+        arena._GameArena__legality = (None, {})
+        started = time.perf_counter()
+        results.append(query(arena, player))
+        elapsed += time.perf_counter() - started
+    return elapsed / len(positions) * 1e3, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=20)
+    parser.add_argument('--plies', type=int, default=80)
+    args = parser.parse_args(argv)
+
+    positions = collect_positions(args.games, args.plies)
+    pseudo, pseudo_moves = timed(positions, lambda arena, player: arena.retrieve_packed_moves(player))
+    legal, legal_moves = timed(positions, lambda arena, player: arena.retrieve_packed_legal_moves(player))
+    naive, naive_moves = timed(positions, naive_legal_moves)
+
+    mismatches = sum(1 for a, b in zip(legal_moves, naive_moves) if sorted(a) != sorted(b))
+    filtered = sum(len(a) - len(b) for a, b in zip(pseudo_moves, legal_moves))
+    checks = sum(1 for arena, player in positions if arena.is_in_check(player))
+    print('{} positions ({} in check), {} pseudo-legal moves filtered out, {} mismatches against naive'.format(
+        len(positions), checks, filtered, mismatches))
+    print('{:>8} {:>10} {:>8}'.format('query', 'ms/pos', 'ratio'))
+    for name, ms in (('pseudo', pseudo), ('legal', legal), ('naive', naive)):
+        print('{:>8} {:>10.3f} {:>8.2f}'.format(name, ms, ms / pseudo))
+    return 1 if mismatches else 0
+
+
+if '__main__' == __name__:
+    sys.exit(main())
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""测量一次走法查询产生的内存分配: Square 元组接口与格子编号(array)接口对比
+
+Usage:
+    python benchmarks/bench_move_encoding.py [--games 20] [--plies 40]
+
+用随机对局产生的局面, 对棋盘上每个棋子分别调用:
+    squares   unit.retrieve_valid_moves(square, snapshot), 结果为 Square 元组
+    indices   unit.retrieve_valid_indices(index, snapshot), 结果为 array('H')
+    packed    arena.retrieve_packed_moves(), 全部走法打包成 array('Q') (每个局面一次, 走法缓存已填满)
+每种查询报告:
+    blocks    查询结果保留下来的内存块数量(sys.getallocatedblocks 的差值), 即每次查询分配的对象个数
+    bytes     查询结果保留下来的字节数(tracemalloc)
+    peak      查询过程中的内存峰值(tracemalloc), 包括临时对象
+    us        耗时(不开启 tracemalloc 时测量)
+旧版本的 gamearena 没有格子编号接口时只测量 squares, 便于在改动前后对比.
+"""
+from __future__ import print_function
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import gamearena
+
+
+def collect_positions(games, plies):
+    """:return: 随机对局中出现的 GameArena 局面列表(每个局面各自一个 arena)"""
+    rng = random.Random(2024)
+    positions = []
+    for g in range(games):
+        moves = []
+        for ply in range(plies):
+            arena = gamearena.new_standard_chess_arena()
+            for unit_id, square in moves:
+                arena.move_unit_to_somewhere(unit_id, square)
+            positions.append(arena)
+            candidates = sorted((unit_id, square) for unit_id, squares in arena.retrieve_all_valid_moves().items()
+                                for square in squares)
+            if not candidates:
+                break
+            moves.append(rng.choice(candidates))
+    return positions
+
+
+def unit_queries(positions, use_indices):
+    """:return: 每个局面上全部棋子的查询函数列表"""
+    queries = []
+    for arena in positions:
+        snapshot = arena._GameArena__take_snapshot()
+        for unit_id, square, unit in arena.retrieve_units_on_board():
+            if use_indices:
+                f, starting = unit.retrieve_valid_indices, snapshot.index_of(square)
+            else:
+                f, starting = unit.retrieve_valid_moves, square
+            if isinstance(unit, gamearena.KingUnit):
+                # 王会修改快照, 每次查询都使用一份副本
+                queries.append(lambda f=f, a=starting, s=snapshot: f(a, s.copy()))
+            else:
+                queries.append(lambda f=f, a=starting, s=snapshot: f(a, s))
+    return queries
+
+
+def measure(calls):
+    """:param calls: 无参数函数的列表, 每个函数执行一次查询"""
+    for call in calls[:100]:
+        call()  # 预热: 射线表等一次性缓存不计入
+    gc.collect()
+    gc.disable()
+    try:
+        started = time.perf_counter()
+        for call in calls:
+            call()
+        elapsed = time.perf_counter() - started
+
+        results = [None] * len(calls)
+        blocks = sys.getallocatedblocks()
+        for k, call in enumerate(calls):
+            results[k] = call()
+        blocks = sys.getallocatedblocks() - blocks
+        del results
+
+        results = [None] * len(calls)
+        tracemalloc.start()
+        peaks = 0
+        for k, call in enumerate(calls):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            results[k] = call()
+            current, peak = tracemalloc.get_traced_memory()
+            peaks += peak - before
+        retained = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del results
+    finally:
+        gc.enable()
+    n = float(len(calls))
+    return blocks / n, retained / n, peaks / n, elapsed / n * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=20)
+    parser.add_argument('--plies', type=int, default=40)
+    args = parser.parse_args(argv)
+
+    positions = collect_positions(args.games, args.plies)
+    rows = [('squares', unit_queries(positions, False))]
+    if hasattr(gamearena.Unit, 'retrieve_valid_indices'):
+        rows.append(('indices', unit_queries(positions, True)))
+    if hasattr(gamearena.GameArena, 'retrieve_packed_moves'):
+        # 走法缓存已在预热时填满, 测量的是走棋之后的常态: 只有打包本身的开销
+        rows.append(('packed', [arena.retrieve_packed_moves for arena in positions]))
+
+    print('{} positions'.format(len(positions)))
+    print('{:>8} {:>8} {:>10} {:>10} {:>10} {:>10}'.format('query', 'calls', 'blocks', 'bytes', 'peak', 'us'))
+    for name, calls in rows:
+        blocks, retained, peak, micros = measure(calls)
+        print('{:>8} {:>8} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.2f}'.format(
+            name, len(calls), blocks, retained, peak, micros))
+
+
+if '__main__' == __name__:
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*-encoding:utf8;-*-
+"""测量 CustomizedPiece 的构造耗时以及场景图节点数量
+
+Usage:
+    python benchmarks/bench_piece_construction.py [--rounds 20]
+
+在不同版本上分别运行本脚本即可对比改动前后的数据. 使用离屏软件渲染, 不需要显示器和 GPU.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import panda3d.core
+
+panda3d.core.loadPrcFileData('', '\n'.join([
+    'load-display p3tinydisplay',
+    'audio-library-name null',
+    'model-path {}'.format(ROOT_DIR),
+]))
+
+import gamegui
+
+PIECE_NAMES = ['rook', 'knight', 'bishop', 'queen', 'king', 'bishop', 'knight', 'rook'] + ['pawn'] * 8
+
+
+def build_pieces(models, parent):
+    pieces = []
+    for i, name in enumerate(PIECE_NAMES * 2):
+        holder = parent.attachNewNode('pieceInstanceHolder')
+        models[name].instanceTo(holder)
+        pieces.append(gamegui.CustomizedPiece(holder, mask=panda3d.core.BitMask32.bit(1)))
+    return pieces
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=20, help='重复构造 32 个棋子的轮数')
+    args = parser.parse_args(argv)
+
+    base = gamegui.MyChessboard(fStartDirect=False, windowType='offscreen')
+    print('MyChessboard render nodes: {}'.format(base.render.findAllMatches('**').getNumPaths()))
+    models = dict((name, base.loader.loadModel('models/default/{}'.format(name))) for name in set(PIECE_NAMES))
+
+    timings = []
+    for k in range(args.rounds):
+        parent = base.render.attachNewNode('benchmarkRoot')
+        start = time.perf_counter()
+        build_pieces(models, parent)
+        timings.append(time.perf_counter() - start)
+        parent.removeNode()
+
+    parent = base.render.attachNewNode('benchmarkRoot')
+    pieces = build_pieces(models, parent)
+    nodes = parent.findAllMatches('**').getNumPaths()
+    collision_nodes = parent.findAllMatches('**/+CollisionNode').getNumPaths()
+    traversers = sum(1 for piece in pieces if hasattr(piece, 'picker'))
+
+    timings.sort()
+    print('construction of 32 pieces: median {:.3f} ms, best {:.3f} ms ({} rounds)'.format(
+        timings[len(timings) // 2] * 1e3, timings[0] * 1e3, args.rounds))
+    print('scene graph nodes under 32 pieces: {}'.format(nodes))
+    print('collision nodes: {}, per-piece traversers: {}'.format(collision_nodes, traversers))
+
+
+if '__main__' == __name__:
+    main()
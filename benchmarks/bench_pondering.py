@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""后台思考对引擎感知延迟的影响: 同样的对局分别在开启和关闭 pondering 时各下一遍
+
+Usage:
+    python benchmarks/bench_pondering.py [--games 2] [--moves 10] [--depth 3] [--think 1.0] [--random-rate 0.3]
+
+引擎执黑. 白方模拟人: 用 depth=2 的引擎选择走法, 以 --random-rate 的概率改为随机合法走法(让预测落空),
+每步棋固定思考 --think 秒, 期间引擎可以在后台搜索. 报告每步棋的感知延迟(从白方落子到引擎给出走法):
+    hits/misses  后台思考命中与未命中的次数
+    mean/p50/max 感知延迟(毫秒)
+两种模式使用相同的随机数种子, 白方的走法序列只在引擎应着不同时才会不同.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import gamearena
+import gameengine
+import gameponder
+
+WHITE = gamearena.GameArena.PlayerID(1)
+BLACK = gamearena.GameArena.PlayerID(2)
+
+
+def play(pondering, games, moves, depth, think, random_rate):
+    """:rtype : gameponder.PonderStats, list"""
+    engine = gameponder.PonderingEngine(BLACK, {'depth': depth}, pondering=pondering)
+    human = gameengine.Engine(depth=2)
+    try:
+        for game in range(games):
+            rng = random.Random(game)
+            arena = gamearena.new_standard_chess_arena()
+            for k in range(moves):
+                started = time.perf_counter()
+                legal = arena.retrieve_packed_legal_moves(WHITE)
+                if not legal:
+                    break
+                move = rng.choice(legal) if rng.random() < random_rate else human.search(arena, WHITE).move
+                time.sleep(max(0.0, think - (time.perf_counter() - started)))
+                gameengine.apply_move(arena, move)
+                engine.opponent_moved(arena)
+                result = engine.wait()
+                if result.move is None:
+                    break
+                gameengine.apply_move(arena, result.move)
+                engine.start_pondering(arena)
+        return engine.stats(), sorted(engine.latencies)
+    finally:
+        engine.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=2)
+    parser.add_argument('--moves', type=int, default=10, help='每局白方走多少步')
+    parser.add_argument('--depth', type=int, default=3, help='引擎的搜索深度')
+    parser.add_argument('--think', type=float, default=1.0, help='白方每步棋的思考时间(秒)')
+    parser.add_argument('--random-rate', type=float, default=0.3, help='白方随机走棋的概率')
+    args = parser.parse_args(argv)
+
+    print('{:>8} {:>6} {:>6} {:>6} {:>10} {:>10} {:>10}'.format(
+        'mode', 'moves', 'hits', 'misses', 'mean ms', 'p50 ms', 'max ms'))
+    for name, pondering in (('ponder', True), ('off', False)):
+        stats, latencies = play(pondering, args.games, args.moves, args.depth, args.think, args.random_rate)
+        p50 = latencies[len(latencies) // 2] * 1e3 if latencies else 0.0
+        print('{:>8} {:>6} {:>6} {:>6} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+            name, stats.moves, stats.hits, stats.misses, stats.mean, p50, stats.maximum))
+
+
+if '__main__' == __name__:
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""客户端输入重放(gamerecord)的基准测试: 合成一段用鼠标拖拽走棋的录制, 离屏全速重放并报告各处理函数的耗时
+
+Usage:
+    python benchmarks/bench_replay.py [--frames-per-drag 30] [--idle-frames 30] [--size 800x600] [--save PATH]
+
+离屏窗口中把棋盘格子投影到屏幕坐标, 按 MOVES 合成输入: 先按 Page Up 把镜头转到接近垂直俯视(斜视时前排的
+高棋子会挡住后排的棋子), 然后每步棋鼠标从上一个位置移到起点格子, 停稳后按下左键, 拖到终点格子, 停稳后松开左键,
+再停留若干帧(悬停动画和落子动画照常播放), 帧间隔固定为 1/60 秒.
+录制文件末尾写入用规则模块走出的结束局面, 重放结束时核对, 不一致说明客户端的拾取或走棋逻辑有问题.
+--save 保存合成的录制文件, 之后可以用 python main.py --replay PATH 重放.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import panda3d.core
+
+import gamearena
+import gamerecord
+
+# 意大利开局, 包括吃子(送进墓地的动画)
+MOVES = ['e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1c4', 'f8c5', 'c2c3', 'g8f6', 'd2d4', 'e5d4', 'c3d4', 'c5b4']
+FRAME_TIME = 1.0 / 60
+PAGE_UP_PRESSES = 3  # 俯仰角 -45 度转到 -88.5 度
+SETTLE_FRAMES = 5  # 按下和松开左键之前鼠标静止的帧数, 拖拽中的棋子跟上鼠标
+
+
+def screen_position(base, index):
+    """:return: 格子 index 的中心在屏幕上的坐标(-1..1)"""
+    topCenter = base.render.find('**/chessboardTopCenter')
+    point = base.cam.getRelativePoint(topCenter, panda3d.core.LPoint3((index % 8) - 3.5, (index // 8) - 3.5, 0))
+    screen = panda3d.core.LPoint2()
+    if not base.camLens.project(point, screen):
+        raise ValueError('square {} is outside of the view'.format(index))
+    return screen.getX(), screen.getY()
+
+
+def synthesize(base, path, moves, framesPerDrag, idleFrames):
+    """按 moves 合成录制文件, 投影时临时转动 base 的镜头, 结束后复原
+
+    :return: 帧数
+    """
+    arena = gamearena.new_standard_chess_arena()
+    players = (gamearena.GameArena.PlayerID(1), gamearena.GameArena.PlayerID(2))
+    recorder = gamerecord.InputRecorder(path, base.win.getXSize(), base.win.getYSize(),
+                                        gamearena.fen_of_arena(arena, side_to_move=players[0]))
+    mouse = (0.0, 0.0)
+    pitch = base.axisCameraPitching.getHpr()
+    for k in range(PAGE_UP_PRESSES):
+        recorder.record_frame(FRAME_TIME, mouse)
+        recorder.record_event('page_up')
+        base.onKeyboardPageUpPressed()
+    squares = [screen_position(base, index) for index in range(64)]
+    base.axisCameraPitching.setHpr(pitch)
+
+    def glide(target, frames):
+        x0, y0 = mouse
+        for k in range(1, frames + 1):
+            recorder.record_frame(FRAME_TIME, (x0 + (target[0] - x0) * k / frames, y0 + (target[1] - y0) * k / frames))
+        return target
+
+    for text in moves:
+        fr = gamearena.parse_coordinate_square(arena, text[:2])
+        to = gamearena.parse_coordinate_square(arena, text[2:])
+        mouse = glide(squares[fr], framesPerDrag)
+        mouse = glide(mouse, SETTLE_FRAMES)
+        recorder.record_event('mouse1')
+        mouse = glide(squares[to], framesPerDrag)
+        mouse = glide(mouse, SETTLE_FRAMES)
+        recorder.record_event('mouse1-up')
+        mouse = glide(mouse, idleFrames)
+        arena.move_unit_to_index(arena.find_unit_id_on_index(fr), to)
+    frames = recorder.frames
+    recorder.close(gamearena.fen_of_arena(arena, side_to_move=players[len(moves) % 2]))
+    return frames
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames-per-drag', type=int, default=30)
+    parser.add_argument('--idle-frames', type=int, default=30)
+    parser.add_argument('--size', default='800x600', help='离屏窗口大小')
+    parser.add_argument('--display', default='p3tinydisplay')
+    parser.add_argument('--save', metavar='PATH', help='保存合成的录制文件')
+    args = parser.parse_args(argv)
+
+    width, height = [int(n) for n in args.size.split('x')]
+    panda3d.core.loadPrcFileData('', '\n'.join([
+        'load-display {}'.format(args.display),
+        'audio-library-name null',
+        'win-size {} {}'.format(width, height),
+        'model-path {}'.format(ROOT_DIR),
+    ]))
+    import gamegui
+    base = gamegui.MyChessboard(fStartDirect=False, windowType='offscreen')
+    gamegui.attach_default_lights(base.render)
+
+    path = args.save or os.path.join(tempfile.mkdtemp(prefix='bench_replay_'), 'bench.input')
+    synthesize(base, path, MOVES, args.frames_per_drag, args.idle_frames)
+    print('{} plies, recording {} bytes'.format(len(MOVES), os.path.getsize(path)))
+    report = gamerecord.replay(base, gamerecord.read_recording(path))
+    print(gamerecord.format_report(report))
+    if not args.save:
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+    return 0 if report.matched else 1
+
+
+if '__main__' == __name__:
+    sys.exit(main())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""gameserver 压力测试: 在本机启动服务器子进程, 多个连接以流水线方式发送走法查询和走棋请求
+
+Usage:
+    python benchmarks/bench_server_load.py [--connections 8] [--sessions 4000] [--pipeline 32] [--duration 10]
+
+输出每秒请求数以及 p50/p99 延迟(从发出请求到收到应答).
+"""
+from __future__ import print_function
+
+import argparse
+import asyncio
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import gameserver
+
+
+class LoadClient(asyncio.Protocol):
+    """一个连接: 先创建若干会话, 然后保持 pipeline 个请求在途, 直到测试结束"""
+
+    def __init__(self, sessions, pipeline, deadline, latencies, rng):
+        self.__decoder = gameserver.FrameDecoder()
+        self.__sessions_wanted = sessions
+        self.__sessions = []
+        self.__pipeline = pipeline
+        self.__deadline = deadline
+        self.__latencies = latencies
+        self.__rng = rng
+        self.__sent = {}  # request_id -> (发送时间, 会话编号, 操作码, 起点格子)
+        self.__next_request = 1
+        self.__transport = None
+        self.done = asyncio.get_running_loop().create_future()
+
+    def connection_made(self, transport):
+        self.__transport = transport
+        frames = []
+        for k in range(self.__sessions_wanted):
+            frames.append(self.__request(gameserver.OP_NEW, 0, b''))
+        transport.write(b''.join(frames))
+
+    def data_received(self, data):
+        frames = []
+        now = time.perf_counter()
+        for payload in self.__decoder.feed(data):
+            opcode, request_id, status = gameserver.RESPONSE_HEADER.unpack_from(payload)
+            sent, session_id, op, fr = self.__sent.pop(request_id)
+            body = payload[gameserver.RESPONSE_HEADER.size:]
+            if opcode == gameserver.OP_NEW:
+                self.__sessions.append(gameserver.SESSION.unpack(body)[0])
+                if len(self.__sessions) == self.__sessions_wanted:
+                    frames += [self.__next_load_request() for k in range(self.__pipeline)]
+                continue
+            self.__latencies.append(now - sent)
+            if now >= self.__deadline:
+                continue
+            if opcode == gameserver.OP_QUERY and status == gameserver.STATUS_OK and body and self.__rng.random() < 0.1:
+                to = self.__rng.choice(gameserver.decode_squares(body))
+                frames.append(self.__request(gameserver.OP_MOVE, session_id, gameserver.MOVE.pack(fr, to), fr))
+            else:
+                frames.append(self.__next_load_request())
+        if frames:
+            self.__transport.write(b''.join(frames))
+        elif not self.__sent and not self.done.done():
+            self.done.set_result(None)
+
+    def __next_load_request(self):
+        session_id = self.__rng.choice(self.__sessions)
+        fr = self.__rng.randrange(64)
+        return self.__request(gameserver.OP_QUERY, session_id, gameserver.SQUARE.pack(fr), fr)
+
+    def __request(self, opcode, session_id, body, fr=0):
+        request_id = self.__next_request
+        self.__next_request += 1
+        self.__sent[request_id] = (time.perf_counter(), session_id, opcode, fr)
+        return gameserver.encode_request(opcode, session_id, request_id, body)
+
+
+async def run_load(host, port, connections, sessions, pipeline, duration):
+    loop = asyncio.get_running_loop()
+    latencies = []
+    start = time.perf_counter()
+    deadline = start + duration
+    clients = []
+    for k in range(connections):
+        transport, client = await loop.create_connection(
+            lambda: LoadClient(sessions // connections, pipeline, deadline, latencies, random.Random(k)), host, port)
+        clients.append((transport, client))
+    await asyncio.gather(*[client.done for transport, client in clients])
+    elapsed = time.perf_counter() - start
+    for transport, client in clients:
+        transport.close()
+    return latencies, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--connections', type=int, default=8)
+    parser.add_argument('--sessions', type=int, default=4000, help='全部连接共创建的会话数量')
+    parser.add_argument('--pipeline', type=int, default=32, help='每个连接同时在途的请求数量')
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args(argv)
+
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT_DIR, 'gameserver.py'), '--port', '0'],
+                              stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        line = server.stdout.readline()
+        port = int(re.search(r', (\d+)\)', line).group(1))
+        latencies, elapsed = asyncio.run(run_load(
+            '127.0.0.1', port, args.connections, args.sessions, args.pipeline, args.duration))
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies.sort()
+    n = len(latencies)
+    print('{} requests in {:.2f} s: {:.0f} requests/s'.format(n, elapsed, n / elapsed))
+    print('latency p50 {:.3f} ms, p99 {:.3f} ms, max {:.3f} ms'.format(
+        latencies[n // 2] * 1e3, latencies[min(n - 1, int(n * 0.99))] * 1e3, latencies[-1] * 1e3))
+
+
+if '__main__' == __name__:
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""多进程局面分析的吞吐量: pickle 传输 GameArena 与共享内存环形缓冲区(gameshm)对比
+
+Usage:
+    python benchmarks/bench_shm.py [--games 20] [--plies 80] [--workers 4] [--depth 0] [--slots 64]
+
+局面来自随机对局, 分两组测量:
+    warm   走法缓存已经填满(与对局过程中的 GameArena 相同), pickle 会把缓存一起传过去, 工作进程不必重新计算
+    cold   同样的局面重新构造, 没有走法缓存(例如从棋谱或数据库读出的局面)
+两种方式使用同一个分析函数:
+    pickle     ProcessPoolExecutor.map((arena, player)), chunksize 为 1 和 16
+    shm        gameshm.AnalysisPool.analyze_stream(), 局面写成固定布局的二进制记录
+报告每秒分析的局面数量和每个局面传输的字节数, 并核对两种方式的结果一致.
+--depth 0 时只做静态评估和合法走法统计, 传输开销占比最大.
+"""
+from __future__ import print_function
+
+import argparse
+import concurrent.futures
+import os
+import pickle
+import random
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import gamearena
+import gameengine
+import gameshm
+
+WHITE = gamearena.GameArena.PlayerID(1)
+BLACK = gamearena.GameArena.PlayerID(2)
+
+_engine = None
+
+
+def collect_positions(games, plies):
+    """:return: [(arena, 走棋一方)], 沿着对局逐步复制, 每个局面各自一个 arena"""
+    rng = random.Random(44)
+    positions = []
+    for g in range(games):
+        arena = gamearena.new_standard_chess_arena()
+        player, other = WHITE, BLACK
+        for ply in range(plies):
+            legal = arena.retrieve_packed_legal_moves(player)
+            positions.append((arena, player))
+            if not legal:
+                break
+            arena = arena.copy()
+            gameengine.apply_move(arena, rng.choice(legal))
+            player, other = other, player
+    return positions
+
+
+def cold_positions(positions):
+    """同样的局面重新构造一遍, 没有走法缓存"""
+    buf = memoryview(bytearray(gameshm.SLOT_SIZE))
+    result = []
+    for arena, player in positions:
+        gameshm.encode_position(buf, 0, arena, player)
+        result.append(gameshm.decode_position(buf, 0))
+    return result
+
+
+def _init_worker():
+    global _engine
+    _engine = gameengine.Engine(depth=1, tt_size=0)
+
+
+def _analyze_pickled(task):
+    arena, player, depth = task
+    return gameshm.analyze(arena, player, _engine, depth)
+
+
+def run_pickle(positions, workers, depth, chunksize):
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        executor.submit(_analyze_pickled, positions[0] + (depth,)).result()  # 等工作进程启动
+        started = time.perf_counter()
+        results = list(executor.map(_analyze_pickled, [(arena, player, depth) for arena, player in positions],
+                                    chunksize=chunksize))
+        return time.perf_counter() - started, results
+
+
+def run_shm(positions, workers, depth, slots):
+    with gameshm.AnalysisPool(workers=workers, slots=slots, depth=depth) as pool:
+        list(pool.analyze_stream(positions[:1]))  # 等工作进程启动
+        started = time.perf_counter()
+        results = [tuple(result[1:]) for result in pool.analyze_stream(iter(positions))]
+        return time.perf_counter() - started, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=20)
+    parser.add_argument('--plies', type=int, default=80)
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument('--depth', type=int, default=0)
+    parser.add_argument('--slots', type=int, default=64)
+    args = parser.parse_args(argv)
+
+    positions = collect_positions(args.games, args.plies)
+
+    print('{} positions, {} workers, depth {}'.format(len(positions), args.workers, args.depth))
+    print('{:>6} {:>10} {:>10} {:>12} {:>12} {:>10}'.format(
+        'cache', 'path', 'seconds', 'positions/s', 'bytes/pos', 'mismatch'))
+    for cache, batch in (('warm', positions), ('cold', cold_positions(positions))):
+        pickled = sum(len(pickle.dumps((arena, player, args.depth), pickle.HIGHEST_PROTOCOL))
+                      for arena, player in batch) / float(len(batch))
+        rows = []
+        for chunksize in (1, 16):
+            elapsed, results = run_pickle(batch, args.workers, args.depth, chunksize)
+            rows.append(('pickle/{}'.format(chunksize), elapsed, pickled, results))
+        elapsed, results = run_shm(batch, args.workers, args.depth, args.slots)
+        rows.append(('shm', elapsed, float(gameshm.SLOT_SIZE), results))
+
+        expected = [tuple(result) for result in rows[0][3]]
+        for name, elapsed, size, results in rows:
+            mismatches = sum(1 for a, b in zip(expected, results) if tuple(a) != tuple(b))
+            print('{:>6} {:>10} {:>10.3f} {:>12.0f} {:>12.0f} {:>10}'.format(
+                cache, name, elapsed, len(batch) / elapsed, size, mismatches))
+
+
+if '__main__' == __name__:
+    main()
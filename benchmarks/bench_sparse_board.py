@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""对比稠密与稀疏两种棋盘存储方式在不同棋盘尺寸下的开销
+
+Usage:
+    python benchmarks/bench_sparse_board.py [--sizes 8 16 64 256 1024] [--units 32] [--rounds 20]
+
+每种尺寸随机摆放相同的一组棋子(車、象、后、马、王各若干), 分别测量:
+    build   创建竞技场并摆放全部棋子
+    snap    生成一次快照
+    moves   用同一份快照计算全部棋子的走法
+    find    按编码查找全部棋子所在格子
+    memory  竞技场占用的内存(tracemalloc)
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import gamearena
+
+UNIT_TYPES = [gamearena.RookUnit, gamearena.BishopUnit, gamearena.QueenUnit, gamearena.KnightUnit,
+              gamearena.KingUnit]
+
+
+def build_arena(size, placement, sparse):
+    arena = gamearena.GameArena(width=size, ranks=size, sparse=sparse)
+    for k, square in enumerate(placement):
+        player = gamearena.GameArena.PlayerID(1 + k % 2)
+        arena.new_unit_recruited_by_player(player, square, UNIT_TYPES[k % len(UNIT_TYPES)])
+    return arena
+
+
+def measure(size, units, rounds, sparse):
+    rng = random.Random(size)
+    placement = rng.sample([gamearena.Square(x, y) for y in range(size) for x in range(size)], units) \
+        if size * size <= 1 << 16 else \
+        list(set(gamearena.Square(rng.randrange(size), rng.randrange(size)) for k in range(units)))
+
+    tracemalloc.start()
+    arena = build_arena(size, placement, sparse)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    timings = {'build': [], 'snap': [], 'moves': [], 'find': []}
+    for r in range(rounds):
+        started = time.perf_counter()
+        arena = build_arena(size, placement, sparse)
+        timings['build'].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        snapshot = arena._GameArena__take_snapshot()
+        timings['snap'].append(time.perf_counter() - started)
+
+        on_board = arena.retrieve_units_on_board()
+        started = time.perf_counter()
+        for unit_id, square, unit in on_board:
+            unit.retrieve_valid_moves(square, snapshot.copy() if isinstance(unit, gamearena.KingUnit) else snapshot)
+        timings['moves'].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for unit_id, square, unit in on_board:
+            arena.find_square_from_unit_id(unit_id)
+        timings['find'].append(time.perf_counter() - started)
+    return dict((name, sorted(values)[len(values) // 2] * 1e3) for name, values in timings.items()), memory
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[8, 16, 64, 256, 1024])
+    parser.add_argument('--units', type=int, default=32)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    print('{:>6} {:>7} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'size', 'backend', 'build ms', 'snap ms', 'moves ms', 'find ms', 'memory KB'))
+    for size in args.sizes:
+        for sparse in (False, True):
+            rounds = args.rounds if sparse or size <= 256 else max(1, args.rounds // 10)
+            median, memory = measure(size, args.units, rounds, sparse)
+            print('{:>6} {:>7} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.1f}'.format(
+                size, 'sparse' if sparse else 'dense', median['build'], median['snap'], median['moves'],
+                median['find'], memory / 1024.0))
+
+
+if '__main__' == __name__:
+    main()
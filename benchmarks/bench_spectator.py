@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*-encoding:utf8;-*-
+"""观战墙帧率测试: 在没有 GPU 的软件渲染器上逐步增加棋盘数量, 找出能维持目标帧率的最大棋盘数
+
+Usage:
+    LIBGL_ALWAYS_SOFTWARE=1 python benchmarks/bench_spectator.py [--target-fps 30] [--boards 16 32 48 64]
+
+默认目标帧率为 30 fps, 窗口大小 1280x720, 使用 EGL 离屏渲染(p3headlessgl), 在无显示器的 Linux 上由 Mesa
+llvmpipe 软件光栅化. 每一帧随机挑选 --moves-per-frame 个棋盘各走一步随机的走法, 其余棋盘保持不变.
+
+参考数据(单核 CPU, Mesa llvmpipe, 1280x720, 每帧 4 个棋盘走棋):
+     4 boards: 45 fps    8 boards: 24 fps    16 boards: 13 fps    64 boards: 4 fps
+绘制调用只有 6~15 次, 瓶颈在于软件光栅化的顶点处理(每盘约 2.5 万个棋子顶点), 与棋盘数量成正比.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+
+def random_move(arena, rng):
+    """随机挑选一个棋子走一步, 棋子太少时返回 False 表示需要重新开局"""
+    units = arena.retrieve_units_on_board()
+    if len(units) < 4:
+        return False
+    for k in range(8):
+        unit_id, square, unit = rng.choice(units)
+        moves = arena.retrieve_valid_moves_of_unit(unit_id)
+        if moves:
+            arena.move_unit_to_somewhere(unit_id, rng.choice(moves))
+            return True
+    return True
+
+
+def measure(wall, rng, frames, moves_per_frame):
+    import gamearena
+    boards = wall.boards
+    for k in range(10):  # 预热: 着色器编译、首帧提交全部棋盘
+        wall.taskMgr.step()
+    start = time.perf_counter()
+    for frame in range(frames):
+        for k in range(moves_per_frame):
+            board = rng.choice(boards)
+            if not random_move(board.arena, rng):
+                board.arena = gamearena.new_standard_chess_arena()
+            wall.notifyChanged(board.key)
+        wall.taskMgr.step()
+    return frames / (time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--boards', type=int, nargs='+', default=[4, 8, 16, 32, 64])
+    parser.add_argument('--target-fps', type=float, default=30.0)
+    parser.add_argument('--frames', type=int, default=120)
+    parser.add_argument('--moves-per-frame', type=int, default=4)
+    parser.add_argument('--win-size', default='1280 720')
+    parser.add_argument('--display', default='p3headlessgl', help='例如 p3headlessgl, pandagl; p3tinydisplay 不支持 shader, 棋子改用合并几何体绘制')
+    args = parser.parse_args(argv)
+
+    import panda3d.core
+    panda3d.core.loadPrcFileData('', '\n'.join([
+        'load-display {}'.format(args.display),
+        'audio-library-name null',
+        'win-size {}'.format(args.win_size),
+        'sync-video false',
+        'model-path {}'.format(ROOT_DIR),
+    ]))
+    import gamearena
+    import gamespectator
+
+    rng = random.Random(2017)
+    best = 0
+    for count in args.boards:
+        wall = gamespectator.SpectatorWall([gamearena.new_standard_chess_arena() for k in range(count)],
+                                           windowType='offscreen')
+        renderer = wall.win.getGsg().getDriverRenderer()
+        fps = measure(wall, rng, args.frames, args.moves_per_frame)
+        print('{:3d} boards: {:7.1f} fps, {} draw calls ({})'.format(count, fps, wall.getNumDrawCalls(), renderer))
+        if fps >= args.target_fps:
+            best = max(best, count)
+        wall.destroy()
+    print('target {:.0f} fps: up to {} boards'.format(args.target_fps, best))
+
+
+if '__main__' == __name__:
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""UCI 适配器的命令-回复延迟: 在子进程中运行 uci.py, 通过管道发送命令并计时
+
+Usage:
+    python benchmarks/bench_uci.py [--plies 80] [--repeat 200]
+
+测量项目(毫秒):
+    isready idle      空闲时 isready -> readyok
+    isready search    go infinite 搜索期间 isready -> readyok
+    stop              go infinite 搜索期间 stop -> bestmove
+    position incr     随机对局逐步发送 position startpos moves ..., 每次只比上一次多一步, 再 isready -> readyok
+    position full     同上, 但每次之前先发送 ucinewgame, 迫使适配器从头重放全部走法
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import gamearena
+import uci
+
+
+class UciProcess(object):
+    def __init__(self):
+        self.process = subprocess.Popen([sys.executable, os.path.join(ROOT_DIR, 'uci.py')],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        universal_newlines=True, bufsize=1)
+
+    def send(self, command):
+        self.process.stdin.write(command + '\n')
+        self.process.stdin.flush()
+
+    def wait_for(self, prefix):
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                raise EOFError('uci.py exited')
+            if line.startswith(prefix):
+                return line
+
+    def round_trip(self, commands, prefix):
+        """:return: 发送第一条命令到收到以 prefix 开头的回复的时间(毫秒)"""
+        started = time.perf_counter()
+        for command in commands:
+            self.send(command)
+        self.wait_for(prefix)
+        return (time.perf_counter() - started) * 1e3
+
+    def close(self):
+        self.send('quit')
+        self.process.wait()
+
+
+def random_game(plies):
+    """:return: UCI 走法字符串列表"""
+    rng = random.Random(43)
+    arena = gamearena.new_standard_chess_arena()
+    side, other = gamearena.WHITE, gamearena.BLACK
+    moves = []
+    for ply in range(plies):
+        legal = arena.retrieve_packed_legal_moves(side)
+        if not legal:
+            break
+        move = rng.choice(legal)
+        moves.append(uci.format_uci_move(arena, move))
+        fr, to, flags = gamearena.unpack_move(move)
+        arena.move_unit_to_index(arena.find_unit_id_on_index(fr), to)
+        side, other = other, side
+    return moves
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return sum(samples) / len(samples), samples[len(samples) // 2], samples[-1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--plies', type=int, default=80)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    moves = random_game(args.plies)
+    engine = UciProcess()
+    try:
+        engine.round_trip(['uci'], 'uciok')
+        rows = [('isready idle', [engine.round_trip(['isready'], 'readyok') for k in range(args.repeat)])]
+
+        busy, stops = [], []
+        for k in range(max(1, args.repeat // 20)):
+            engine.send('position startpos')
+            engine.send('go infinite')
+            time.sleep(0.05)
+            busy.extend(engine.round_trip(['isready'], 'readyok') for j in range(20))
+            stops.append(engine.round_trip(['stop'], 'bestmove'))
+        rows.append(('isready search', busy))
+        rows.append(('stop', stops))
+
+        incremental = []
+        engine.round_trip(['ucinewgame', 'isready'], 'readyok')
+        for n in range(1, len(moves) + 1):
+            incremental.append(engine.round_trip(
+                ['position startpos moves ' + ' '.join(moves[:n]), 'isready'], 'readyok'))
+        rows.append(('position incr', incremental))
+
+        full = []
+        for n in range(1, len(moves) + 1):
+            engine.round_trip(['ucinewgame', 'isready'], 'readyok')
+            full.append(engine.round_trip(['position startpos moves ' + ' '.join(moves[:n]), 'isready'], 'readyok'))
+        rows.append(('position full', full))
+    finally:
+        engine.close()
+
+    print('{} plies'.format(len(moves)))
+    print('{:>16} {:>8} {:>10} {:>10} {:>10}'.format('command', 'samples', 'mean ms', 'p50 ms', 'max ms'))
+    for name, samples in rows:
+        mean, p50, maximum = summarize(samples)
+        print('{:>16} {:>8} {:>10.3f} {:>10.3f} {:>10.3f}'.format(name, len(samples), mean, p50, maximum))
+
+
+if '__main__' == __name__:
+    main()
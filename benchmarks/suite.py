@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""基准测试套件: 规则引擎和 3D 客户端的性能数据, 结果写成 JSON, 并可与基线对比找出性能退化
+
+Usage:
+    python benchmarks/suite.py run [--output results.json] [--only rules|client] [--repeat 7] [--quick]
+    python benchmarks/suite.py compare BASELINE.json CURRENT.json [--threshold 0.10] [--statistic min|median]
+
+run 的测量项目(数值越小越好, 每项重复 --repeat 轮, 记录最小值和中位数):
+    rules.valid_moves.<单位类型>  us    unit.retrieve_valid_moves(square, snapshot) 每次调用
+    rules.take_snapshot            us    GameArena.__take_snapshot() 每次调用
+    rules.find_square_from_unit_id us    每次调用
+    rules.movegen_pseudo           us    清空走法缓存后计算一方全部伪合法走法, 每个局面
+    rules.movegen_legal            us    同上, 包括将军/牵制过滤
+    rules.arena_bytes              bytes tracemalloc 统计的每个标准开局 GameArena 的内存, 走法缓存已填满
+    client.startup                 ms    新进程中 import gamegui 并创建离屏 MyChessboard 的耗时
+    client.mouse_task              us    离屏模式下 mouseTask 每帧的耗时, 合成的鼠标停在 e1 的白王上(拾取和高亮)
+    client.frame                   us    离屏模式下 taskMgr.step() 一帧的耗时(软件渲染)
+没有安装 panda3d 时跳过 client 项目. JSON 中同时记录机器信息和 git 版本, 便于判断两份结果能否对比.
+
+compare 逐项计算 (当前 - 基线) / 基线, 超过 --threshold 的项目视为退化, 存在退化时退出码为 1.
+默认比较每项的最小值: 其他进程的干扰只会让耗时变长, 最小值比中位数稳定得多.
+"""
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import gamearena
+
+WHITE = gamearena.GameArena.PlayerID(1)
+BLACK = gamearena.GameArena.PlayerID(2)
+FORMAT_VERSION = 1
+
+
+def collect_positions(games, plies):
+    """:return: [(arena, 走棋一方)], 随机对局(只走合法走法)中出现的局面"""
+    rng = random.Random(45)
+    positions = []
+    for g in range(games):
+        arena = gamearena.new_standard_chess_arena()
+        player, other = WHITE, BLACK
+        for ply in range(plies):
+            legal = arena.retrieve_packed_legal_moves(player)
+            positions.append((arena, player))
+            if not legal:
+                break
+            arena = arena.copy()
+            fr, to, flags = gamearena.unpack_move(rng.choice(legal))
+            arena.move_unit_to_index(arena.find_unit_id_on_index(fr), to)
+            player, other = other, player
+    return positions
+
+
+def per_call(calls, repeat):
+    """:param calls: 无参数函数的列表; :return: 每轮的平均耗时(微秒)列表"""
+    for call in calls[:100]:
+        call()  # 预热
+    samples = []
+    gc.disable()
+    try:
+        for k in range(repeat):
+            started = time.perf_counter()
+            for call in calls:
+                call()
+            samples.append((time.perf_counter() - started) / len(calls) * 1e6)
+    finally:
+        gc.enable()
+    return samples
+
+
+def bench_valid_moves(positions, repeat):
+    """每种单位类型分别测量; 王会从快照中删除自己, 所以王的每次调用都用一份副本, 并扣除复制的耗时"""
+    calls = {}
+    copies = []
+    for arena, player in positions:
+        snapshot = arena._GameArena__take_snapshot()
+        for unit_id, square, unit in arena.retrieve_units_on_board():
+            name = type(unit).__name__
+            if unit.depends_on_whole_board:
+                calls.setdefault(name, []).append(
+                    lambda f=unit.retrieve_valid_moves, a=square, s=snapshot: f(a, s.copy()))
+                copies.append(snapshot.copy)
+            else:
+                calls.setdefault(name, []).append(lambda f=unit.retrieve_valid_moves, a=square, s=snapshot: f(a, s))
+    copy_cost = min(per_call(copies, repeat)) if copies else 0.0
+    results = {}
+    for name, unit_calls in sorted(calls.items()):
+        samples = per_call(unit_calls, repeat)
+        if name == 'KingUnit':
+            samples = [sample - copy_cost for sample in samples]
+        results['rules.valid_moves.' + name] = ('us', samples)
+    return results
+
+
+def bench_rules(repeat, quick):
+    positions = collect_positions(4 if quick else 20, 40 if quick else 80)
+    results = bench_valid_moves(positions, repeat)
+    results['rules.take_snapshot'] = ('us', per_call(
+        [arena._GameArena__take_snapshot for arena, player in positions], repeat))
+
+    lookups = []
+    for arena, player in positions:
+        for unit_id, square, unit in arena.retrieve_units_on_board():
+            lookups.append(lambda f=arena.find_square_from_unit_id, u=unit_id: f(u))
+    results['rules.find_square_from_unit_id'] = ('us', per_call(lookups, repeat))
+
+    for name, query in (('pseudo', 'retrieve_packed_moves'), ('legal', 'retrieve_packed_legal_moves')):
+        def generate(arena, player, query=query):
+            arena._GameArena__valid_moves.clear()
+            arena._GameArena__legality = (None, {})
+            return getattr(arena, query)(player)
+        results['rules.movegen_' + name] = ('us', per_call(
+            [lambda a=arena, p=player: generate(a, p) for arena, player in positions], repeat))
+
+    samples = []
+    count = 20 if quick else 100
+    for k in range(repeat):
+        gc.collect()
+        tracemalloc.start()
+        arenas = []
+        for i in range(count):
+            arena = gamearena.new_standard_chess_arena()
+            arena.retrieve_all_valid_moves()
+            arenas.append(arena)
+        samples.append(tracemalloc.get_traced_memory()[0] / float(count))
+        tracemalloc.stop()
+        del arenas
+    results['rules.arena_bytes'] = ('bytes', samples)
+    return results
+
+
+CLIENT_SCRIPT = r'''
+import json, sys, time
+started = time.perf_counter()
+import panda3d.core
+panda3d.core.loadPrcFileData('', 'load-display p3tinydisplay\naudio-library-name null\nmodel-path {root}')
+sys.path.insert(0, {root!r})
+import gamegui
+base = gamegui.MyChessboard(fStartDirect=False, windowType='offscreen')
+startup = (time.perf_counter() - started) * 1e3
+result = {{'startup': startup}}
+if {frames}:
+    import gamerecord
+    # 离屏窗口没有鼠标, 与重放录制时一样由 InputPlayback 提供鼠标位置,
+    # 停在 e1 格子中心的投影上: 白王离镜头最近, 不会被其他棋子挡住, 每帧都走拾取和高亮的路径
+    topCenter = base.render.find('**/chessboardTopCenter')
+    point = base.cam.getRelativePoint(topCenter, panda3d.core.LPoint3(4 - 3.5, 0 - 3.5, 0))
+    screen = panda3d.core.LPoint2()
+    base.camLens.project(point, screen)
+    playback = gamerecord.InputPlayback()
+    playback.mouse = (screen.getX(), screen.getY())
+    base.setInputSource(playback)
+    for k in range(10):
+        base.taskMgr.step()
+    frames = []
+    mouse = []
+    for k in range({frames}):
+        t = time.perf_counter()
+        base.taskMgr.step()
+        frames.append((time.perf_counter() - t) * 1e6)
+        t = time.perf_counter()
+        base.mouseTask(None)
+        mouse.append((time.perf_counter() - t) * 1e6)
+    frames.sort()
+    mouse.sort()
+    result['frame'] = frames[len(frames) // 2]
+    result['mouse_task'] = mouse[len(mouse) // 2]
+print(json.dumps(result))
+'''
+
+
+def run_client_process(frames):
+    output = subprocess.check_output(
+        [sys.executable, '-c', CLIENT_SCRIPT.format(root=ROOT_DIR, frames=frames)],
+        stderr=subprocess.DEVNULL, universal_newlines=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def bench_client(repeat, quick):
+    """ShowBase 每个进程只能创建一次, 每一轮都在新进程中测量"""
+    frames = 50 if quick else 300
+    startup, frame, mouse = [], [], []
+    for k in range(repeat):
+        result = run_client_process(frames)
+        startup.append(result['startup'])
+        frame.append(result['frame'])
+        mouse.append(result['mouse_task'])
+    return {
+        'client.startup': ('ms', startup),
+        'client.frame': ('us', frame),
+        'client.mouse_task': ('us', mouse),
+    }
+
+
+def has_panda3d():
+    try:
+        import panda3d.core
+    except ImportError:
+        return False
+    return True
+
+
+def machine_metadata():
+    metadata = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'hostname': platform.node(),
+    }
+    try:
+        metadata['git_commit'] = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR, stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+        metadata['git_dirty'] = bool(subprocess.check_output(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT_DIR, stderr=subprocess.DEVNULL,
+            universal_newlines=True).strip())
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    if has_panda3d():
+        import panda3d.core
+        metadata['panda3d'] = panda3d.core.PandaSystem.getVersionString()
+    return metadata
+
+
+def median(samples):
+    samples = sorted(samples)
+    n = len(samples)
+    return samples[n // 2] if n % 2 else (samples[n // 2 - 1] + samples[n // 2]) / 2.0
+
+
+def run(args):
+    benchmarks = {}
+    if args.only in (None, 'rules'):
+        benchmarks.update(bench_rules(args.repeat, args.quick))
+    if args.only in (None, 'client'):
+        if has_panda3d():
+            benchmarks.update(bench_client(args.repeat, args.quick))
+        else:
+            print('panda3d not installed, skipping client benchmarks', file=sys.stderr)
+    report = {
+        'format': FORMAT_VERSION,
+        'metadata': machine_metadata(),
+        'benchmarks': dict((name, {'unit': unit, 'min': min(samples), 'median': median(samples), 'samples': samples})
+                           for name, (unit, samples) in benchmarks.items()),
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print('{:<36} {:>12} {:>12} {:>6}'.format('benchmark', 'min', 'median', 'unit'))
+    for name, entry in sorted(report['benchmarks'].items()):
+        print('{:<36} {:>12.3f} {:>12.3f} {:>6}'.format(name, entry['min'], entry['median'], entry['unit']))
+    print('results saved to {}'.format(args.output))
+    return 0
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    for key in ('machine', 'cpu_count', 'python', 'hostname'):
+        a, b = baseline['metadata'].get(key), current['metadata'].get(key)
+        if a != b:
+            print('warning: {} differs: {} vs {}'.format(key, a, b))
+    regressions = 0
+    statistic = args.statistic
+    print('{:<36} {:>12} {:>12} {:>8}'.format('benchmark', 'baseline', 'current', 'change'))
+    for name in sorted(set(baseline['benchmarks']) | set(current['benchmarks'])):
+        old, new = baseline['benchmarks'].get(name), current['benchmarks'].get(name)
+        if old is None or new is None:
+            print('{:<36} {:>12} {:>12} {:>8}'.format(
+                name, '-' if old is None else '{:.3f}'.format(old[statistic]),
+                '-' if new is None else '{:.3f}'.format(new[statistic]), 'n/a'))
+            continue
+        change = (new[statistic] - old[statistic]) / old[statistic] if old[statistic] else 0.0
+        flag = ''
+        if change > args.threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        elif change < -args.threshold:
+            flag = '  improved'
+        print('{:<36} {:>12.3f} {:>12.3f} {:>+7.1%}{}'.format(name, old[statistic], new[statistic], change, flag))
+    print('{} regression(s) beyond {:.0%}'.format(regressions, args.threshold))
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    run_parser = commands.add_parser('run', help='运行基准测试并保存 JSON')
+    run_parser.add_argument('--output', default='benchmark-results.json')
+    run_parser.add_argument('--only', choices=('rules', 'client'))
+    run_parser.add_argument('--repeat', type=int, default=7)
+    run_parser.add_argument('--quick', action='store_true', help='缩小测量规模, 用于快速检查')
+    compare_parser = commands.add_parser('compare', help='对比两份 JSON 结果')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.10, help='相对变化超过该比例视为退化')
+    compare_parser.add_argument('--statistic', choices=('min', 'median'), default='min')
+    args = parser.parse_args(argv)
+    return run(args) if args.command == 'run' else compare(args)
+
+
+if '__main__' == __name__:
+    sys.exit(main())
@@ -1,16 +1,283 @@
 # coding=utf-8
+import array
 import collections
+import itertools
 
 Vector = collections.namedtuple('Vector', ['dx', 'dy'])
 
 Square = collections.namedtuple('Square', ['x', 'y'])
 
+# 规则引擎内部用整数表示格子: index = x + y * 棋盘宽度, Square 只在对外接口上使用
+# 一步棋打包成一个整数: 起点 | 终点 << MOVE_SQUARE_BITS | 标志 << (2 * MOVE_SQUARE_BITS)
+MOVE_SQUARE_BITS = 24
+MOVE_SQUARE_MASK = (1 << MOVE_SQUARE_BITS) - 1
+MOVE_FLAG_CAPTURE = 1
+
+
+def pack_move(fr, to, flags=0):
+    """
+    :param fr: 起点格子编号
+    :param to: 终点格子编号
+    :param flags: MOVE_FLAG_* 的组合
+    :rtype : int
+    """
+    return fr | to << MOVE_SQUARE_BITS | flags << (2 * MOVE_SQUARE_BITS)
+
+
+def unpack_move(move):
+    """
+    :return: 起点格子编号, 终点格子编号, 标志
+    :rtype : int, int, int
+    """
+    return move & MOVE_SQUARE_MASK, (move >> MOVE_SQUARE_BITS) & MOVE_SQUARE_MASK, move >> (2 * MOVE_SQUARE_BITS)
+
+
+def index_typecode(xmax, ymax):
+    """存放格子编号的 array 类型: 不超过 65536 格的棋盘用 'H', 更大的棋盘用 'L'"""
+    return 'H' if xmax * ymax <= 0x10000 else 'L'
+
+
+# 单位类型注册表: 类型编码 -> 单位类型, 编码是从 1 开始的小整数, 0 表示未注册的(抽象)类型
+UNIT_TYPES = [None]
+
+# 单位走到某个格子之后调用的钩子: 类型编码 -> hook(unit, index, xmax, ymax)
+# 钩子返回一个新的单位实例时, 由它替换原来的单位(例如兵升变为后), 返回 None 则不变
+UNIT_ARRIVAL_HOOKS = {}
+
+
+def register_unit_type(unit_type):
+    """类装饰器, 为单位类型分配类型编码
+
+    :rtype : type
+    """
+    unit_type.type_code = len(UNIT_TYPES)
+    UNIT_TYPES.append(unit_type)
+    return unit_type
+
 
 class Unit(object):
+    # 走法描述由同一类型的全部单位共用, 在类上定义为不可变的元组, 不在每个实例中另外保存
+    __slots__ = ('owner', 'has_been_moved')
+    type_code = 0  # 见 register_unit_type()
+    directions = ()  # 用一组 Vector 矢量描述棋子可以朝哪些方向走
+    limited_move_range = 0  # 用负数或 0 代表不限制棋子最大移动格数, 用正整数 N 代表棋子最大移动距离(倍数 N)
+    depends_on_whole_board = False  # 为 True 时走法不只取决于线路上的格子, 每步棋之后都要重新计算(王)
+    royal = False  # 为 True 时该单位不能被将军, 其余单位的合法走法都要保护它(王), 见 LegalityFilter
+    _rays = None  # 缓存 (xmax, ymax, 射线表), 见 retrieve_rays(), 同一类型的全部单位共用
+
     def __init__(self, owner):
         self.owner = owner  # 所属玩家
         self.has_been_moved = None  # None 表示未知棋子当前状态是否已经走过
 
+    def clone(self):
+        """复制单位的状态, 不经过 __init__()
+
+        :rtype : Unit
+        """
+        other = object.__new__(type(self))
+        other.owner = self.owner
+        other.has_been_moved = self.has_been_moved
+        return other
+
+    def retrieve_rays(self, starting_index, snapshot):
+        """按 self.directions 和 self.limited_move_range 查预先计算好的射线表
+
+        :param starting_index: 当前位置的格子编号
+        :return: 每个方向一条射线, 射线是从近到远排列的格子编号, 已经截掉了棋盘外和超出射程的部分
+        :rtype : tuple
+        """
+        rays = self._rays
+        if rays is None or rays[0] != snapshot.xmax or rays[1] != snapshot.ymax:
+            table = ray_table(snapshot.xmax, snapshot.ymax, self.directions, self.limited_move_range)
+            rays = type(self)._rays = (snapshot.xmax, snapshot.ymax, table)
+        return rays[2][starting_index]
+
+    # 以下几个方法以格子编号为参数和结果, 子类必须实现 retrieve_valid_indices() 和
+    # retrieve_indices_within_shooting_range(); 使用 Square 的同名方法只是对它们的转换
+
+    def retrieve_valid_indices(self, starting_index, snapshot):
+        """
+        :return: 所有可达格子的编号
+        :rtype : array.array
+        """
+        raise NotImplementedError
+
+    def retrieve_indices_within_shooting_range(self, starting_index, snapshot):
+        """
+        :return: 火力覆盖的格子编号, 不区分目标格子上是敌方还是己方的棋子
+        :rtype : tuple
+        """
+        raise NotImplementedError
+
+    def iter_capture_indices(self, starting_index, snapshot):
+        """吃子走法的终点编号, 子类应当改写为不生成完整走法列表的实现"""
+        for index in self.retrieve_valid_indices(starting_index, snapshot):
+            if snapshot.node_at_index(index).unit_id > 0:
+                yield index
+
+    def iter_quiet_indices(self, starting_index, snapshot):
+        """走到空格子的走法的终点编号"""
+        for index in self.retrieve_valid_indices(starting_index, snapshot):
+            if not snapshot.node_at_index(index).unit_id:
+                yield index
+
+    def retrieve_valid_moves(self, starting_square, snapshot):
+        """
+        :param starting_square: 当前位置
+        :param snapshot: 作战双方棋子的位置的一个快照
+        :rtype : tuple
+        """
+        square_of = square_table(snapshot.xmax).__getitem__
+        starting_index = snapshot.index_of(starting_square)
+        return tuple(map(square_of, self.retrieve_valid_indices(starting_index, snapshot)))
+
+    def retrieve_squares_within_shooting_range(self, starting_square, snapshot):
+        """
+        :param starting_square: 当前位置
+        :param snapshot: 作战双方棋子的位置的一个快照
+        :rtype : tuple
+        """
+        square_of = square_table(snapshot.xmax).__getitem__
+        starting_index = snapshot.index_of(starting_square)
+        return tuple(map(square_of, self.retrieve_indices_within_shooting_range(starting_index, snapshot)))
+
+    def iter_valid_moves(self, starting_square, snapshot):
+        """与 retrieve_valid_moves() 结果相同的生成器: 先产生吃子走法, 再产生不吃子的走法
+
+        每一阶段只在被消费时才计算, 搜索或"是否还有棋可走"的判断可以随时停止, 不必生成完整的走法列表
+        """
+        return itertools.chain(self.iter_captures(starting_square, snapshot),
+                               self.iter_quiet_moves(starting_square, snapshot))
+
+    def iter_captures(self, starting_square, snapshot):
+        return map(snapshot.square_of, self.iter_capture_indices(snapshot.index_of(starting_square), snapshot))
+
+    def iter_quiet_moves(self, starting_square, snapshot):
+        return map(snapshot.square_of, self.iter_quiet_indices(snapshot.index_of(starting_square), snapshot))
+
+
+_ray_tables = {}
+
+
+def _iter_captures_along_rays(unit, starting_index, snapshot):
+    """沿射线表前进, 只产生每条射线尽头的敌方棋子"""
+    node_at_index = snapshot.node_at_index
+    owner = unit.owner
+    for ray in unit.retrieve_rays(starting_index, snapshot):
+        for index in ray:
+            node = node_at_index(index)
+            if node.unit_id > 0:
+                if node.unit.owner != owner:
+                    yield index
+                break
+
+
+def _iter_quiet_moves_along_rays(unit, starting_index, snapshot):
+    """沿射线表前进, 产生被阻挡之前的全部空格子"""
+    node_at_index = snapshot.node_at_index
+    for ray in unit.retrieve_rays(starting_index, snapshot):
+        for index in ray:
+            if node_at_index(index).unit_id > 0:
+                break
+            yield index
+
+
+def _retrieve_moves_along_rays(unit, starting_index, snapshot):
+    """沿射线表逐格前进直到被阻挡: 可以占领空格或攻击敌人所在的格子, 但不能攻击己方棋子所在的格子"""
+    result = array.array(snapshot.typecode)
+    append = result.append
+    node_at_index = snapshot.node_at_index
+    owner = unit.owner
+    for ray in unit.retrieve_rays(starting_index, snapshot):
+        for index in ray:
+            node = node_at_index(index)
+            if node.unit_id > 0:
+                if node.unit.owner != owner:
+                    append(index)
+                break
+            append(index)
+    return result
+
+
+def _retrieve_shooting_range_along_rays(unit, starting_index, snapshot):
+    """沿射线表逐格前进, 被阻挡的格子本身也在火力范围之内"""
+    result = []
+    node_at_index = snapshot.node_at_index
+    for ray in unit.retrieve_rays(starting_index, snapshot):  # 每个方向单独处理, 射线已截掉棋盘外和超出射程的格子
+        for index in ray:
+            result.append(index)
+            if node_at_index(index).unit_id > 0:
+                # 存在敌人时, 火力线被敌人阻挡, 火力覆盖不到后面的位置了
+                # 存在己方棋子时, 火力线则被己方阻挡, 结果同上
+                break
+    return tuple(result)
+
+
+def ray_table(xmax, ymax, directions, limited_move_range):
+    """对同一种棋盘尺寸、方向组合和射程, 只计算一次每个格子出发的射线
+
+    :param limited_move_range: 0 或负数表示不限格数
+    :return: 格子编号 -> 每个方向一条射线
+    :rtype : dict
+    """
+    key = (xmax, ymax, tuple(directions), limited_move_range)
+    table = _ray_tables.get(key)
+    if table is None:
+        table = _ray_tables[key] = RayTable(xmax, ymax, directions, limited_move_range)
+    return table
+
+
+class RayTable(dict):
+    """射线表, 某个格子的射线在第一次被查询时才计算, 超大棋盘上只有棋子到过的格子才占用内存"""
+
+    def __init__(self, xmax, ymax, directions, limited_move_range):
+        super(RayTable, self).__init__()
+        self.xmax = xmax
+        self.ymax = ymax
+        self.directions = tuple(directions)
+        self.max_steps = limited_move_range if limited_move_range > 0 else max(xmax, ymax)
+
+    def __missing__(self, index):
+        if not 0 <= index < self.xmax * self.ymax:
+            raise KeyError(index)
+        x0, y0 = index % self.xmax, index // self.xmax
+        rays = []
+        for dx, dy in self.directions:
+            ray = []
+            x, y = x0 + dx, y0 + dy
+            while len(ray) < self.max_steps and 0 <= x < self.xmax and 0 <= y < self.ymax:
+                ray.append(x + y * self.xmax)
+                x, y = x + dx, y + dy
+            rays.append(tuple(ray))
+        rays = self[index] = tuple(rays)
+        return rays
+
+
+_square_tables = {}
+
+
+def square_table(xmax):
+    """格子编号 -> Square 的转换表, 同一宽度的棋盘共用, 转换结果不必每次都新建 Square 对象
+
+    :rtype : dict
+    """
+    table = _square_tables.get(xmax)
+    if table is None:
+        table = _square_tables[xmax] = SquareTable(xmax)
+    return table
+
+
+class SquareTable(dict):
+    """与 RayTable 相同, 只在某个格子第一次被查询时才创建它的 Square"""
+
+    def __init__(self, xmax):
+        super(SquareTable, self).__init__()
+        self.xmax = xmax
+
+    def __missing__(self, index):
+        square = self[index] = Square(index % self.xmax, index // self.xmax)
+        return square
+
 
 class GameArena:
     """模拟竞技场
@@ -24,15 +291,24 @@ class GameArena:
         """直接使用整数表示的战斗单位编码"""
         pass
 
-    def __init__(self, width, ranks):
+    def __init__(self, width, ranks, sparse=False):
         """初始化游戏竞技场数据
 
         :param width: x 轴方向上棋盘的宽度(=xmax), 例如国际象棋棋盘为 8 路纵列, 中国象棋棋盘则为 9 路
         :param ranks: 横行数量(=ymax)
+        :param sparse: 只记录被占领的格子, 适合棋子很少的超大棋盘(例如 64x64 以上), 快照和查询的开销只与棋子数量有关
         """
         self.__unit_info_list = []  # 按单位的编码顺序存储所有战斗单位的信息(其中并不包括该单位所在位置), 初始状态为空列表, 通过编码查找. 单位死亡后仍然保留记录
-        # 二维数组共 width*ranks 个格子, 记录每个空格被哪一个棋子占领, 全部初始化置零表示所有格子均无人占领:
-        self.__battlefield = [[self.UnitID(0)] * width for y in range(ranks)]
+        self.__size = (width, ranks)
+        self.__typecode = index_typecode(width, ranks)
+        # 按格子编号记录每个空格被哪一个棋子占领, 初始状态所有格子均无人占领:
+        self.__battlefield = SparseBattlefield(width, ranks) if sparse else DenseBattlefield(width, ranks)
+        self.__revision = 0  # 局面版本号, 棋盘上每发生一次变化加一, 供外部缓存判断是否过期
+        # 走法缓存: unit_id -> (终点格子编号, 计算走法时读取过的格子编号集合), 集合为 None 表示每步棋之后都要重新计算(王)
+        self.__valid_moves = {}
+        self.__changed_units = frozenset()  # 上一步棋之后走法发生变化的单位
+        self.__legality = (None, {})  # (局面版本号, player_id -> LegalityFilter), 每个局面只计算一次
+        self.__journal = None  # 走棋日志, 见 attach_journal()
 
     @property
     def size(self):
@@ -41,56 +317,125 @@ class GameArena:
         :return: 战场一横排的格数 x 和一纵列的格数 y
         :rtype : int, int
         """
-        ymax = len(self.__battlefield)
-        xmax = len(self.__battlefield[0])
-        return xmax, ymax
+        return self.__size
+
+    @property
+    def sparse(self):
+        return isinstance(self.__battlefield, SparseBattlefield)
+
+    @property
+    def revision(self):
+        """局面版本号, 版本号相同则棋盘上所有单位的位置和状态均未改变
+
+        :rtype : int
+        """
+        return self.__revision
+
+    def index_of_square(self, square):
+        """格子坐标转换为格子编号 x + y * 棋盘宽度, 越界时上报 ValueError 异常
+
+        :rtype : int
+        """
+        x, y = square[0], square[1]
+        xmax, ymax = self.__size
+        if x < 0 or y < 0 or x >= xmax or y >= ymax:
+            raise ValueError('invalid square:{}'.format(square))
+        return x + y * xmax
+
+    def square_of_index(self, index):
+        """
+        :rtype : Square
+        """
+        return square_table(self.__size[0])[index]
+
+    def __check_index(self, index):
+        xmax, ymax = self.__size
+        if not 0 <= index < xmax * ymax:
+            raise ValueError('invalid square index:{}'.format(index))
 
-    def new_unit_recruited_by_player(self, player_id, square, unit_type):
+    def new_unit_recruited_by_player(self, player_id, square, unit_type, has_been_moved=False):
         """征募一个虚拟单位进入战场, 返回值表示为其分配的编码
 
         :param player_id: 玩家编号, 每个单位必须有一个玩家归属
         :param square: 单位的初始位置
         :param unit_type: 单位的类型, 必须继承 class Unit
+        :param has_been_moved: 单位是否已经走过(例如从残局布局中恢复的兵不能再冲锋走两格)
         :return: 为新单位分配的编码, 最小值从 1 开始分配
         :rtype : GameArena.UnitID
         """
         unit = unit_type(owner=player_id)
+        index = self.index_of_square(square) if square else None
         self.__unit_info_list.append(unit)
         unit_id = self.UnitID(len(self.__unit_info_list))
-        unit.has_been_moved = False
-        if square:
-            x, y = square[0], square[1]
-            xmax, ymax = self.size
-            if x < 0 or y < 0 or x >= xmax or y >= ymax:
-                raise ValueError('invalid square:{}'.format(square))
-            self.__battlefield[y][x] = unit_id
+        unit.has_been_moved = has_been_moved
+        if index is not None:
+            self.__battlefield.set(index, unit_id)
+            self.__revision += 1
+            self.__valid_moves.clear()  # 新单位可能挡住任意一条线路, 全部重新计算
         return unit_id
 
+    def copy(self):
+        """复制竞技场, 例如供搜索时试走; 复制品与原竞技场互不影响
+
+        单位实例在状态改变时总是被替换而不是被修改, 所以两者可以共用; 走法缓存中的数组也不会被修改, 同样共用
+
+        :rtype : GameArena
+        """
+        other = GameArena.__new__(GameArena)
+        other.__unit_info_list = list(self.__unit_info_list)
+        other.__size = self.__size
+        other.__typecode = self.__typecode
+        other.__battlefield = self.__battlefield.copy()
+        other.__revision = self.__revision
+        other.__valid_moves = dict(self.__valid_moves)
+        other.__changed_units = self.__changed_units
+        other.__legality = self.__legality
+        other.__journal = None  # 试走不写入日志
+        return other
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_GameArena__journal'] = None  # 日志持有文件和后台线程, 不随局面传给其他进程
+        return state
+
+    def attach_journal(self, journal):
+        """之后每一步棋都交给 journal.record_move(起点格子编号, 终点格子编号, 单位编码) 记录, 见 gamejournal
+
+        :param journal: None 表示停止记录
+        """
+        if journal is not None and self.__size[0] * self.__size[1] > journal.max_squares:
+            raise ValueError('arena of {}x{} squares is too large for the journal'.format(*self.__size))
+        self.__journal = journal
+
     def owner_of_unit(self, unit_id):
         if not self.is_valid_unit_id(unit_id):
             raise ValueError('unit_id:{} not exists'.format(unit_id))
         return self.__unit_info_list[unit_id - 1].owner
 
-    def __place_unit_on_square(self, unit_id, square):
+    def __place_unit_on_index(self, unit_id, index):
         """放置棋子(即移动或者复活棋子, 但该函数不能将棋子本身从棋盘上拿走)
 
         如果指定的单位已经死亡则将其复活并放入战场, 强制杀死指定位置上原有的单位无论是否是己方单位
+
+        :return: 棋子原来的格子编号(复活时为 None), 被杀死的单位编码(没有时为 0)
+        :rtype : int, GameArena.UnitID
         """
-        x, y = square[0], square[1]
-        try:
-            # 进行移动前, 先尝试寻找该棋子移动前的位置信息
-            square_before_move = self.find_square_from_unit_id(unit_id)
-        except ValueError:
-            # 这种情况没有“脚印”即不需要擦除
-            pass
-        else:  # 擦除脚印
-            self.__battlefield[square_before_move.y][square_before_move.x] = self.UnitID(0)
+        captured = self.__battlefield.get(index)
+        # 进行移动前, 先尝试寻找该棋子移动前的位置信息
+        index_before_move = self.__battlefield.find(unit_id)
+        if index_before_move is not None:  # 擦除脚印, 复活的棋子没有“脚印”即不需要擦除
+            self.__battlefield.set(index_before_move, self.UnitID(0))
         # 然后再将棋子放置到新位置
-        self.__battlefield[y][x] = unit_id
-        # 检查小兵是否走到底排
-        unit = self.__unit_info_list[unit_id-1]
-        if isinstance(unit,AbstractPawnUnit):
-            unit.check_bottom(y)
+        self.__battlefield.set(index, unit_id)
+        self.__revision += 1
+        # 按类型编码查找到达钩子, 例如检查小兵是否走到底排
+        unit = self.__unit_info_list[unit_id - 1]
+        hook = UNIT_ARRIVAL_HOOKS.get(unit.type_code)
+        if hook is not None:
+            replacement = hook(unit, index, self.__size[0], self.__size[1])
+            if replacement is not None:
+                self.__unit_info_list[unit_id - 1] = replacement
+        return index_before_move, captured
 
     def move_unit_to_somewhere(self, unit_id, square):
         """移动棋子
@@ -100,12 +445,76 @@ class GameArena:
         """
         if not self.is_valid_unit_id(unit_id):
             raise ValueError('unit_id:{} does not exist'.format(unit_id))
-        x, y = square[0], square[1]
-        xmax, ymax = self.size
-        if x < 0 or y < 0 or x >= xmax or y >= ymax:
-            raise ValueError('invalid square:{}'.format(square))
-        self.__place_unit_on_square(unit_id, square)
-        self.__unit_info_list[unit_id - 1].has_been_moved = True
+        self.move_unit_to_index(unit_id, self.index_of_square(square))
+
+    def move_unit_to_index(self, unit_id, index):
+        """移动棋子, 与 move_unit_to_somewhere() 相同, 但目的地用格子编号表示
+
+        :param unit_id: 单位编码
+        :param index: 目的地格子编号
+        """
+        if not self.is_valid_unit_id(unit_id):
+            raise ValueError('unit_id:{} does not exist'.format(unit_id))
+        self.__check_index(index)
+        index_before_move, captured = self.__place_unit_on_index(unit_id, index)
+        unit = self.__unit_info_list[unit_id - 1]
+        if not unit.has_been_moved:
+            # 单位实例可能被 copy() 出来的其它竞技场共用, 状态改变时替换成新的实例
+            unit = self.__unit_info_list[unit_id - 1] = unit.clone()
+            unit.has_been_moved = True
+        changed_indices = {index}
+        if index_before_move is not None:
+            changed_indices.add(index_before_move)
+        self.__update_valid_moves(changed_indices, {unit_id, captured} - {0})
+        if self.__journal is not None:
+            self.__journal.record_move(index_before_move, index, unit_id)
+
+    def __update_valid_moves(self, changed_indices, moved_units):
+        """增量更新走法缓存: 只重新计算线路经过 changed_indices 的单位以及王, 并记录走法发生变化的单位
+
+        :param changed_indices: 本步棋中内容发生变化的格子编号
+        :param moved_units: 本步棋中被移动或被吃掉的单位
+        """
+        changed = set(moved_units)
+        affected = []
+        for unit_id, (moves, depends) in self.__valid_moves.items():
+            if unit_id in moved_units or depends is None or not depends.isdisjoint(changed_indices):
+                affected.append((unit_id, moves))
+        for unit_id, moves in affected:
+            del self.__valid_moves[unit_id]
+        snapshot = self.__take_snapshot()
+        for unit_id, moves in affected:
+            index = self.__battlefield.find(unit_id)
+            if index is None:
+                continue  # 已被吃掉
+            if self.__compute_valid_moves(unit_id, index, snapshot) != moves:
+                changed.add(unit_id)
+        self.__changed_units = frozenset(changed)
+
+    def __compute_valid_moves(self, unit_id, index, snapshot):
+        """计算单位走法, 同时记下计算过程中读取过哪些格子, 存入走法缓存"""
+        unit = self.__unit_info_list[unit_id - 1]
+        if unit.depends_on_whole_board:
+            # 王要排除所有被敌方控制的格子, 任何一步棋都可能影响结果; 并且王会修改快照, 只能使用副本
+            moves = unit.retrieve_valid_indices(index, snapshot.copy())
+            self.__valid_moves[unit_id] = (moves, None)
+            return moves
+        snapshot.accessed = set()
+        moves = unit.retrieve_valid_indices(index, snapshot)
+        snapshot.accessed.add(index)
+        self.__valid_moves[unit_id] = (moves, frozenset(snapshot.accessed))
+        snapshot.accessed = None
+        return moves
+
+    @property
+    def changed_units(self):
+        """上一次 move_unit_to_somewhere() 之后走法发生变化的单位编码, 包括被移动和被吃掉的单位
+
+        只有之前查询过走法(已存入缓存)的单位才会被比较, 调用 retrieve_all_valid_moves() 之后即可跟踪全部单位
+
+        :rtype : frozenset
+        """
+        return self.__changed_units
 
     def is_valid_unit_id(self, unit_id):
         """unit_id 编码检查, 这里不区分是否已经死亡, 只要单位曾经存在即为有效 ID, unit_id=0 时无效
@@ -126,9 +535,199 @@ class GameArena:
         result = {}
         if not self.is_valid_unit_id(unit_id):
             return result
-        square = self.find_square_from_unit_id(unit_id)  # 找不到则会向上传递 ValueError 异常
+        square_of_index = square_table(self.__size[0]).__getitem__
+        return tuple(map(square_of_index, self.retrieve_valid_destinations_of_unit(unit_id)))
+
+    def retrieve_valid_destinations_of_unit(self, unit_id):
+        """查询走法, 与 retrieve_valid_moves_of_unit() 相同, 但结果是格子编号
+
+        :param unit_id: 棋子单位的编码
+        :return: 所有可达格子的编号, 返回的是走法缓存本身, 调用者不得修改
+        :rtype : array.array
+        """
+        if not self.is_valid_unit_id(unit_id):
+            return array.array(self.__typecode)
+        cached = self.__valid_moves.get(unit_id)
+        if cached is not None:
+            return cached[0]
+        index = self.find_index_from_unit_id(unit_id)  # 找不到则会向上传递 ValueError 异常
+        return self.__compute_valid_moves(unit_id, index, self.__take_snapshot())
+
+    def retrieve_all_valid_moves(self):
+        """查询棋盘上全部单位的走法, 此后每步棋只增量更新受影响的单位
+
+        :return: unit_id -> 该单位所有可达位置
+        :rtype : dict
+        """
+        square_of_index = square_table(self.__size[0]).__getitem__
+        return dict((unit_id, tuple(map(square_of_index, destinations)))
+                    for unit_id, index, destinations in self.__retrieve_all_destinations())
+
+    def __retrieve_all_destinations(self, player_id=None):
+        """:return: 按格子顺序排列的 (unit_id, 起点编号, 终点编号) 三元组"""
+        snapshot = None
+        result = []
+        units = self.__unit_info_list
+        for index, unit_id in self.__battlefield.occupied():
+            if player_id is not None and units[unit_id - 1].owner != player_id:
+                continue
+            cached = self.__valid_moves.get(unit_id)
+            if cached is None:
+                if snapshot is None:
+                    snapshot = self.__take_snapshot()
+                result.append((unit_id, index, self.__compute_valid_moves(unit_id, index, snapshot)))
+            else:
+                result.append((unit_id, index, cached[0]))
+        return result
+
+    def retrieve_packed_moves(self, player_id=None):
+        """把全部走法打包成整数(见 pack_move()), 同样使用走法缓存
+
+        :param player_id: 只列出该玩家的单位, None 表示双方
+        :rtype : array.array
+        """
+        result = array.array('Q')
+        get = self.__battlefield.get
+        for unit_id, fr, destinations in self.__retrieve_all_destinations(player_id):
+            for to in destinations:
+                result.append(pack_move(fr, to, MOVE_FLAG_CAPTURE if get(to) else 0))
+        return result
+
+    def iter_valid_moves_of_unit(self, unit_id):
+        """生成器版本的 retrieve_valid_moves_of_unit(): 先产生吃子走法, 再产生不吃子的走法
+
+        快照在调用时生成, 此后改变棋盘不影响尚未消费完的生成器
+        """
+        if not self.is_valid_unit_id(unit_id):
+            return iter(())
+        index = self.find_index_from_unit_id(unit_id)  # 找不到则会向上传递 ValueError 异常
         unit = self.__unit_info_list[unit_id - 1]
-        return unit.retrieve_valid_moves(starting_square=square, snapshot=self.__take_snapshot())
+        snapshot = self.__take_snapshot()
+        return map(self.square_of_index, itertools.chain(unit.iter_capture_indices(index, snapshot),
+                                                         unit.iter_quiet_indices(index, snapshot)))
+
+    def iter_valid_moves(self, player_id=None):
+        """按阶段产生棋盘上全部单位的走法: 先是所有单位的吃子走法, 然后才是所有单位的不吃子走法
+
+        :param player_id: 只列出该玩家的单位, None 表示双方
+        :return: (unit_id, destination) 的生成器
+        """
+        unit_ids = dict(self.__battlefield.occupied())
+        square_of_index = square_table(self.__size[0]).__getitem__
+        for move in self.__iter_staged_moves(self.__staged_units(player_id), self.__take_snapshot()):
+            fr, to, flags = unpack_move(move)
+            yield unit_ids[fr], square_of_index(to)
+
+    def iter_packed_moves(self, player_id=None):
+        """与 iter_valid_moves() 的顺序相同, 但每步棋打包成整数(见 pack_move())
+
+        :param player_id: 只列出该玩家的单位, None 表示双方
+        """
+        return self.__iter_staged_moves(self.__staged_units(player_id), self.__take_snapshot())
+
+    def __staged_units(self, player_id):
+        """:return: 按格子顺序排列的 (格子编号, unit) 列表"""
+        units = self.__unit_info_list
+        return [(index, units[unit_id - 1]) for index, unit_id in self.__battlefield.occupied()
+                if player_id is None or units[unit_id - 1].owner == player_id]
+
+    @staticmethod
+    def __iter_staged_moves(staged, snapshot):
+        for fr, unit in staged:
+            for to in unit.iter_capture_indices(fr, snapshot):
+                yield pack_move(fr, to, MOVE_FLAG_CAPTURE)
+        for fr, unit in staged:
+            for to in unit.iter_quiet_indices(fr, snapshot):
+                yield pack_move(fr, to)
+
+    def has_any_valid_move(self, player_id):
+        """玩家是否还有棋可走, 找到第一个走法即返回"""
+        for unit_id, (moves, depends) in self.__valid_moves.items():
+            if moves and self.__unit_info_list[unit_id - 1].owner == player_id:
+                return True
+        for move in self.iter_packed_moves(player_id):
+            return True
+        return False
+
+    def legality_of_player(self, player_id):
+        """当前局面下该玩家的将军与牵制信息, 同一局面版本只计算一次
+
+        :rtype : LegalityFilter
+        """
+        revision, filters = self.__legality
+        if revision != self.__revision:
+            filters = {}
+            self.__legality = (self.__revision, filters)
+        legality = filters.get(player_id)
+        if legality is None:
+            units = self.__unit_info_list
+            king_index = None
+            for index, unit_id in self.__battlefield.occupied():
+                unit = units[unit_id - 1]
+                if unit.royal and unit.owner == player_id:
+                    king_index = index
+                    break
+            legality = filters[player_id] = LegalityFilter(self.__take_snapshot(), player_id, king_index)
+        return legality
+
+    def is_in_check(self, player_id):
+        """
+        :rtype : bool
+        """
+        return bool(self.legality_of_player(player_id).checkers)
+
+    def retrieve_legal_destinations_of_unit(self, unit_id):
+        """查询合法走法: 在 retrieve_valid_destinations_of_unit() 的基础上排除走完之后己方王被将军的走法
+
+        :param unit_id: 棋子单位的编码
+        :return: 所有合法终点格子的编号
+        :rtype : array.array
+        """
+        destinations = self.retrieve_valid_destinations_of_unit(unit_id)
+        if not destinations:
+            return destinations
+        unit = self.__unit_info_list[unit_id - 1]
+        return self.legality_of_player(unit.owner).filter(unit, self.__battlefield.find(unit_id), destinations)
+
+    def retrieve_legal_moves_of_unit(self, unit_id):
+        """与 retrieve_legal_destinations_of_unit() 相同, 但结果是 Square
+
+        :rtype : tuple
+        """
+        if not self.is_valid_unit_id(unit_id):
+            return ()
+        return tuple(map(square_table(self.__size[0]).__getitem__, self.retrieve_legal_destinations_of_unit(unit_id)))
+
+    def retrieve_packed_legal_moves(self, player_id):
+        """该玩家的全部合法走法, 打包成整数(见 pack_move())
+
+        :rtype : array.array
+        """
+        legality = self.legality_of_player(player_id)
+        units = self.__unit_info_list
+        result = array.array('Q')
+        get = self.__battlefield.get
+        for unit_id, fr, destinations in self.__retrieve_all_destinations(player_id):
+            for to in legality.filter(units[unit_id - 1], fr, destinations):
+                result.append(pack_move(fr, to, MOVE_FLAG_CAPTURE if get(to) else 0))
+        return result
+
+    def retrieve_restricted_units(self):
+        """合法走法少于 retrieve_valid_destinations_of_unit() 的单位: 被牵制的单位, 以及被将军一方的全部单位
+
+        局面改变后, 合法走法可能发生变化的单位是 changed_units 加上改变前后的 retrieve_restricted_units()
+
+        :rtype : frozenset
+        """
+        units = self.__unit_info_list
+        players = set(unit.owner for unit in units)
+        restricted = set()
+        for player_id in players:
+            legality = self.legality_of_player(player_id)
+            for index, unit_id in self.__battlefield.occupied():
+                if units[unit_id - 1].owner == player_id and (legality.checkers or index in legality.pins):
+                    restricted.add(unit_id)
+        return frozenset(restricted)
 
     def find_square_from_unit_id(self, unit_id):
         """搜索特定棋子编码的棋子如果在棋盘上则返回坐标, 否则向上传递一个 ValueError 表示没找到
@@ -136,49 +735,182 @@ class GameArena:
         :param unit_id:
         :rtype : Square
         """
+        return self.square_of_index(self.find_index_from_unit_id(unit_id))
+
+    def find_index_from_unit_id(self, unit_id):
+        """与 find_square_from_unit_id() 相同, 但返回格子编号
+
+        :rtype : int
+        """
         if not self.is_valid_unit_id(unit_id):
             raise ValueError('Error: invalid unit_id:{}'.format(unit_id))
-        for y in range(len(self.__battlefield)):
-            rank = self.__battlefield[y]
-            for x in range(len(rank)):
-                if unit_id == rank[x]:
-                    return Square(x, y)
+        index = self.__battlefield.find(unit_id)
+        if index is not None:
+            return index
         raise ValueError('Note: unit_id:{} is not on chessboard'.format(unit_id))
 
+    def find_unit_id_on_square(self, square):
+        """查询格子上的单位编码
+
+        :param square: 格子坐标, 越界时上报 ValueError 异常
+        :return: 单位编码, 空格子返回 0
+        :rtype : GameArena.UnitID
+        """
+        return self.__battlefield.get(self.index_of_square(square))
+
+    def find_unit_id_on_index(self, index):
+        """与 find_unit_id_on_square() 相同, 但格子用编号表示
+
+        :rtype : GameArena.UnitID
+        """
+        self.__check_index(index)
+        return self.__battlefield.get(index)
+
+    def position_key(self):
+        """局面的键, 可以用作置换表或重复局面判断的字典键; 两个竞技场的键相等时棋盘上所有单位的类型、归属、位置和状态都相同
+
+        :rtype : tuple
+        """
+        units = self.__unit_info_list
+        key = []
+        for index, unit_id in self.__battlefield.occupied():
+            unit = units[unit_id - 1]
+            key.append((index, unit.type_code, unit.owner, bool(unit.has_been_moved)))
+        return tuple(key)
+
+    def find_unit_on_index(self, index):
+        """查询格子上的单位实例
+
+        :return: 单位实例, 空格子返回 None
+        :rtype : Unit
+        """
+        unit_id = self.find_unit_id_on_index(index)
+        return self.__unit_info_list[unit_id - 1] if unit_id else None
+
+    def retrieve_units_on_board(self):
+        """列出当前位于棋盘上的全部单位(已死亡的单位不在其中)
+
+        :return: 按格子顺序(先横行后纵列)排列的 (unit_id, square, unit) 三元组
+        :rtype : tuple
+        """
+        units = self.__unit_info_list
+        square_of_index = square_table(self.__size[0]).__getitem__
+        return tuple((unit_id, square_of_index(index), units[unit_id - 1])
+                     for index, unit_id in self.__battlefield.occupied())
+
     def is_occupied_square(self, square):
         x, y = square[0], square[1]
         xmax, ymax = self.size
         if x < 0 or y < 0 or x >= xmax or y >= ymax:
             return False
-        return self.__battlefield[y][x] > 0
+        return self.__battlefield.get(x + y * xmax) > 0
 
     def __take_snapshot(self):
-        """遍历所有格子的信息, 生成一份快照"""
+        """生成一份快照, 快照中只有被占领的格子"""
         builder = SnapshotBuilder(self.size)
-        for y in range(len(self.__battlefield)):
-            rank = self.__battlefield[y]
-            for x in range(len(rank)):
-                unit_id = rank[x]
-                if unit_id > 0:
-                    unit = self.__unit_info_list[unit_id - 1]
-                else:
-                    unit = None
-                builder.set_node(x, y, unit_id, unit_instance=unit)
+        units = self.__unit_info_list
+        for index, unit_id in self.__battlefield.occupied():
+            builder.set_node_at_index(index, unit_id, unit_instance=units[unit_id - 1])
         return builder.snapshot
 
 
+class DenseBattlefield(object):
+    """一维数组共 width*ranks 个格子, 按格子编号存放单位编码, 零表示无人占领"""
+
+    def __init__(self, width, ranks):
+        self.cells = [GameArena.UnitID(0)] * (width * ranks)
+
+    def get(self, index):
+        return self.cells[index]
+
+    def set(self, index, unit_id):
+        self.cells[index] = unit_id
+
+    def find(self, unit_id):
+        """:return: 单位所在格子编号, 不在棋盘上时返回 None"""
+        try:
+            return self.cells.index(unit_id)
+        except ValueError:
+            return None
+
+    def occupied(self):
+        """按格子顺序(先横行后纵列)列出 (index, unit_id)"""
+        return [(index, unit_id) for index, unit_id in enumerate(self.cells) if unit_id > 0]
+
+    def copy(self):
+        other = DenseBattlefield(0, 0)
+        other.cells = list(self.cells)
+        return other
+
+
+class SparseBattlefield(object):
+    """只保存被占领的格子, 同时维护单位到格子的反向索引, 所有操作的开销与棋盘面积无关"""
+
+    def __init__(self, width, ranks):
+        self.__units = {}  # index -> unit_id
+        self.__indices = {}  # unit_id -> index
+
+    def get(self, index):
+        return self.__units.get(index, GameArena.UnitID(0))
+
+    def set(self, index, unit_id):
+        previous = self.__units.pop(index, 0)
+        if previous:
+            del self.__indices[previous]
+        if unit_id:
+            self.__units[index] = unit_id
+            self.__indices[unit_id] = index
+
+    def find(self, unit_id):
+        return self.__indices.get(unit_id)
+
+    def occupied(self):
+        return sorted(self.__units.items())
+
+    def copy(self):
+        other = SparseBattlefield(0, 0)
+        other.__units = dict(self.__units)
+        other.__indices = dict(self.__indices)
+        return other
+
+
 class Snapshot(dict):
+    """格子编号 -> Node, 只保存被占领的格子"""
     xmax = 0
     ymax = 0
+    typecode = 'H'  # 走法结果使用的 array 类型, 见 index_typecode()
+    accessed = None  # 不为 None 时记录 node_at_index() 读取过的格子编号, 用于判断走法依赖哪些格子
 
     def get_node(self, x, y):
-        try:
-            return self[Square(x, y)]
-        except KeyError:
-            if 0 <= x < self.xmax and 0 <= y < self.ymax:
-                return Snapshot.Node(unit_id=0, unit_instance=None)
-            # 否则上报一个 ValueError 异常:
-            raise ValueError('Error: x,y坐标越界: get_node(x={},y={})'.format(x, y))
+        if 0 <= x < self.xmax and 0 <= y < self.ymax:
+            return self.node_at_index(x + y * self.xmax)
+        # 否则上报一个 ValueError 异常:
+        raise ValueError('Error: x,y坐标越界: get_node(x={},y={})'.format(x, y))
+
+    def node_at(self, square):
+        return self.get_node(square[0], square[1])
+
+    def node_at_index(self, index):
+        """按格子编号查找, 供射线表使用, 不检查是否越界"""
+        if self.accessed is not None:
+            self.accessed.add(index)
+        node = self.get(index)
+        if node is not None:
+            return node
+        return Snapshot.EMPTY_NODE  # 快照中不保存空格子
+
+    def index_of(self, square):
+        return square[0] + square[1] * self.xmax
+
+    def square_of(self, index):
+        return square_table(self.xmax)[index]
+
+    def copy(self):
+        s = Snapshot(self)
+        s.xmax = self.xmax
+        s.ymax = self.ymax
+        s.typecode = self.typecode
+        return s
 
     class Node:
         def __init__(self, unit_id, unit_instance=None):
@@ -186,6 +918,9 @@ class Snapshot(dict):
             self.unit = unit_instance
 
 
+Snapshot.EMPTY_NODE = Snapshot.Node(unit_id=0, unit_instance=None)  # 所有空格子共用, 不可修改
+
+
 class SnapshotBuilder:
     def __init__(self, size):
         self.__xmax, self.__ymax = size[0], size[1]
@@ -193,23 +928,116 @@ class SnapshotBuilder:
 
     @property
     def snapshot(self):
-        s = Snapshot(self.__nodes.items())
+        s = Snapshot(self.__nodes)
         s.xmax = self.__xmax
         s.ymax = self.__ymax
+        s.typecode = index_typecode(self.__xmax, self.__ymax)
         return s
 
     def set_node(self, x, y, unit_id, unit_instance):
         if 0 <= x < self.__xmax and 0 <= y < self.__ymax:
-            self.__nodes[Square(x, y)] = Snapshot.Node(unit_id, unit_instance)
+            self.set_node_at_index(x + y * self.__xmax, unit_id, unit_instance)
         else:
             raise ValueError('Error: 坐标越界: set_node(x={},y={})'.format(x, y))
 
+    def set_node_at_index(self, index, unit_id, unit_instance):
+        if unit_id:
+            self.__nodes[index] = Snapshot.Node(unit_id, unit_instance)
+        else:
+            self.__nodes.pop(index, None)
+
+
+class LegalityFilter(object):
+    """某一方在一个局面下的将军与牵制信息, 用来把伪合法走法(pseudo-legal)过滤成合法走法
+
+    从王所在的格子出发沿射线向外搜索, 每个局面只需计算一次, 不必对每一步棋都试走并重新计算敌方火力:
+    - 沿直线和斜线碰到的第一个棋子若是能沿反方向攻击过来的敌方棋子, 即为将军; 若是己方棋子, 并且它身后第一个
+      棋子是能沿反方向攻击过来的敌方棋子, 则该己方棋子被牵制, 只能在这条线上移动
+    - 马之类的跳跃攻击同样按射线表从王出发查找, 兵这类没有 directions 的单位则检查它的火力范围
+    王自己的走法已经排除了被攻击的格子, 不再过滤
+    """
+    __slots__ = ('checkers', 'block', 'pins')
+
+    def __init__(self, snapshot, owner, king_index):
+        """
+        :param snapshot: 当前局面的快照
+        :param owner: 被保护的王所属的玩家
+        :param king_index: 王所在的格子编号, None 表示该玩家没有王(不过滤任何走法)
+        """
+        self.checkers = []  # 正在将军的敌方棋子所在格子
+        self.block = None  # 被将军时, 非王的棋子只能走到这些格子(吃掉将军的棋子或者挡住将军的线路)
+        self.pins = {}  # 被牵制的棋子所在格子 -> 它可以走到的格子
+        if king_index is None:
+            return
+        node_at_index = snapshot.node_at_index
+        xmax, ymax = snapshot.xmax, snapshot.ymax
+        lines = ray_table(xmax, ymax, QueenUnit.directions, 0)[king_index]
+        for direction, ray in zip(QueenUnit.directions, lines):
+            reverse = Vector(-direction.dx, -direction.dy)
+            pinned = None
+            for distance, index in enumerate(ray, 1):
+                node = node_at_index(index)
+                if not node.unit_id:
+                    continue
+                unit = node.unit
+                if unit.owner == owner:
+                    if pinned is not None:
+                        break  # 两个己方棋子, 都不受牵制
+                    pinned = (index, distance)
+                    continue
+                if reverse in unit.directions and \
+                        (unit.limited_move_range <= 0 or distance <= unit.limited_move_range):
+                    if pinned is None:
+                        self.__add_checker(index, ray[:distance])
+                    else:
+                        self.pins[pinned[0]] = frozenset(ray[:distance])
+                break
+        leaps = ray_table(xmax, ymax, KnightUnit.directions, 1)[king_index]
+        for direction, ray in zip(KnightUnit.directions, leaps):
+            if not ray:
+                continue
+            node = node_at_index(ray[0])
+            if node.unit_id and node.unit.owner != owner and \
+                    Vector(-direction.dx, -direction.dy) in node.unit.directions:
+                self.__add_checker(ray[0], ray[:1])
+        for index, node in snapshot.items():
+            unit = node.unit
+            if unit.owner != owner and not unit.directions and \
+                    king_index in unit.retrieve_indices_within_shooting_range(index, snapshot):
+                self.__add_checker(index, (index,))
+
+    def __add_checker(self, index, block):
+        self.checkers.append(index)
+        self.block = frozenset(block) if len(self.checkers) == 1 else frozenset()  # 双将时只能走王
+
+    def filter(self, unit, starting_index, destinations):
+        """
+        :param unit: 走棋的单位, 必须属于构造时指定的玩家
+        :param starting_index: 单位所在格子编号
+        :param destinations: 伪合法走法的终点格子编号
+        :return: 合法走法的终点格子编号, 没有被过滤时直接返回 destinations
+        :rtype : array.array
+        """
+        if unit.royal:
+            return destinations
+        block = self.block
+        allowed = self.pins.get(starting_index)
+        if block is None and allowed is None:
+            return destinations
+        result = array.array(destinations.typecode)
+        for index in destinations:
+            if (block is None or index in block) and (allowed is None or index in allowed):
+                result.append(index)
+        return result
+
 
 import abc
 
 
 class AbstractPawnUnit(Unit):
     __metaclass__ = abc.ABCMeta
+    __slots__ = ()
+    _pawn_rays = None  # 缓存 (xmax, ymax, 直走一格的射线表, 冲锋两格的射线表, 斜吃的射线表), 同一类型的兵共用
 
     @abc.abstractproperty
     def pawn_charge_direction(self):
@@ -219,198 +1047,128 @@ class AbstractPawnUnit(Unit):
         """国际象棋的兵
 
         :param owner: 所属玩家
-        :param pawn_charge_direction: 指定兵的冲锋方向, DirectionVector 矢量, 一般情况下应设置白方为 Vector(0, 1), 黑方为 Vector(0, -1)
         """
         super(AbstractPawnUnit, self).__init__(owner)
         self.has_been_moved = False  # 是否被移动过(兵第一次移动时可以进行冲锋走两格,之后只能沿棋盘纵列每步走一格)
-        self.has_been_queen = False
 
-    def retrieve_valid_moves(self, starting_square, snapshot):
+    def __pawn_ray_tables(self, snapshot):
+        tables = self._pawn_rays
+        if tables is None or tables[0] != snapshot.xmax or tables[1] != snapshot.ymax:
+            dy = self.pawn_charge_direction.dy
+            xmax, ymax = snapshot.xmax, snapshot.ymax
+            tables = type(self)._pawn_rays = (
+                xmax, ymax,
+                ray_table(xmax, ymax, (Vector(0, dy),), 1),
+                ray_table(xmax, ymax, (Vector(0, dy),), 2),
+                ray_table(xmax, ymax, (Vector(1, dy), Vector(-1, dy)), 1))
+        return tables
+
+    def retrieve_valid_indices(self, starting_index, snapshot):
         """兵只直走和斜吃两种情况(吃过路兵功能未实现, 需要另外单独处理)
 
-        :param starting_square: 兵当前位置
+        :param starting_index: 兵当前位置的格子编号
         :param snapshot: 作战双方棋子的位置的一个快照
-        :rtype : tuple
+        :rtype : array.array
         """
-        if self.has_been_queen:
-            return self.retrieve_valid_moves_queen(starting_square, snapshot)
-        result = []
-
-        # 先分析直走
-        dx, dy = self.pawn_charge_direction
-        x, y = starting_square.x + dx, starting_square.y + dy
-        max_steps = 1
-        if not self.has_been_moved:
-            max_steps = 2
-        step = 1
-        squares = []
-        while step <= max_steps:
-            step += 1
-            if y < 0 or y >= snapshot.ymax:
-                break  # 此时已经跑到棋盘外面了
-            other_unit_id = snapshot.get_node(x, y).unit_id
-            if not other_unit_id:
-                squares.append(Square(x, y))
-                y += dy
-        result += squares
-
-        # 再分析斜吃
-        dy = self.pawn_charge_direction.dy
-        squares = []
-        for x, y in self.retrieve_squares_within_shooting_range(starting_square, snapshot):
-            node = snapshot.get_node(x, y)
-            if not node.unit_id:
-                # 斜线方向上没有棋子时兵不能斜吃斜走, 但是吃过路兵除外
-                continue  # FIXME: 此处信息不足, 暂时无法判断能否吃过路兵
-            unit = node.unit
-            if unit.owner == self.owner:
-                continue  # 兵不能斜吃己方棋子
-            squares.append(Square(x, y))
-        result += squares
-        return tuple(result)
-
-    def retrieve_valid_moves_queen(self, starting_square, snapshot):
-        squares = []
-        for x, y in self.retrieve_squares_within_shooting_range_queen(starting_square, snapshot):
-            node = snapshot.get_node(x, y)
-            # 可以占领空格或攻击敌人所在的格子, 但不能攻击己方棋子所在的格子:
-            if not node.unit_id or node.unit.owner != self.owner:
-                squares.append(Square(x, y))
-        return tuple(squares)
-
-    def retrieve_squares_within_shooting_range(self, starting_square, snapshot):
+        # 先分析直走, 再分析斜吃
+        result = array.array(snapshot.typecode, self.__iter_forward_moves(starting_index, snapshot))
+        result.extend(self.__iter_diagonal_captures(starting_index, snapshot))
+        return result
+
+    def iter_capture_indices(self, starting_index, snapshot):
+        return self.__iter_diagonal_captures(starting_index, snapshot)
+
+    def iter_quiet_indices(self, starting_index, snapshot):
+        return self.__iter_forward_moves(starting_index, snapshot)
+
+    def __iter_forward_moves(self, starting_index, snapshot):
+        """直走: 第一次移动时可以走两格, 被挡住则停止"""
+        tables = self.__pawn_ray_tables(snapshot)
+        table = tables[2] if self.has_been_moved else tables[3]
+        node_at_index = snapshot.node_at_index
+        for index in table[starting_index][0]:
+            if node_at_index(index).unit_id:
+                break
+            yield index
+
+    def __iter_diagonal_captures(self, starting_index, snapshot):
+        """斜吃"""
+        node_at_index = snapshot.node_at_index
+        for ray in self.__pawn_ray_tables(snapshot)[4][starting_index]:
+            for index in ray:
+                node = node_at_index(index)
+                if not node.unit_id:
+                    # 斜线方向上没有棋子时兵不能斜吃斜走, 但是吃过路兵除外
+                    continue  # FIXME: 此处信息不足, 暂时无法判断能否吃过路兵
+                if node.unit.owner == self.owner:
+                    continue  # 兵不能斜吃己方棋子
+                yield index
+
+    def retrieve_indices_within_shooting_range(self, starting_index, snapshot):
         """分析兵可以攻击的两格火力点(射程), 不需要区分目标格子上是否为己方的棋子
 
-        :param starting_square: 兵当前位置
+        :param starting_index: 兵当前位置的格子编号
         :param snapshot: 作战双方棋子的位置的一个快照
         :rtype : tuple
         """
-        result = []
-        dy = self.pawn_charge_direction.dy
-        for dx in {-1, 1}:
-            x, y = starting_square.x + dx, starting_square.y + dy
-            if x < 0 or x >= snapshot.xmax or y < 0 or y >= snapshot.ymax:
-                continue  # 此时已经跑到棋盘外面了
-            result.append(Square(x, y))
-        return tuple(result)
-
-    def retrieve_squares_within_shooting_range_queen(self, starting_square, snapshot):
-        """计算沿直线走和吃子的棋子可以的所有火力点(当前火力射程范围), 不需要区分目标格子上是敌方还是己方的棋子
+        return tuple(ray[0] for ray in self.__pawn_ray_tables(snapshot)[4][starting_index] if ray)
 
-        :param starting_square: 当前位置
-        :param snapshot: 作战双方棋子的位置的一个快照
-        :rtype : tuple
-        """
-        result = []
-        for dx, dy in self.directions:  # 每个方向单独处理
-            squares = []
-            step_count = 1
-            x, y = starting_square[0] + dx, starting_square[1] + dy
-            # 若不限制棋子移动格数则一直循环, 直到碰到其他棋子或者棋盘边界:
-            while step_count <= self.limited_move_range if self.limited_move_range > 0 else True:
-                step_count += 1
-                if x < 0 or x >= snapshot.xmax or y < 0 or y >= snapshot.ymax:
-                    # 此时已经跑到棋盘外面了, 结束 while 循环
-                    break
-                node = snapshot.get_node(x, y)
-                if node.unit_id > 0:
-                    # 存在敌人时, 火力线被敌人阻挡, 火力覆盖不到后面的位置了
-                    # 存在己方棋子时, 火力线则被己方阻挡, 结果同上
-                    squares.append(Square(x, y))
-                    break  # 结束 while 循环
-                squares.append(Square(x, y))
-                x, y = x + dx, y + dy
-            result += squares
-        return tuple(result)
-
-    def check_bottom(self,y):
-        t = self.pawn_charge_direction.dy,y
-        if t == (1,7) or t == (-1,0):
-            # 变生成女皇
-            self.has_been_queen=True
-            self.directions = \
-                [Vector(1, 0), Vector(1, 1), Vector(0, 1), Vector(-1, 1),
-                 Vector(-1, 0), Vector(-1, -1), Vector(0, -1), Vector(1, -1)]
-            self.limited_move_range = 0  # 0 for no limit
 
+@register_unit_type
 class WhitePawnUnit(AbstractPawnUnit):
-    @property
-    def pawn_charge_direction(self):
-        return Vector(0, 1)
+    __slots__ = ()
+    pawn_charge_direction = Vector(0, 1)
 
 
+@register_unit_type
 class BlackPawnUnit(AbstractPawnUnit):
-    @property
-    def pawn_charge_direction(self):
-        return Vector(0, -1)
+    __slots__ = ()
+    pawn_charge_direction = Vector(0, -1)
 
 
 class StraightMovingAndAttackingUnit(Unit):
     """沿直线行进并攻击敌人的棋子，包括車、象、后、王(王只能走1格)
 
+    子类只需要在类上定义 directions 和 limited_move_range. 王和马只能按移动矢量的一倍距离进行移动(倍数 N=1)
+
     注意:
     中国象棋的炮只能隔子吃而不能直线吃, 所以该走法规则是不能支持中国象棋炮的
     中国象棋的象和马有有蹩腿规则, 也需要单独判定
     """
+    __slots__ = ()
 
-    def __init__(self, owner):
-        super(StraightMovingAndAttackingUnit, self).__init__(owner)
-        self.directions = []  # 用一组 Vector 矢量描述棋子可以朝哪些方向走
-        self.limited_move_range = 0  # 用负数或 0 代表不限制棋子最大移动格数, 用正整数 N 代表棋子最大移动距离(倍数 N). 王和马只能按移动矢量的一倍距离进行移动(倍数 N=1)
-
-    def retrieve_valid_moves(self, starting_square, snapshot):
+    def retrieve_valid_indices(self, starting_index, snapshot):
         """计算走法沿直线走和吃子的棋子可以到达哪些格子
 
-        :param starting_square: 当前位置
+        :param starting_index: 当前位置的格子编号
         :param snapshot: 作战双方棋子的位置的一个快照
-        :rtype : tuple
+        :rtype : array.array
         """
-        squares = []
-        for x, y in self.retrieve_squares_within_shooting_range(starting_square, snapshot):
-            node = snapshot.get_node(x, y)
-            # 可以占领空格或攻击敌人所在的格子, 但不能攻击己方棋子所在的格子:
-            if not node.unit_id or node.unit.owner != self.owner:
-                squares.append(Square(x, y))
-        return tuple(squares)
+        return _retrieve_moves_along_rays(self, starting_index, snapshot)
 
-    def retrieve_squares_within_shooting_range(self, starting_square, snapshot):
+    def iter_capture_indices(self, starting_index, snapshot):
+        return _iter_captures_along_rays(self, starting_index, snapshot)
+
+    def iter_quiet_indices(self, starting_index, snapshot):
+        return _iter_quiet_moves_along_rays(self, starting_index, snapshot)
+
+    def retrieve_indices_within_shooting_range(self, starting_index, snapshot):
         """计算沿直线走和吃子的棋子可以的所有火力点(当前火力射程范围), 不需要区分目标格子上是敌方还是己方的棋子
 
-        :param starting_square: 当前位置
+        :param starting_index: 当前位置的格子编号
         :param snapshot: 作战双方棋子的位置的一个快照
         :rtype : tuple
         """
-        result = []
-        for dx, dy in self.directions:  # 每个方向单独处理
-            squares = []
-            step_count = 1
-            x, y = starting_square[0] + dx, starting_square[1] + dy
-            # 若不限制棋子移动格数则一直循环, 直到碰到其他棋子或者棋盘边界:
-            while step_count <= self.limited_move_range if self.limited_move_range > 0 else True:
-                step_count += 1
-                if x < 0 or x >= snapshot.xmax or y < 0 or y >= snapshot.ymax:
-                    # 此时已经跑到棋盘外面了, 结束 while 循环
-                    break
-                node = snapshot.get_node(x, y)
-                if node.unit_id > 0:
-                    # 存在敌人时, 火力线被敌人阻挡, 火力覆盖不到后面的位置了
-                    # 存在己方棋子时, 火力线则被己方阻挡, 结果同上
-                    squares.append(Square(x, y))
-                    break  # 结束 while 循环
-                squares.append(Square(x, y))
-                x, y = x + dx, y + dy
-            result += squares
-        return tuple(result)
+        return _retrieve_shooting_range_along_rays(self, starting_index, snapshot)
 
 
+@register_unit_type
 class RookUnit(StraightMovingAndAttackingUnit):
     # TODO: 王車易位功能暂未实现, 需要在王的走法部分补充代码单独进行处理
     """車(国际象棋与中国象棋通用)"""
-
-    def __init__(self, owner):
-        super(RookUnit, self).__init__(owner)
-        self.directions = [Vector(1, 0), Vector(0, 1), Vector(-1, 0), Vector(0, -1)]  # 車可以前后左右四个方向(纵向、横向)移动, 不限格数
-        self.limited_move_range = 0  # 0 for no limit
+    __slots__ = ()
+    directions = (Vector(1, 0), Vector(0, 1), Vector(-1, 0), Vector(0, -1))  # 車可以前后左右四个方向(纵向、横向)移动, 不限格数
+    limited_move_range = 0  # 0 for no limit
 
     def retrieve_valid_moves(self, starting_square, snapshot):
         """車的走法(国际象棋与中国象棋完全相同)
@@ -422,68 +1180,285 @@ class RookUnit(StraightMovingAndAttackingUnit):
         return super(RookUnit, self).retrieve_valid_moves(starting_square, snapshot)
 
 
+@register_unit_type
 class BishopUnit(StraightMovingAndAttackingUnit):
     """国际象棋象的走法: 斜走 and 不限格数"""
-
-    def __init__(self, owner):
-        super(BishopUnit, self).__init__(owner)
-        self.directions = [Vector(1, 1), Vector(-1, 1), Vector(-1, -1), Vector(1, -1)]  # 象可以朝四个斜方向移动, 不限格数
-        self.limited_move_range = 0  # 0 for no limit
+    __slots__ = ()
+    directions = (Vector(1, 1), Vector(-1, 1), Vector(-1, -1), Vector(1, -1))  # 象可以朝四个斜方向移动, 不限格数
+    limited_move_range = 0  # 0 for no limit
 
 
+@register_unit_type
 class QueenUnit(StraightMovingAndAttackingUnit):
     """国际象棋后的走法: 直走或斜走, 并且均不限格数"""
-
-    def __init__(self, owner):
-        super(QueenUnit, self).__init__(owner)
-        self.directions = \
-            [Vector(1, 0), Vector(1, 1), Vector(0, 1), Vector(-1, 1),
-             Vector(-1, 0), Vector(-1, -1), Vector(0, -1), Vector(1, -1)]
-        self.limited_move_range = 0  # 0 for no limit
+    __slots__ = ()
+    directions = \
+        (Vector(1, 0), Vector(1, 1), Vector(0, 1), Vector(-1, 1),
+         Vector(-1, 0), Vector(-1, -1), Vector(0, -1), Vector(1, -1))
+    limited_move_range = 0  # 0 for no limit
 
 
+@register_unit_type
 class KingUnit(StraightMovingAndAttackingUnit):
     """国际象棋王的走法: 直走或斜走, 格数限制只能走1格"""
-
-    def __init__(self, owner):
-        super(KingUnit, self).__init__(owner)
-        self.directions = \
-            [Vector(1, 0), Vector(1, 1), Vector(0, 1), Vector(-1, 1),
-             Vector(-1, 0), Vector(-1, -1), Vector(0, -1), Vector(1, -1)]
-        self.limited_move_range = 1  # 王能朝各个方向走, 但只能走一格
-
-    def retrieve_valid_moves(self, starting_square, snapshot):
+    __slots__ = ()
+    directions = \
+        (Vector(1, 0), Vector(1, 1), Vector(0, 1), Vector(-1, 1),
+         Vector(-1, 0), Vector(-1, -1), Vector(0, -1), Vector(1, -1))
+    limited_move_range = 1  # 王能朝各个方向走, 但只能走一格
+    depends_on_whole_board = True  # 要排除所有被敌方控制的格子
+    royal = True
+
+    def retrieve_valid_indices(self, starting_index, snapshot):
         """国际象棋王的走法
 
-        :param starting_square: 当前位置
+        :param starting_index: 当前位置的格子编号
         :param snapshot: 作战双方棋子的位置的一个快照
-        :rtype : tuple
+        :rtype : array.array
         """
         # 王的一般走法是只能走一格(先不考虑王車易位的特殊情况)
-        regular_moves = super(KingUnit, self).retrieve_valid_moves(starting_square, snapshot)
-        result = set(regular_moves)
+        regular_moves = super(KingUnit, self).retrieve_valid_indices(starting_index, snapshot)
         # 上面几个格子可能会被将军, 逐一排除:
         # 下面要从 snapshot 中将王从自己当前所在的位置处移除
         # 否则王自己也出现在 snapshot 中, 将阻挡敌方棋子的特定进攻路线, 导致计算王可以走的逃跑路线时出现逻辑错误
         # (测试用例要注意检查被将军时, 王能否向背离敌方車、象或后的方向逃跑)
-        del snapshot[starting_square]
-        for square, node in snapshot.items():
-            if node.unit_id and node.unit.owner != self.owner:
-                dangerous_squares = node.unit.retrieve_squares_within_shooting_range(square, snapshot)
-                result -= set(dangerous_squares)
+        del snapshot[starting_index]
+        dangerous = self.__dangerous_indices(snapshot)
         # TODO: 需要获取更多信息用于实现王車易位功能
-        return tuple(result)
-
+        return array.array(snapshot.typecode, [index for index in regular_moves if index not in dangerous])
 
+    def __dangerous_indices(self, snapshot):
+        """敌方火力覆盖的全部格子编号, 调用前必须已经从快照中移除王自己"""
+        dangerous = set()
+        for index, node in snapshot.items():
+            if node.unit_id and node.unit.owner != self.owner:
+                dangerous.update(node.unit.retrieve_indices_within_shooting_range(index, snapshot))
+        return dangerous
+
+    def iter_capture_indices(self, starting_index, snapshot):
+        return self.__iter_safe_indices(_iter_captures_along_rays(self, starting_index, snapshot),
+                                        starting_index, snapshot)
+
+    def iter_quiet_indices(self, starting_index, snapshot):
+        return self.__iter_safe_indices(_iter_quiet_moves_along_rays(self, starting_index, snapshot),
+                                        starting_index, snapshot)
+
+    def __iter_safe_indices(self, indices, starting_index, snapshot):
+        """排除被敌方火力覆盖的格子; 敌方火力只在第一个候选格子出现时才计算, 并且不修改传入的快照"""
+        dangerous = None
+        for index in indices:
+            if dangerous is None:
+                snapshot = snapshot.copy()
+                del snapshot[starting_index]  # 理由同 retrieve_valid_indices()
+                dangerous = self.__dangerous_indices(snapshot)
+            if index not in dangerous:
+                yield index
+
+
+@register_unit_type
 class KnightUnit(StraightMovingAndAttackingUnit):
     """国际象棋马的走法: 马走“日”的对角, 国际象棋的马不蹩腿"""
+    __slots__ = ()
+    directions = \
+        (Vector(2, 1), Vector(1, 2), Vector(-1, 2), Vector(-2, 1),
+         Vector(-2, -1), Vector(-1, -2), Vector(1, -2), Vector(2, -1))
+    limited_move_range = 1
 
-    def __init__(self, owner):
-        super(KnightUnit, self).__init__(owner)
-        self.directions = \
-            [Vector(2, 1), Vector(1, 2), Vector(-1, 2), Vector(-2, 1),
-             Vector(-2, -1), Vector(-1, -2), Vector(1, -2), Vector(2, -1)]
-        self.limited_move_range = 1
+
+def _promote_pawn(unit, index, xmax, ymax):
+    """兵走到底排时升变为后(暂时总是选择后), 升变后的单位沿用兵的单位编码
+
+    :rtype : QueenUnit
+    """
+    y = index // xmax
+    if y != (ymax - 1 if unit.pawn_charge_direction.dy > 0 else 0):
+        return None
+    queen = QueenUnit(unit.owner)
+    queen.has_been_moved = True
+    return queen
+
+
+UNIT_ARRIVAL_HOOKS[WhitePawnUnit.type_code] = _promote_pawn
+UNIT_ARRIVAL_HOOKS[BlackPawnUnit.type_code] = _promote_pawn
+
+
+STANDARD_CHESS_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+# FEN 和坐标记法中的双方, 与 new_arena_from_fen() 的默认参数一致
+WHITE = GameArena.PlayerID(1)
+BLACK = GameArena.PlayerID(2)
+
+# FEN 字母与棋子类型的对应关系, 大写字母为白方, 小写字母为黑方
+FEN_UNIT_TYPES = {
+    'K': KingUnit, 'Q': QueenUnit, 'R': RookUnit, 'B': BishopUnit, 'N': KnightUnit, 'P': WhitePawnUnit,
+    'k': KingUnit, 'q': QueenUnit, 'r': RookUnit, 'b': BishopUnit, 'n': KnightUnit, 'p': BlackPawnUnit,
+}
+
+
+def parse_fen_placement(fen):
+    """解析 FEN 字符串的第一段(棋子布局), 允许非 8x8 的棋盘, 例如 9 路 10 行
+
+    :param fen: 完整的 FEN 字符串, 或者只有棋子布局的第一段
+    :return: 棋盘宽度, 横行数量, 按格子顺序排列的 (square, letter) 列表
+    :rtype : int, int, list
+    """
+    fields = fen.split()
+    if not fields:
+        raise ValueError('empty FEN: {!r}'.format(fen))
+    rows = fields[0].split('/')
+    ranks = len(rows)
+    width = None
+    pieces = []
+    for r, row in enumerate(rows):
+        y = ranks - 1 - r  # FEN 从第 8 横行开始描述
+        x = 0
+        empty = ''
+        for ch in row + '/':
+            if ch.isdigit():
+                empty += ch  # 空格数量可能是两位数
+                continue
+            if empty:
+                x += int(empty)
+                empty = ''
+            if ch == '/':
+                break
+            if ch not in FEN_UNIT_TYPES:
+                raise ValueError('invalid FEN piece:{!r} in {!r}'.format(ch, fen))
+            pieces.append((Square(x, y), ch))
+            x += 1
+        if width is None:
+            width = x
+        elif x != width:
+            raise ValueError('invalid FEN rank width:{!r} in {!r}'.format(row, fen))
+    pieces.sort(key=lambda item: (item[0].y, item[0].x))
+    return width, ranks, pieces
+
+
+def new_arena_from_fen(fen, white=GameArena.PlayerID(1), black=GameArena.PlayerID(2), sparse=False):
+    """按 FEN 棋子布局创建 GameArena
+
+    单位编码按格子顺序分配(a1, b1, ..., h8), 不在初始横行上的兵视为已经走过
+
+    :param sparse: 见 GameArena.__init__()
+    :rtype : GameArena
+    """
+    width, ranks, pieces = parse_fen_placement(fen)
+    arena = GameArena(width=width, ranks=ranks, sparse=sparse)
+    for square, letter in pieces:
+        unit_type = FEN_UNIT_TYPES[letter]
+        if letter.isupper():
+            has_been_moved = unit_type is WhitePawnUnit and square.y != 1
+            arena.new_unit_recruited_by_player(white, square, unit_type, has_been_moved)
+        else:
+            has_been_moved = unit_type is BlackPawnUnit and square.y != ranks - 2
+            arena.new_unit_recruited_by_player(black, square, unit_type, has_been_moved)
+    return arena
+
+
+def new_standard_chess_arena(white=GameArena.PlayerID(1), black=GameArena.PlayerID(2)):
+    """按国际象棋标准开局摆放 32 个棋子
+
+    单位编码的分配顺序与 gamegui.MyChessboard 相同: 白棋 a1~h2 为 1~16, 黑棋 a7~h8 为 17~32
+
+    :rtype : GameArena
+    """
+    return new_arena_from_fen(STANDARD_CHESS_FEN, white, black)
+
+
+# 单位类型 -> FEN 字母, 白方的单位输出为大写
+FEN_LETTERS = {
+    KingUnit: 'k', QueenUnit: 'q', RookUnit: 'r', BishopUnit: 'b', KnightUnit: 'n',
+    WhitePawnUnit: 'p', BlackPawnUnit: 'p',
+}
+
+
+def fen_of_arena(arena, white=GameArena.PlayerID(1), side_to_move=None):
+    """生成 FEN 字符串, 是 new_arena_from_fen() 的逆操作; 王車易位和吃过路兵尚未实现, 这两段总是 '-'
+
+    :param white: 白方的玩家编号, 其余玩家的单位都视为黑方
+    :param side_to_move: 轮到哪一方走棋, None 表示只输出第一段(棋子布局)
+    :rtype : str
+    """
+    width, ranks = arena.size
+    letters = {}
+    for unit_id, square, unit in arena.retrieve_units_on_board():
+        letter = FEN_LETTERS.get(type(unit))
+        if letter is None:
+            raise ValueError('unit type {} has no FEN letter'.format(type(unit).__name__))
+        letters[square] = letter.upper() if unit.owner == white else letter
+    rows = []
+    for y in range(ranks - 1, -1, -1):
+        row = ''
+        empty = 0
+        for x in range(width):
+            letter = letters.get(Square(x, y))
+            if letter is None:
+                empty += 1
+                continue
+            if empty:
+                row += str(empty)
+                empty = 0
+            row += letter
+        if empty:
+            row += str(empty)
+        rows.append(row)
+    placement = '/'.join(rows)
+    if side_to_move is None:
+        return placement
+    return '{} {} - - 0 1'.format(placement, 'w' if side_to_move == white else 'b')
+
+
+def parse_coordinate_square(arena, text):
+    """坐标记法的格子名称转换为格子编号, 例如 'e2' -> 12; 越界时上报 ValueError 异常
+
+    :rtype : int
+    """
+    return arena.index_of_square(Square(ord(text[0]) - ord('a'), int(text[1:]) - 1))
+
+
+def format_coordinate_move(arena, move):
+    """打包的走法写成坐标记法(UCI 使用的格式), 例如 'e2e4'; 兵走到底线时加上升变字母 'q'
+
+    :param arena: 走这步棋之前的局面
+    :rtype : str
+    """
+    fr, to, flags = unpack_move(move)
+    a, b = arena.square_of_index(fr), arena.square_of_index(to)
+    text = '{}{}{}{}'.format(chr(ord('a') + a.x), a.y + 1, chr(ord('a') + b.x), b.y + 1)
+    unit = arena.find_unit_on_index(fr)
+    if isinstance(unit, AbstractPawnUnit):
+        if b.y == (arena.size[1] - 1 if unit.pawn_charge_direction.dy > 0 else 0):
+            text += 'q'
+    return text
+
+
+class IllegalMoveError(ValueError):
+    pass
+
+
+def apply_coordinate_move(arena, side, text):
+    """在 arena 上替 side 走一步坐标记法的走法, 例如 'e2e4' 或 'e7e8q'
+
+    兵总是升变为后, 所以第五个字符(升变字母)只接受 'q', 写成其他棋子时按非法走法处理
+
+    :param side: 轮到走棋的一方, WHITE 或 BLACK
+    :return: 走完之后轮到走棋的一方
+    :rtype : GameArena.PlayerID
+    :raise IllegalMoveError: 走法写错了, 或者在当前局面下不合法; 出错时 arena 保持不变
+    """
+    try:
+        fr = parse_coordinate_square(arena, text[0:2])
+        to = parse_coordinate_square(arena, text[2:4])
+    except (ValueError, IndexError):
+        raise IllegalMoveError('invalid move: {}'.format(text))
+    if text[4:] not in ('', 'q'):
+        raise IllegalMoveError('unsupported promotion: {}'.format(text))
+    unit = arena.find_unit_on_index(fr)
+    unit_id = arena.find_unit_id_on_index(fr)
+    if unit is None or unit.owner != side or to not in arena.retrieve_legal_destinations_of_unit(unit_id):
+        raise IllegalMoveError('illegal move: {}'.format(text))
+    arena.move_unit_to_index(unit_id, to)
+    return BLACK if side == WHITE else WHITE
 
 
 def do_self_test():
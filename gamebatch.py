@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""多个对局同步批量计算走法: 用 NumPy 把 N 个 8x8 局面的全部单位一起计算, 代替逐个对局查询
+
+服务器上成千上万个对局的棋盘尺寸和走法规则相同. 这里把 N 个局面叠成一个 NumPy 数组, 每个单位用一个
+uint64 位棋盘表示自己的位置, 全部对局的全部单位在同一组数组运算中完成移位和掩码:
+    马、王      按 directions 中的矢量移位一次, 屏蔽绕到另一侧的纵列
+    車、象、后  沿每个方向做 Kogge-Stone 填充(移位 1, 2, 4 倍), 被阻挡的第一个格子也算在内
+    兵          直走一格, 没走过的兵再走一格, 两格都必须是空的; 斜前方只能吃敌方棋子
+    王          再排除敌方火力覆盖的格子, 计算火力时从棋盘上拿掉王自己, 与 KingUnit 的规则相同
+结果与 GameArena.retrieve_valid_moves_of_unit() 相同(伪合法走法, 王不会走进被攻击的格子),
+并按同样的射线顺序转换成 Square 元组. 王車易位和吃过路兵与 gamearena 一样尚未实现.
+
+局面数组 boards 的形状为 (N, 64, 2), dtype 为 uint8, 与 gameshm 的格子编码相同:
+    [..., 0]  单位类型编码(gamearena.UNIT_TYPES 的下标), 空格子为 0
+    [..., 1]  所属玩家 | MOVED_FLAG(单位已经走过)
+
+Usage:
+    boards = encode_arenas(arenas)
+    batch = generate_moves(boards)
+    batch.valid_moves_of_game(0)      # {起点格子编号: (Square, ...)}
+    retrieve_all_valid_moves(arenas)  # [{unit_id: (Square, ...)}], 与 GameArena.retrieve_all_valid_moves() 相同
+"""
+from __future__ import print_function
+
+import numpy
+
+import gamearena
+
+WIDTH = 8
+SQUARES = WIDTH * WIDTH
+MOVED_FLAG = 0x80  # 与 gameshm.MOVED_FLAG 相同
+
+_ONE = numpy.uint64(1)
+_EMPTY = numpy.uint64(0)
+_FULL = numpy.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+def _file_mask(files):
+    """:return: 指定纵列全部格子的位棋盘"""
+    mask = 0
+    for x in files:
+        for y in range(WIDTH):
+            mask |= 1 << (x + y * WIDTH)
+    return mask
+
+
+def _direction(dx, dy):
+    """:return: 位移量, 移位之后必须屏蔽的格子(从棋盘另一侧绕过来的纵列)"""
+    if dx > 0:
+        wrap = _file_mask(range(dx))
+    elif dx < 0:
+        wrap = _file_mask(range(WIDTH + dx, WIDTH))
+    else:
+        wrap = 0
+    return dx + dy * WIDTH, numpy.uint64(~wrap & 0xFFFFFFFFFFFFFFFF)
+
+
+def _shift(bitboards, offset):
+    if offset > 0:
+        return numpy.left_shift(bitboards, numpy.uint64(offset))
+    return numpy.right_shift(bitboards, numpy.uint64(-offset))
+
+
+def _step(bitboards, directions):
+    """每个方向走一步(马、王和兵的斜吃)"""
+    result = numpy.zeros_like(bitboards)
+    for dx, dy in directions:
+        offset, keep = _direction(dx, dy)
+        result |= _shift(bitboards, offset) & keep
+    return result
+
+
+def _slide(bitboards, empty, directions):
+    """Kogge-Stone 填充: 沿每个方向一直走到被阻挡, 阻挡的格子包括在内, 起点不包括在内
+
+    :param empty: 每个单位所在对局的空格子, 与 bitboards 形状相同
+    """
+    result = numpy.zeros_like(bitboards)
+    for dx, dy in directions:
+        offset, keep = _direction(dx, dy)
+        generator = bitboards
+        propagator = empty & keep
+        for k in (1, 2, 4):
+            generator = generator | (propagator & _shift(generator, offset * k))
+            propagator = propagator & _shift(propagator, offset * k)
+        result |= _shift(generator, offset) & keep
+    return result
+
+
+ORTHOGONAL = gamearena.RookUnit.directions
+DIAGONAL = gamearena.BishopUnit.directions
+KING_STEPS = gamearena.KingUnit.directions
+KNIGHT_STEPS = gamearena.KnightUnit.directions
+
+KING = gamearena.KingUnit.type_code
+QUEEN = gamearena.QueenUnit.type_code
+ROOK = gamearena.RookUnit.type_code
+BISHOP = gamearena.BishopUnit.type_code
+KNIGHT = gamearena.KnightUnit.type_code
+WHITE_PAWN = gamearena.WhitePawnUnit.type_code
+BLACK_PAWN = gamearena.BlackPawnUnit.type_code
+SUPPORTED_TYPES = (KING, QUEEN, ROOK, BISHOP, KNIGHT, WHITE_PAWN, BLACK_PAWN)
+
+
+def encode_arenas(arenas):
+    """把竞技场叠成局面数组
+
+    :rtype : numpy.ndarray
+    """
+    boards = numpy.zeros((len(arenas), SQUARES, 2), dtype=numpy.uint8)
+    for game, arena in enumerate(arenas):
+        if tuple(arena.size) != (WIDTH, WIDTH):
+            raise ValueError('batched move generation supports 8x8 boards only, got {}x{}'.format(*arena.size))
+        for index, type_code, owner, moved in arena.position_key():
+            boards[game, index, 0] = type_code
+            boards[game, index, 1] = owner | (MOVED_FLAG if moved else 0)
+    return boards
+
+
+def generate_moves(boards):
+    """计算全部对局中全部单位的伪合法走法
+
+    :param boards: 形状为 (N, 64, 2) 的局面数组, 见 encode_arenas()
+    :rtype : MoveBatch
+    """
+    boards = numpy.asarray(boards, dtype=numpy.uint8)
+    if boards.ndim != 3 or boards.shape[1:] != (SQUARES, 2):
+        raise ValueError('boards must have shape (N, {}, 2), got {}'.format(SQUARES, boards.shape))
+    types = boards[..., 0]
+    unknown = ~numpy.isin(types, (0,) + SUPPORTED_TYPES)
+    if unknown.any():
+        raise ValueError('unsupported unit type codes: {}'.format(sorted(set(types[unknown].tolist()))))
+
+    # 每个单位一行, numpy.nonzero 按对局、格子编号的顺序排列
+    games, squares = numpy.nonzero(types)
+    unit_types = types[games, squares]
+    owners = boards[games, squares, 1] & ~numpy.uint8(MOVED_FLAG)
+    unmoved = (boards[games, squares, 1] & MOVED_FLAG) == 0
+    units = numpy.left_shift(_ONE, squares.astype(numpy.uint64))
+
+    # 每个对局的占据格子和每个玩家的棋子; 玩家编号换成 0, 1, ... 的下标
+    player_ids, players = numpy.unique(owners, return_inverse=True)
+    occupied = numpy.zeros(len(boards), dtype=numpy.uint64)
+    numpy.bitwise_or.at(occupied, games, units)
+    own = numpy.zeros((len(boards), len(player_ids)), dtype=numpy.uint64)
+    numpy.bitwise_or.at(own, (games, players), units)
+    friendly = own[games, players]
+
+    moves = numpy.zeros_like(units)
+    empty = ~occupied[games]
+    _piece_moves(moves, units, unit_types, empty, friendly, unmoved)
+
+    # 王不能走进敌方火力: 每个单位对其他玩家的王的火力, 计算时从棋盘上拿掉那些王
+    kings = numpy.zeros_like(own)
+    is_king = unit_types == KING
+    numpy.bitwise_or.at(kings, (games[is_king], players[is_king]), units[is_king])
+    enemy_kings = numpy.bitwise_or.reduce(kings, axis=1)[games] & ~kings[games, players]
+    attacks = _shooting_range(units, unit_types, ~(occupied[games] & ~enemy_kings))
+    attacked_by = numpy.zeros_like(own)
+    numpy.bitwise_or.at(attacked_by, (games, players), attacks)
+    g, p = games[is_king], players[is_king]
+    dangerous = numpy.zeros(len(g), dtype=numpy.uint64)
+    for k in range(len(player_ids)):
+        dangerous |= numpy.where(p != k, attacked_by[g, k], _EMPTY)
+    moves[is_king] &= ~dangerous
+    return MoveBatch(len(boards), games, squares, unit_types, unmoved, moves)
+
+
+def _piece_moves(moves, units, unit_types, empty, friendly, unmoved):
+    """按类型分组计算走法, 写入 moves"""
+    rook_like = (unit_types == ROOK) | (unit_types == QUEEN)
+    bishop_like = (unit_types == BISHOP) | (unit_types == QUEEN)
+    for selected, directions in ((rook_like, ORTHOGONAL), (bishop_like, DIAGONAL)):
+        moves[selected] |= _slide(units[selected], empty[selected], directions)
+    for code, directions in ((KNIGHT, KNIGHT_STEPS), (KING, KING_STEPS)):
+        selected = unit_types == code
+        moves[selected] |= _step(units[selected], directions)
+    moves &= ~friendly
+    for code, dy in ((WHITE_PAWN, 1), (BLACK_PAWN, -1)):
+        selected = unit_types == code
+        pawns, free = units[selected], empty[selected]
+        one = _shift(pawns, dy * WIDTH) & free
+        two = _shift(one, dy * WIDTH) & free & numpy.where(unmoved[selected], _FULL, _EMPTY)
+        enemies = ~free & ~friendly[selected]
+        moves[selected] = one | two | (_step(pawns, ((1, dy), (-1, dy))) & enemies)
+
+
+def _shooting_range(units, unit_types, empty):
+    """火力范围: 被阻挡的格子本身也算, 不区分上面是敌方还是己方的棋子; 兵只有斜前方两格"""
+    attacks = numpy.zeros_like(units)
+    rook_like = (unit_types == ROOK) | (unit_types == QUEEN)
+    bishop_like = (unit_types == BISHOP) | (unit_types == QUEEN)
+    for selected, directions in ((rook_like, ORTHOGONAL), (bishop_like, DIAGONAL)):
+        attacks[selected] |= _slide(units[selected], empty[selected], directions)
+    for code, directions in ((KNIGHT, KNIGHT_STEPS), (KING, KING_STEPS),
+                             (WHITE_PAWN, ((1, 1), (-1, 1))), (BLACK_PAWN, ((1, -1), (-1, -1)))):
+        selected = unit_types == code
+        attacks[selected] = _step(units[selected], directions)
+    return attacks
+
+
+_destination_orders = {}
+
+
+def _destination_order(type_code, unmoved, index):
+    """retrieve_valid_indices() 列出终点的顺序: 按 directions 逐条射线由近及远, 兵先直走后斜吃
+
+    :rtype : tuple
+    """
+    key = (type_code, unmoved and type_code in (WHITE_PAWN, BLACK_PAWN), index)
+    order = _destination_orders.get(key)
+    if order is None:
+        unit_type = gamearena.UNIT_TYPES[type_code]
+        if issubclass(unit_type, gamearena.AbstractPawnUnit):
+            dy = unit_type.pawn_charge_direction.dy
+            rays = gamearena.ray_table(WIDTH, WIDTH, (gamearena.Vector(0, dy),), 2 if key[1] else 1)[index] + \
+                gamearena.ray_table(WIDTH, WIDTH, (gamearena.Vector(1, dy), gamearena.Vector(-1, dy)), 1)[index]
+        else:
+            rays = gamearena.ray_table(WIDTH, WIDTH, unit_type.directions, unit_type.limited_move_range)[index]
+        order = _destination_orders[key] = tuple(i for ray in rays for i in ray)
+    return order
+
+
+class MoveBatch(object):
+    """generate_moves() 的结果, 每个单位一个 uint64 走法掩码, 按对局和格子编号排列"""
+
+    def __init__(self, size, games, squares, unit_types, unmoved, moves):
+        self.size = size
+        self.games = games
+        self.squares = squares
+        self.unit_types = unit_types
+        self.unmoved = unmoved
+        self.moves = moves
+        self.__bounds = numpy.searchsorted(games, numpy.arange(size + 1))
+
+    def __len__(self):
+        return self.size
+
+    def masks_of_game(self, game):
+        """
+        :return: 起点格子编号 -> 终点的位棋盘(第 i 位表示格子编号 i)
+        :rtype : dict
+        """
+        begin, end = self.__bounds[game], self.__bounds[game + 1]
+        return dict(zip(self.squares[begin:end].tolist(), self.moves[begin:end].tolist()))
+
+    def valid_moves_of_game(self, game):
+        """
+        :return: 起点格子编号 -> 全部可达位置, 与 retrieve_valid_moves_of_unit() 的形式和顺序相同
+        :rtype : dict
+        """
+        square_of = gamearena.square_table(WIDTH).__getitem__
+        begin, end = self.__bounds[game], self.__bounds[game + 1]
+        result = {}
+        for index, type_code, unmoved, mask in zip(self.squares[begin:end].tolist(),
+                                                   self.unit_types[begin:end].tolist(),
+                                                   self.unmoved[begin:end].tolist(),
+                                                   self.moves[begin:end].tolist()):
+            result[index] = tuple(square_of(i) for i in _destination_order(type_code, unmoved, index)
+                                  if mask >> i & 1)
+        return result
+
+
+def retrieve_all_valid_moves(arenas):
+    """批量版本的 GameArena.retrieve_all_valid_moves()
+
+    :return: 每个竞技场一个字典 unit_id -> 该单位所有可达位置
+    :rtype : list
+    """
+    batch = generate_moves(encode_arenas(arenas))
+    result = []
+    for game, arena in enumerate(arenas):
+        moves = batch.valid_moves_of_game(game)
+        result.append(dict((arena.find_unit_id_on_index(index), destinations)
+                           for index, destinations in moves.items()))
+    return result
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""基于 GameArena 规则的对弈引擎: 迭代加深的 negamax alpha-beta 搜索, 置换表, 主要变例(PV)
+
+走法都是 gamearena.pack_move() 打包的整数, 试走时用 GameArena.copy() 复制局面, 不需要悔棋操作.
+轮到哪一方走棋不由 GameArena 记录, 由调用者通过 player 参数指定.
+
+Usage:
+    python gameengine.py [--depth 3] [--fen FEN]
+"""
+from __future__ import print_function
+
+import collections
+import time
+
+import gamearena
+
+# 子力价值(单位: 兵=100), 王不计入子力
+PIECE_VALUES = {
+    gamearena.KingUnit: 0,
+    gamearena.QueenUnit: 900,
+    gamearena.RookUnit: 500,
+    gamearena.BishopUnit: 330,
+    gamearena.KnightUnit: 320,
+    gamearena.WhitePawnUnit: 100,
+    gamearena.BlackPawnUnit: 100,
+}
+
+MATE_SCORE = 100000  # 将死的分数, 实际返回 MATE_SCORE - 步数, 越快将死分数越高
+MATE_BOUND = MATE_SCORE - 1000  # 绝对值超过这个数的分数是将死分数(搜索深度远小于 1000 步)
+
+# 置换表条目的分数类型
+BOUND_EXACT = 0
+BOUND_LOWER = 1  # 发生了 beta 剪枝, 真实分数 >= 记录的分数
+BOUND_UPPER = 2  # 没有走法超过 alpha, 真实分数 <= 记录的分数
+
+SearchResult = collections.namedtuple('SearchResult', ['move', 'score', 'depth', 'nodes', 'pv', 'elapsed'])
+
+
+class SearchStopped(Exception):
+    """搜索被 stop_event 或时间限制中止"""
+    pass
+
+
+class TranspositionTable(object):
+    """局面 -> (深度, 分数, 分数类型, 最佳走法), 条目数超过容量时整体清空"""
+
+    def __init__(self, capacity=1 << 16):
+        self.__capacity = capacity
+        self.__entries = {}
+        self.hits = 0
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key):
+        entry = self.__entries.get(key)
+        if entry is not None:
+            self.hits += 1
+        return entry
+
+    def put(self, key, depth, score, bound, move):
+        if len(self.__entries) >= self.__capacity and key not in self.__entries:
+            self.__entries.clear()
+        self.__entries[key] = (depth, score, bound, move)
+
+    def clear(self):
+        self.__entries.clear()
+        self.hits = 0
+
+
+def score_to_tt(score, ply):
+    """将死分数从"距根节点的步数"换算成"距当前节点的步数"再存入置换表, 经由不同路径到达同一局面时仍然正确"""
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def score_from_tt(score, ply):
+    """score_to_tt() 的逆运算"""
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+
+def opponent_of(arena, player):
+    """棋盘上第一个不属于 player 的单位的所属玩家, 棋盘上只有一方时返回 None"""
+    for unit_id, square, unit in arena.retrieve_units_on_board():
+        if unit.owner != player:
+            return unit.owner
+    return None
+
+
+def apply_move(arena, move):
+    """在 arena 上走一步打包的走法"""
+    fr, to, flags = gamearena.unpack_move(move)
+    arena.move_unit_to_index(arena.find_unit_id_on_index(fr), to)
+
+
+def position_key(arena, player):
+    """置换表的键: 棋子布局加上轮到走棋的一方"""
+    return arena.position_key(), player
+
+
+class Engine(object):
+    """一种引擎配置, 同一个实例的置换表在多次搜索之间保留
+
+    :param depth: 迭代加深的最大深度(半回合)
+    :param tt_size: 置换表容量, 0 表示不使用置换表
+    :param ordering: 是否对走法排序(置换表走法优先, 然后按 MVV-LVA 排列吃子走法)
+    :param mobility: 评估函数中每个合法走法的加分, 0 表示只计算子力和位置
+    :param time_limit: 每步棋的搜索时间上限(秒), None 表示只受深度限制
+    """
+
+    def __init__(self, depth=3, tt_size=1 << 16, ordering=True, mobility=0, time_limit=None, name=None):
+        self.depth = int(depth)
+        self.ordering = bool(ordering)
+        self.mobility = mobility
+        self.time_limit = time_limit
+        self.name = name or 'depth{}'.format(self.depth)
+        self.tt = TranspositionTable(tt_size) if tt_size else None
+        self.nodes = 0
+        self.__deadline = None
+        self.__stop_event = None
+
+    def search(self, arena, player, depth=None, stop_event=None, time_limit=None, on_iteration=None):
+        """迭代加深搜索, 返回最后一次完整完成的迭代的结果
+
+        :param arena: 当前局面, 搜索过程中不会被修改
+        :param player: 轮到走棋的玩家
+        :param depth: 覆盖 self.depth
+        :param stop_event: threading.Event 或 multiprocessing.Event, 被设置后尽快停止搜索
+        :param time_limit: 覆盖 self.time_limit
+        :param on_iteration: 每完成一次迭代调用 on_iteration(SearchResult)
+        :return: 没有合法走法时 move 为 None
+        :rtype : SearchResult
+        """
+        started = time.perf_counter()
+        depth = self.depth if depth is None else depth
+        time_limit = self.time_limit if time_limit is None else time_limit
+        self.__deadline = started + time_limit if time_limit else None
+        self.__stop_event = stop_event
+        self.nodes = 0
+        opponent = opponent_of(arena, player)
+        moves = arena.retrieve_packed_legal_moves(player)
+        if not moves:
+            score = -MATE_SCORE if arena.is_in_check(player) else 0
+            return SearchResult(None, score, 0, 0, (), time.perf_counter() - started)
+        result = SearchResult(moves[0], 0, 0, 0, (moves[0],), 0.0)
+        for d in range(1, depth + 1):
+            try:
+                score, pv = self.__negamax(arena, player, opponent, d, -MATE_SCORE - 1, MATE_SCORE + 1, 0)
+            except SearchStopped:
+                break
+            result = SearchResult(pv[0] if pv else moves[0], score, d, self.nodes, tuple(pv),
+                                  time.perf_counter() - started)
+            if on_iteration is not None:
+                on_iteration(result)
+            if abs(score) >= MATE_SCORE - d:
+                break  # 已经找到将死, 更深的搜索不会改变结果
+        return result._replace(nodes=self.nodes, elapsed=time.perf_counter() - started)
+
+    def __check_stop(self):
+        if self.__stop_event is not None and self.__stop_event.is_set():
+            raise SearchStopped()
+        if self.__deadline is not None and time.perf_counter() >= self.__deadline:
+            raise SearchStopped()
+
+    def __negamax(self, arena, player, opponent, depth, alpha, beta, ply):
+        """
+        :return: 从 player 角度看的分数, 主要变例
+        :rtype : int, list
+        """
+        self.nodes += 1
+        if self.nodes & 15 == 0:  # 每个节点要生成合法走法, 耗时约 0.3 ms, 每 16 个节点检查一次即可及时响应 stop
+            self.__check_stop()
+        tt = self.tt
+        key = None
+        tt_move = None
+        if tt is not None:
+            key = position_key(arena, player)
+            entry = tt.get(key)
+            if entry is not None:
+                entry_depth, score, bound, tt_move = entry
+                score = score_from_tt(score, ply)
+                if entry_depth >= depth and ply > 0:
+                    if bound == BOUND_EXACT or \
+                            (bound == BOUND_LOWER and score >= beta) or (bound == BOUND_UPPER and score <= alpha):
+                        return score, [tt_move] if tt_move is not None else []
+        moves = arena.retrieve_packed_legal_moves(player)
+        if not moves:
+            return (-MATE_SCORE + ply if arena.is_in_check(player) else 0), []
+        if depth <= 0:
+            return self.evaluate(arena, player, moves), []
+        if self.ordering:
+            moves = self.__order_moves(arena, moves, tt_move)
+        original_alpha = alpha
+        best_score = -MATE_SCORE - 1
+        best_pv = []
+        for move in moves:
+            child = arena.copy()
+            apply_move(child, move)
+            score, pv = self.__negamax(child, opponent, player, depth - 1, -beta, -alpha, ply + 1)
+            score = -score
+            if score > best_score:
+                best_score = score
+                best_pv = [move] + pv
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        if tt is not None:
+            if best_score <= original_alpha:
+                bound = BOUND_UPPER
+            elif best_score >= beta:
+                bound = BOUND_LOWER
+            else:
+                bound = BOUND_EXACT
+            tt.put(key, depth, score_to_tt(best_score, ply), bound, best_pv[0])
+        return best_score, best_pv
+
+    @staticmethod
+    def __order_moves(arena, moves, tt_move):
+        """置换表走法优先, 然后是吃子走法(先吃价值高的棋子, 同等情况下用价值低的棋子去吃), 最后是其余走法"""
+        def priority(move):
+            if move == tt_move:
+                return -1 << 30
+            fr, to, flags = gamearena.unpack_move(move)
+            if not flags & gamearena.MOVE_FLAG_CAPTURE:
+                return 0
+            victim = PIECE_VALUES.get(type(arena.find_unit_on_index(to)), 0)
+            attacker = PIECE_VALUES.get(type(arena.find_unit_on_index(fr)), 0)
+            return attacker - victim * 10
+        return sorted(moves, key=priority)
+
+    def evaluate(self, arena, player, moves=None):
+        """静态评估, 从 player 的角度计分: 子力 + 兵的推进 + 马和象靠近中心 + 可选的机动性
+
+        :param moves: player 的合法走法, 已经算出时传入可以避免重复计算
+        :rtype : int
+        """
+        xmax, ymax = arena.size
+        cx, cy = (xmax - 1) * 0.5, (ymax - 1) * 0.5
+        score = 0
+        for unit_id, square, unit in arena.retrieve_units_on_board():
+            value = PIECE_VALUES.get(type(unit), 0)
+            if isinstance(unit, gamearena.AbstractPawnUnit):
+                dy = unit.pawn_charge_direction.dy
+                value += 5 * (square.y if dy > 0 else ymax - 1 - square.y)
+            elif isinstance(unit, (gamearena.KnightUnit, gamearena.BishopUnit)):
+                value -= int(4 * (abs(square.x - cx) + abs(square.y - cy)))
+            score += value if unit.owner == player else -value
+        if self.mobility:
+            if moves is None:
+                moves = arena.retrieve_packed_legal_moves(player)
+            score += self.mobility * len(moves)
+        return score
+
+
+def format_move_sequence(arena, moves):
+    """按顺序试走, 逐个格式化主要变例中的走法"""
+    arena = arena.copy()
+    for move in moves:
+        yield gamearena.format_coordinate_move(arena, move)
+        apply_move(arena, move)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='search one position with gameengine')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fen', default=gamearena.STANDARD_CHESS_FEN)
+    args = parser.parse_args(argv)
+
+    arena = gamearena.new_arena_from_fen(args.fen)
+    fields = args.fen.split()
+    player = gamearena.GameArena.PlayerID(2 if len(fields) > 1 and fields[1] == 'b' else 1)
+    engine = Engine(depth=args.depth)
+
+    def report(result):
+        print('depth {} score {} nodes {} time {:.3f} s pv {}'.format(
+            result.depth, result.score, result.nodes, result.elapsed,
+            ' '.join(format_move_sequence(arena, result.pv))))
+
+    result = engine.search(arena, player, on_iteration=report)
+    print('bestmove {}'.format(gamearena.format_coordinate_move(arena, result.move) if result.move is not None else '(none)'))
+
+
+if '__main__' == __name__:
+    main()
@@ -2,15 +2,20 @@
 # -*-encoding:utf8;-*-
 from __future__ import print_function
 
+import os
 import sys
 import math
+import time
+import concurrent.futures
 import panda3d.core
+import direct.showbase.DirectObject
 import direct.showbase.ShowBase
 import direct.gui.OnscreenText
 import direct.task.Task
-import direct.interval.LerpInterval
 import direct.gui.DirectCheckButton
 import gamearena
+import gamejournal
+import gameprofiler
 
 
 class IllegalMoveException(Exception):
@@ -18,9 +23,23 @@ class IllegalMoveException(Exception):
 
 
 class MyChessboard(direct.showbase.ShowBase.ShowBase):
-    def __init__(self, fStartDirect=True, windowType=None):
+    def __init__(self, fStartDirect=True, windowType=None, profileCsv=None, enginePlayer=None, engineDepth=4,
+                 pondering=True, journalPath=None):
+        """
+        :param profileCsv: 按 F4 键导出性能统计数据的 CSV 文件路径, 默认按时间生成文件名
+        :param enginePlayer: 由引擎执棋的一方, 1 为白棋, 2 为黑棋; None 表示双方都由鼠标操作且不限制走棋顺序
+        :param engineDepth: 引擎的搜索深度(半回合)
+        :param pondering: 轮到人走棋时引擎是否在后台预先思考
+        :param journalPath: 走棋日志文件, 已经存在时先重放其中的走法恢复上次的对局, 之后的走法继续追加, 见 gamejournal
+        """
         direct.showbase.ShowBase.ShowBase.__init__(self, fStartDirect=fStartDirect, windowType=windowType)
         self.disableMouse()
+        # 热点路径计时, 按 F3 键开关屏幕统计图, 连接 pstats 后也能看到同名的收集器
+        self.profiler = gameprofiler.HotPathProfiler(PROFILED_SECTIONS)
+        # 全部棋子的悬停和落下动画由一个任务推进, 见 PieceAnimationScheduler
+        self.animations = PieceAnimationScheduler(self.taskMgr, self.profiler)
+        self.__profileCsv = profileCsv
+        self.__profilerOverlay = None
         # Since we are using collision detection to do picking, we set it up like
         # any other collision detection system with a traverser and a handler
         self.__picker = panda3d.core.CollisionTraverser()
@@ -46,11 +65,9 @@ class MyChessboard(direct.showbase.ShowBase.ShowBase):
         # 载入棋子模型
         white_piece_model = self.__selectChessPieceModelSytle('models/default')
         black_piece_model = self.__selectChessPieceModelSytle('models/default')
+        self.__pieceModels = {'WHITE': white_piece_model, 'BLACK': black_piece_model}  # 缩略图模式重复使用这两套模型
         name_order = ['rook', 'knight', 'bishop', 'queen', 'king', 'bishop', 'knight', 'rook']
-        colors = {
-            'WHITE': (1.000, 1.000, 1.000, 1),  # RGB color for WHITE pieces
-            'BLACK': (0.150, 0.150, 0.150, 1),  # RGB color for BLACK pieces
-        }
+        colors = PieceColor
 
         # 利用 GameArena() 进行沙盘推演，是为了检查每个棋子的走法是否符合国际象棋规则
         self.arena = gamearena.GameArena(8, 8)
@@ -80,7 +97,7 @@ class MyChessboard(direct.showbase.ShowBase.ShowBase):
             point = (i % 8, i // 8)
             pid = self.arena.new_unit_recruited_by_player(white_player, point, white_unit_type_list[name])
             piece_id_sorted_by_square[i] = pid
-            piece = CustomizedPiece(piece_holder, mask=panda3d.core.BitMask32.bit(1))
+            piece = CustomizedPiece(piece_holder, mask=panda3d.core.BitMask32.bit(1), scheduler=self.animations)
             piece.setTag('piece', str(pid))
             pieces_sorted_by_square[i] = piece
             pieces_sorted_by_id[pid] = piece
@@ -94,7 +111,7 @@ class MyChessboard(direct.showbase.ShowBase.ShowBase):
             point = (i % 8, i // 8)
             pid = self.arena.new_unit_recruited_by_player(black_player, point, black_unit_type_list[name])
             piece_id_sorted_by_square[i] = pid
-            piece = CustomizedPiece(piece_holder, mask=panda3d.core.BitMask32.bit(1))
+            piece = CustomizedPiece(piece_holder, mask=panda3d.core.BitMask32.bit(1), scheduler=self.animations)
             piece.setTag('piece', str(pid))
             pieces_sorted_by_square[i] = piece
             pieces_sorted_by_id[pid] = piece
@@ -116,10 +133,41 @@ class MyChessboard(direct.showbase.ShowBase.ShowBase):
         self.__dragging = 0  # 取值范围: 整数 0 表示当前鼠标指针没有拖拽住棋盘格子上的棋子, 整数 1~64 表示正在拖拽, 被拖拽的棋子原位于 64 个棋盘方格之一
         self.__finger = self.__pieceRoot.attachNewNode('fingerTouching')  # 后面用于设定用户手指正在触摸的棋盘位置
         self.__mouse3 = None # 用于鼠标右键
+        self.__mouse = None  # 本帧的鼠标位置 (x, y), 鼠标不在窗口中时为 None, 由 inputTask 每帧更新一次
+        self.__inputSource = None  # 重放录制的输入时代替真实的鼠标和按键, 见 gamerecord
+        self.__recorder = None
+        self.__recorderListener = None
+        # 走法查询在后台线程中计算, 避免在输入事件处理函数中卡住画面
+        # __moveQuery 为 (序号, 格子编号, 棋子编号, future), 序号与 __moveQuerySerial 不一致的结果视为过期
+        self.__moveQueryExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.__moveQuery = None
+        self.__moveQuerySerial = 0
+        # 鼠标悬停时预先计算的走法缓存: 棋子编号 -> 有效终点格子编号, 仅对 __moveCacheRevision 版本的局面有效
+        self.__moveCache = {}
+        self.__moveCacheFutures = {}  # 棋子编号 -> 尚未完成的后台计算
+        self.__moveCacheRevision = self.arena.revision
+        self.__moveCacheHits = 0
+        self.__moveCacheMisses = 0
         self.__hsymbol = 1
+        # 人机对弈: 引擎在子进程中搜索, 轮到人走棋时预先搜索猜测的应着之后的局面, 见 gameponder
+        self.__players = (white_player, black_player)
+        self.__engine = None
+        self.__journal = None
+        self.__sideToMove = self.__players[0]
+        if journalPath:
+            self.__sideToMove = self.__openJournal(journalPath)
+        if enginePlayer:
+            import gameponder  # 只有人机对弈才需要 multiprocessing, 延迟导入以缩短启动时间
+            self.__engine = gameponder.PonderingEngine(
+                gamearena.GameArena.PlayerID(enginePlayer), {'depth': engineDepth}, pondering=pondering)
+            self.taskMgr.add(self.engineTask, 'EngineTask')
+            if self.__engine.player == self.__sideToMove:
+                self.__engine.start_thinking(self.arena)
         # 注册回调函数
+        self.taskMgr.add(self.inputTask, 'InputTask', sort=-10)  # 在 dataLoop 更新鼠标之后, 按键事件和 mouseTask 之前
         self.taskMgr.add(self.mouseTask, 'MouseTask')
-        self.accept('escape', sys.exit)  # 键盘 Esc 键
+        self.taskMgr.add(self.moveQueryTask, 'MoveQueryTask')
+        self.accept('escape', self.quit)  # 键盘 Esc 键
         self.accept("mouse1", self.onMouse1Pressed)  # left-click grabs a piece
         self.accept("mouse1-up", self.onMouse1Released)  # releasing places it
         self.accept("mouse3", self.onMouse3Pressed)
@@ -133,6 +181,9 @@ class MyChessboard(direct.showbase.ShowBase.ShowBase):
         self.accept('page_down', self.onKeyboardPageDownPressed)  # 同上
         self.accept('wheel_up', self.onMouseWheelRolledUpwards)  # 鼠标滚轮实现镜头缩放
         self.accept('wheel_down', self.onMouseWheelRolledDownwards)  # 同上
+        self.accept('f3', self.toggleProfilerOverlay)
+        self.accept('f4', self.dumpProfilerCsv)
+        self.taskMgr.add(self.profilerTask, 'ProfilerTask', sort=-100)
 
     def __defaultLabels(self):
         labels = [
@@ -155,12 +206,23 @@ class MyChessboard(direct.showbase.ShowBase.ShowBase):
                 text="PageUp/PageDown: Camera orientation",
                 parent=self.a2dTopLeft, align=panda3d.core.TextNode.ALeft,
                 style=1, fg=(1, 1, 1, 1), pos=(0.06, -0.2), scale=.05)
+            ,
+            direct.gui.OnscreenText.OnscreenText(
+                text="F3: Profiler overlay  F4: Save profile as CSV",
+                parent=self.a2dTopLeft, align=panda3d.core.TextNode.ALeft,
+                style=1, fg=(1, 1, 1, 1), pos=(0.06, -0.25), scale=.05)
         ]
         return labels
 
     def mouseTask(self, task):
         """mouseTask deals with the highlighting and dragging based on the mouse"""
+        started = self.profiler.start('mouseTask')
+        try:
+            return self.__mouseTask(task)
+        finally:
+            self.profiler.stop('mouseTask', started)
 
+    def __mouseTask(self, task):
         marks = self.__chessboard['marks']
         squareRoot = self.__chessboard['squareRoot']
 
@@ -176,15 +238,15 @@ class MyChessboard(direct.showbase.ShowBase.ShowBase):
             self.__pointingTo = False
 
         # Check to see if we can access the mouse. We need its coordinates later
-        if not self.mouseWatcherNode.hasMouse():
+        if self.__mouse is None:  # 离屏模式下没有 mouseWatcherNode
             # 当前某个时刻鼠标不可用
             return direct.task.Task.cont
 
         # get the mouse position
-        mpos = self.mouseWatcherNode.getMouse()
+        mx, my = self.__mouse
 
         # Set the position of the ray based on the mouse position
-        self.__pickerRay.setFromLens(self.camNode, mpos.getX(), mpos.getY())
+        self.__pickerRay.setFromLens(self.camNode, mx, my)
 
         # 检查鼠标指针指向的棋盘水平面的点的坐标
         p = self.render.getRelativePoint(self.camera, self.__pickerRay.getOrigin())
@@ -212,21 +274,18 @@ class MyChessboard(direct.showbase.ShowBase.ShowBase):
         # z = 0
 
         if self.__dragging:
-            # 当前拖拽棋子的手指的正下方对应的棋盘格子
+            # 当前拖拽棋子的正下方对应的棋盘格子
+            # 棋盘方格是边长为 1 的正方形, 由棋子中心坐标直接推算格子编号, 不需要为每个棋子单独做碰撞检测
             i = self.__dragging - 1
-            piece = self.__pieceOnSquare[i]
-            piece.picker.traverse(squareRoot)  # 检查棋子正下方的格子编号
-            if piece.handler.getNumEntries() > 0:
-                # if we have hit something, sort the hits so that the closest is first, and make a mark
-                piece.handler.sortEntries()
-                entry = piece.handler.getEntry(0)
-                tag = 'square'
-                value = entry.getIntoNode().getTag(tag)
-                i = int(value)
+            pos = self.__pieceOnSquare[i].getPos(self.__chessboardTopCenter)
+            i = MyChessboard.__squareIndexAt(pos.getX(), pos.getY())
+            if i is not None:
                 self.__pointingTo = i + 1
         else:
             # Do the actual collision pass (Do it only on the squares for efficiency purposes)
+            started = self.profiler.start('collision')
             self.__picker.traverse(self.__pieceRoot)  # 检查鼠标指向哪个棋子
+            self.profiler.stop('collision', started)
             if self.__handler.getNumEntries() > 0:
                 self.__handler.sortEntries()
                 entry = self.__handler.getEntry(0)
@@ -243,7 +302,9 @@ class MyChessboard(direct.showbase.ShowBase.ShowBase):
                             break
             else:
                 # Do the actual collision pass with squareRoot
+                started = self.profiler.start('collision')
                 self.__picker.traverse(squareRoot)
+                self.profiler.stop('collision', started)
                 if self.__handler.getNumEntries() > 0:
                     # if we have hit something, sort the hits so that the closest is first, and make a mark
                     self.__handler.sortEntries()
@@ -261,16 +322,17 @@ class MyChessboard(direct.showbase.ShowBase.ShowBase):
             if self.__hasPieceOnSquare(i):
                 if not self.__dragging or (self.__dragging and self.__pointingTo != self.__dragging):
                     self.__pieceOnSquare[i].showBounds()
+                self.__prefetchValidMarks(self.__pidOnSquare[i])
         if self.__mouse3:
             fold = 50
-            h = self.__mouse3[2] + self.__hsymbol*fold*(self.__mouse3[0] - mpos.getX())
-            p = self.__mouse3[3] - fold*(self.__mouse3[1] - mpos.getY())
+            h = self.__mouse3[2] + self.__hsymbol*fold*(self.__mouse3[0] - mx)
+            p = self.__mouse3[3] - fold*(self.__mouse3[1] - my)
             self.axisCameraPitching.setH(h)
             if p < 0 and p > -90:
                 self.axisCameraPitching.setP(p)
-            h_symbol =  1 if mpos.getY() <=0 else -1
+            h_symbol =  1 if my <=0 else -1
             if h_symbol!=self.__hsymbol:
-                self.__mouse3 = (mpos.getX(),mpos.getY(),self.axisCameraPitching.getH(),self.axisCameraPitching.getP())
+                self.__mouse3 = (mx,my,self.axisCameraPitching.getH(),self.axisCameraPitching.getP())
                 self.__hsymbol = h_symbol
         return direct.task.Task.cont
 
@@ -345,6 +407,14 @@ class MyChessboard(direct.showbase.ShowBase.ShowBase):
         return bool(self.__pieceOnSquare[i])
 
     def onMouse1Pressed(self):
+        """mouse1 事件, 计时后交给 __onMouse1Pressed()"""
+        started = self.profiler.start('mouse1Pressed')
+        try:
+            self.__onMouse1Pressed()
+        finally:
+            self.profiler.stop('mouse1Pressed', started)
+
+    def __onMouse1Pressed(self):
         """鼠标左键被按下时
 
         Case A: 初始情况没有拖拽其他棋子，此时如果鼠标正指向棋盘上的方格并且方格上有棋子，按下鼠标左键将拖拽该棋子
@@ -380,21 +450,7 @@ class MyChessboard(direct.showbase.ShowBase.ShowBase):
                 self.__pieceOnSquare[i].reparentTo(self.__finger)  # 抓起一个棋子i
                 self.__pieceOnSquare[i].setPos(x, y, 0)
                 self.__pieceOnSquare[i].play('hovering')
-                destinations = mark_indexes_from_coordinates(
-                    self.arena.retrieve_valid_moves_of_unit(unit_id=self.__pidOnSquare[i])
-                )
-                current = {i}
-                previous = self.__validMarks
-                self.__validMarks = set(destinations) | current
-                marks = self.__chessboard['marks']
-                marks[i].setColor(MarkColor['STARTING_POINT'])
-                for tmp in previous - self.__validMarks:
-                    marks[tmp].setColor(MarkColor['UNACCEPTABLE_MOVE'])
-                for tmp in destinations:
-                    marks[tmp].setColor(MarkColor['ACCEPTABLE_MOVE'])
-                if self.__marksAlwaysVisible:
-                    for tmp in self.__validMarks:
-                        marks[tmp].show()
+                self.__showValidMarks(i)
             return
 
         # When we are pointing to the chessboard and we know that we are dragging something already:
@@ -427,21 +483,7 @@ class MyChessboard(direct.showbase.ShowBase.ShowBase):
                     y = squarePos.getY() - self.__finger.getY()
                     self.__pieceOnSquare[k2].setPos(x, y, 0)
                     self.__pieceOnSquare[k2].play('hovering')
-                    destinations = mark_indexes_from_coordinates(
-                        self.arena.retrieve_valid_moves_of_unit(unit_id=self.__pidOnSquare[k2])
-                    )
-                    current = {k2}
-                    previous = self.__validMarks
-                    self.__validMarks = set(destinations) | current
-                    marks = self.__chessboard['marks']
-                    marks[k2].setColor(MarkColor['STARTING_POINT'])
-                    for tmp in previous - self.__validMarks:
-                        marks[tmp].setColor(MarkColor['UNACCEPTABLE_MOVE'])
-                    for tmp in destinations:
-                        marks[tmp].setColor(MarkColor['ACCEPTABLE_MOVE'])
-                    if self.__marksAlwaysVisible:
-                        for tmp in self.__validMarks:
-                            marks[tmp].show()
+                    self.__showValidMarks(k2)
             j = self.__dragging - 1
             self.__pieceOnSquare[j].reparentTo(self.__finger)  # 再抓起一个棋子j
             return
@@ -466,7 +508,138 @@ class MyChessboard(direct.showbase.ShowBase.ShowBase):
                 marks[i].hide()
         return
 
+    def __showValidMarks(self, i):
+        """立即标出刚被抓起的棋子 i 的起点; 有效走法如已缓存则一并标出, 否则交给后台线程计算, 结果到达后由 moveQueryTask 填充
+
+        :param i: 棋子所在格子编号, 有效范围: 0<=i<64
+        """
+        started = self.profiler.start('marks')
+        previous = self.__validMarks
+        self.__validMarks = {i}
+        marks = self.__chessboard['marks']
+        marks[i].setColor(MarkColor['STARTING_POINT'])
+        for tmp in previous - self.__validMarks:
+            marks[tmp].setColor(MarkColor['UNACCEPTABLE_MOVE'])
+        if self.__marksAlwaysVisible:
+            marks[i].show()
+        self.profiler.stop('marks', started)
+        self.__moveQuerySerial += 1  # 之前尚未返回的查询结果将被丢弃
+        pid = self.__pidOnSquare[i]
+        destinations = self.__cachedValidMarks(pid)
+        if destinations is not None:
+            self.__fillValidMarks(i, destinations)
+            return
+        future = self.__submitValidMarks(pid)
+        self.__moveQuery = (self.__moveQuerySerial, i, pid, future)
+
+    def __fillValidMarks(self, i, destinations):
+        """用不同颜色标出棋子 i 的全部有效终点"""
+        started = self.profiler.start('marks')
+        self.__validMarks = set(destinations) | {i}
+        marks = self.__chessboard['marks']
+        for tmp in destinations:
+            marks[tmp].setColor(MarkColor['ACCEPTABLE_MOVE'])
+        if self.__marksAlwaysVisible:
+            for tmp in destinations:
+                marks[tmp].show()
+        self.profiler.stop('marks', started)
+
+    def __cachedValidMarks(self, pid):
+        """查询走法缓存并计入命中率
+
+        :return: 有效终点格子编号, 未命中时返回 None
+        """
+        self.__collectPrefetchedMarks()
+        destinations = self.__moveCache.get(pid)
+        if destinations is None:
+            self.__moveCacheMisses += 1
+        else:
+            self.__moveCacheHits += 1
+        return destinations
+
+    def __submitValidMarks(self, pid):
+        """在后台线程中计算棋子 pid 的走法, 同一局面下同一棋子不会重复提交
+
+        :rtype : concurrent.futures.Future
+        """
+        if self.__moveCacheRevision != self.arena.revision:
+            self.__invalidateMoveCache()
+        future = self.__moveCacheFutures.get(pid)
+        if future is None:
+            future = self.__moveQueryExecutor.submit(self.__computeValidMarks, pid)
+            self.__moveCacheFutures[pid] = future
+        return future
+
+    def __prefetchValidMarks(self, pid):
+        """鼠标悬停在棋子上时, 利用空闲时间预先计算它的走法"""
+        if pid not in self.__moveCache:
+            self.__submitValidMarks(pid)
+
+    def __collectPrefetchedMarks(self):
+        """把已完成的后台计算结果放入走法缓存"""
+        if self.__moveCacheRevision != self.arena.revision:
+            self.__invalidateMoveCache()
+        for pid, future in list(self.__moveCacheFutures.items()):
+            if future.done():
+                del self.__moveCacheFutures[pid]
+                if future.exception() is None:
+                    self.__moveCache[pid] = future.result()
+
+    def __invalidateMoveCache(self):
+        """局面改变后清空走法缓存; 调用前后台线程必须已经空闲"""
+        self.__moveCache.clear()
+        self.__moveCacheFutures.clear()
+        self.__moveCacheRevision = self.arena.revision
+
+    def getMoveCacheStats(self):
+        """
+        :return: 走法缓存命中次数, 未命中次数, 命中率
+        :rtype : int, int, float
+        """
+        hits, misses = self.__moveCacheHits, self.__moveCacheMisses
+        total = hits + misses
+        return hits, misses, (float(hits) / total if total else 0.0)
+
+    def __computeValidMarks(self, pid):
+        """在后台线程中执行, 不访问场景图
+
+        查询会填充 arena 的走法缓存和合法性缓存, 所以 arena 的走法查询全部在这一个后台线程中进行,
+        主线程修改 arena 之前先调用 __waitForMoveQuery()
+        """
+        started = time.perf_counter()
+        destinations = self.arena.retrieve_legal_destinations_of_unit(pid)
+        self.profiler.add_sample('validMoves', (time.perf_counter() - started) * 1e3)
+        return destinations
+
+    def __waitForMoveQuery(self):
+        """修改 arena 之前必须等待后台查询结束, 保证后台线程不会读到走了一半的局面"""
+        if self.__moveCacheFutures:
+            concurrent.futures.wait(list(self.__moveCacheFutures.values()))
+
+    def moveQueryTask(self, task):
+        """收集预取结果; 后台查询完成后, 如果选中的棋子没有变化则填充走法标记, 否则丢弃结果"""
+        self.__collectPrefetchedMarks()
+        query = self.__moveQuery
+        if not query or not query[3].done():
+            return direct.task.Task.cont
+        self.__moveQuery = None
+        serial, i, pid, future = query
+        if serial != self.__moveQuerySerial or self.__dragging - 1 != i or self.__pidOnSquare[i] != pid:
+            return direct.task.Task.cont  # 选中的棋子已经改变, 结果过期
+        if future.exception() is not None:
+            return direct.task.Task.cont
+        self.__fillValidMarks(i, future.result())
+        return direct.task.Task.cont
+
     def onMouse1Released(self):
+        """mouse1-up 事件, 计时后交给 __onMouse1Released()"""
+        started = self.profiler.start('mouse1Released')
+        try:
+            self.__onMouse1Released()
+        finally:
+            self.profiler.stop('mouse1Released', started)
+
+    def __onMouse1Released(self):
         """鼠标左键被松开时
 
         Case A: 试着将当前拖拽的棋子移动到新位置 (再根据棋子移动规则判定能否这么走)
@@ -483,7 +656,7 @@ class MyChessboard(direct.showbase.ShowBase.ShowBase):
         # When we are pointing to the chessboard, and we has been dragging a piece:
         if self.__pointingTo != self.__dragging:
             try:  # try to drag this piece to the new place. See Case A
-                self.__movePiece(self.__dragging - 1, self.__pointingTo - 1)
+                self.__movePiece(self.__dragging - 1, self.__pointingTo - 1, byHuman=True)
             except IllegalMoveException:
                 pass
             else:
@@ -504,10 +677,12 @@ class MyChessboard(direct.showbase.ShowBase.ShowBase):
         return
 
     def onMouse3Pressed(self):
-        mpos = self.mouseWatcherNode.getMouse()
+        if self.__mouse is None:
+            return
+        mx, my = self.__mouse
         # h_symbol is a symbol to decide the direction
-        self.hsymbol = 1 if mpos.getY() <=0 else -1
-        self.__mouse3 = (mpos.getX(),mpos.getY(),self.axisCameraPitching.getH(),self.axisCameraPitching.getP())
+        self.hsymbol = 1 if my <=0 else -1
+        self.__mouse3 = (mx,my,self.axisCameraPitching.getH(),self.axisCameraPitching.getP())
 
     def onMouse3Released(self):
         self.__mouse3 = None
@@ -521,20 +696,31 @@ class MyChessboard(direct.showbase.ShowBase.ShowBase):
         pid = self.__pidOnSquare[fr]
         if not pid:
             return False
-        valid_moves = self.arena.retrieve_valid_moves_of_unit(pid)
-        destination = gamearena.Square(x=to % 8, y=to // 8)
-        return destination in valid_moves
-
-    def __movePiece(self, fr, to):
+        destinations = self.__cachedValidMarks(pid)
+        if destinations is None:
+            # 查询会填充 arena 的走法缓存, 不能与后台线程同时进行, 所以同样交给后台线程并等待结果
+            destinations = self.__submitValidMarks(pid).result()
+            self.__moveCache[pid] = destinations
+        return to in destinations
+
+    def __movePiece(self, fr, to, byHuman=False):
         """
 
         :param fr: 取值范围0<=fr<64
         :param to: 取值范围0<=to<64
+        :param byHuman: 用鼠标走棋时为 True; 引擎落子和重放日志时不检查轮到哪一方
         """
         if to == fr:  # 原地不动
             return
         elif not self.__isLegalMove(fr, to):
             raise IllegalMoveException()
+        elif byHuman and self.__engine is not None and (
+                self.__sideToMove == self.__engine.player or
+                self.arena.find_unit_on_index(fr).owner != self.__sideToMove):
+            raise IllegalMoveException()  # 人机对弈时必须轮流走棋, 轮到引擎时人不能替它走棋
+        self.__waitForMoveQuery()
+        self.__moveQuerySerial += 1  # 局面即将改变, 尚未返回的查询结果全部作废
+        self.__collectPrefetchedMarks()
 
         piece1 = self.__pieceOnSquare[fr]
         piece2 = self.__pieceOnSquare[to]
@@ -556,8 +742,130 @@ class MyChessboard(direct.showbase.ShowBase.ShowBase):
             self.__sendToGraveyard(piece=piece2, gid=pid2)
 
         # 必须同步移动 Arena 中的棋子
-        destination = gamearena.Square(x=to % 8, y=to // 8)
-        self.arena.move_unit_to_somewhere(pid1, destination)
+        restricted = self.arena.retrieve_restricted_units()
+        self.arena.move_unit_to_index(pid1, to)
+        # arena 只重新计算了受这步棋影响的单位, 另外走棋前后被将军或被牵制的单位的合法走法也可能改变,
+        # 走法缓存中其余的单位仍然有效
+        for pid in self.arena.changed_units | restricted | self.arena.retrieve_restricted_units():
+            self.__moveCache.pop(pid, None)
+        self.__moveCacheRevision = self.arena.revision
+
+        if self.__engine is not None:
+            mover = self.__sideToMove
+            self.__sideToMove = self.__players[1] if mover == self.__players[0] else self.__players[0]
+            if mover == self.__engine.player:
+                self.__engine.start_pondering(self.arena)  # 人思考的同时, 引擎在后台搜索猜测的应着
+            else:
+                self.__engine.opponent_moved(self.arena)  # 猜中时沿用后台搜索, 猜错时中止并重新搜索
+
+    def engineTask(self, task):
+        """引擎的搜索结果到达后落子; 人正在拖拽棋子时推迟到松开鼠标之后"""
+        if self.__dragging:
+            return direct.task.Task.cont
+        result = self.__engine.poll()
+        if result is None:
+            return direct.task.Task.cont
+        if result.move is None:
+            print('engine has no legal move')
+            return direct.task.Task.done
+        fr, to, flags = gamearena.unpack_move(result.move)
+        self.__movePiece(fr, to)
+        return direct.task.Task.cont
+
+    def getEngineLatencyStats(self):
+        """
+        :return: 引擎走棋次数, 后台思考命中次数, 未命中次数, 平均和最大感知延迟(毫秒); 没有引擎时返回 None
+        :rtype : gameponder.PonderStats
+        """
+        if self.__engine is None:
+            return None
+        return self.__engine.stats()
+
+    def __openJournal(self, path):
+        """重放日志中的走法(与用鼠标走棋相同, 棋子模型一起移动), 然后把之后的走法追加到同一个日志
+
+        :return: 轮到哪一方走棋: 最后一步棋的另一方, 没有走法时取日志中 FEN 的走棋方
+                 (不限制走棋顺序时同一方可能连走, 不能按步数的奇偶推算)
+        :rtype : GameArena.PlayerID
+        """
+        fen = gamearena.fen_of_arena(self.arena, side_to_move=self.__players[0])
+        if not os.path.exists(path):
+            self.__journal = gamejournal.GameJournal(path, fen=fen)
+            self.arena.attach_journal(self.__journal)
+            return self.__players[0]
+        contents = gamejournal.read_journal(path)
+        if contents.fen.split()[0] != fen.split()[0]:
+            raise ValueError('journal {} does not start from the initial position'.format(path))
+        for fr, to, unit_id in contents.moves:
+            self.__movePiece(fr, to)
+        self.__journal = gamejournal.GameJournal(path)  # 续写, 截断末尾不完整的记录
+        self.arena.attach_journal(self.__journal)
+        fields = contents.fen.split()
+        side = self.__players[1] if len(fields) > 1 and fields[1] == 'b' else self.__players[0]
+        if contents.moves:
+            mover = self.arena.owner_of_unit(gamearena.GameArena.UnitID(contents.moves[-1][2]))
+            side = self.__players[1] if mover == self.__players[0] else self.__players[0]
+        return side
+
+    def quit(self):
+        """Esc: 先结束引擎子进程, 避免退出时等待后台搜索完成; 日志中尚未 fsync 的走法立即落盘"""
+        if self.__engine is not None:
+            self.__engine.close()
+            self.__engine = None
+        if self.__journal is not None:
+            self.__journal.close()
+            self.__journal = None
+        self.stopRecording()
+        sys.exit()
+
+    def inputTask(self, task):
+        """每帧读取一次鼠标位置, 供本帧的按键事件处理函数和 mouseTask 使用; 录制时同时写入录制文件,
+        重放时改由录制文件提供鼠标位置, 并在这里发送这一帧录制的按键事件"""
+        if self.__inputSource is not None:
+            self.__mouse, events = self.__inputSource.next_frame()
+            for name in events:
+                self.messenger.send(name)
+            return direct.task.Task.cont
+        mouse = None
+        if self.mouseWatcherNode and self.mouseWatcherNode.hasMouse():
+            mpos = self.mouseWatcherNode.getMouse()
+            mouse = (mpos.getX(), mpos.getY())
+        if self.__recorder is not None:
+            # 使用量化之后的坐标, 录制和重放时拾取到的格子相同
+            mouse = self.__recorder.record_frame(panda3d.core.ClockObject.getGlobalClock().getDt(), mouse)
+        self.__mouse = mouse
+        return direct.task.Task.cont
+
+    def startRecording(self, path):
+        """开始把鼠标和按键输入录制到文件, 直到 stopRecording() 或 quit(), 见 gamerecord"""
+        import gamerecord
+        self.stopRecording()
+        self.__recorder = gamerecord.InputRecorder(
+            path, self.win.getXSize(), self.win.getYSize(), self.getPositionFen())
+        # 另用一个 DirectObject 监听, 同一个对象对同一事件再次 accept() 会替换掉原来的处理函数
+        self.__recorderListener = direct.showbase.DirectObject.DirectObject()
+        for name in gamerecord.RECORDED_EVENTS:
+            self.__recorderListener.accept(name, self.__recorder.record_event, [name])
+
+    def stopRecording(self):
+        """结束录制, 把当前局面写入文件末尾供重放时核对"""
+        if self.__recorder is None:
+            return
+        self.__recorderListener.ignoreAll()
+        self.__recorderListener = None
+        self.__recorder.close(self.getPositionFen())
+        self.__recorder = None
+
+    def setInputSource(self, source):
+        """
+        :param source: 提供 next_frame() -> (鼠标位置, 事件名称列表) 的对象, 例如 gamerecord.InputPlayback;
+                       None 表示恢复使用真实的鼠标和键盘
+        """
+        self.__inputSource = source
+
+    def getPositionFen(self):
+        """:return: 当前局面的 FEN, 包括轮到哪一方走棋"""
+        return gamearena.fen_of_arena(self.arena, side_to_move=self.__sideToMove)
 
     def __sendToGraveyard(self, piece, gid):
         grave = self.__graveyard['graves'][gid]
@@ -635,6 +943,15 @@ class MyChessboard(direct.showbase.ShowBase.ShowBase):
         """A handy little function for getting the proper position for a given square"""
         return panda3d.core.LPoint3((i % 8) - 3.5, (i // 8) - 3.5, 0)
 
+    @staticmethod
+    def __squareIndexAt(x, y):
+        """__squarePos() 的逆运算: 查询棋盘顶面上的点 (x, y) 落在哪个方格内, 在棋盘外时返回 None"""
+        col = int(math.floor(x + 4.0))
+        row = int(math.floor(y + 4.0))
+        if 0 <= col < 8 and 0 <= row < 8:
+            return col + 8 * row
+        return None
+
     def onKeyboardPageUpPressed(self):
         delta = -14.5
         p = self.axisCameraPitching.getP() + delta
@@ -663,6 +980,136 @@ class MyChessboard(direct.showbase.ShowBase.ShowBase):
             return
         self.camera.setY(y)
 
+    def setupThumbnailBatch(self, batchSize=16, columns=4):
+        """进入缩略图模式: 把离屏缓冲区划分成 batchSize 个图块, 每个图块由单独的摄像机拍摄一个棋盘副本
+
+        所有棋盘副本共用同一组方格节点(instanceTo), 棋子节点放在对象池中反复使用, 每批渲染都不会重建场景图.
+        缓冲区的大小需要在创建 MyChessboard 之前通过 win-size 设置为 columns 列图块.
+        """
+        rows = (batchSize + columns - 1) // columns
+        self.camNode.setActive(False)  # 停用主摄像机和 2D 界面, 只保留各个图块的摄像机
+        self.cam2d.node().setActive(False)
+        self.__chessboardTopCenter.stash()
+        self.__graveyard['graveyard'].stash()
+        tileWidth = self.win.getXSize() // columns
+        tileHeight = self.win.getYSize() // rows
+        slots = []
+        for k in range(batchSize):
+            row, col = k // columns, k % columns
+            root = self.render.attachNewNode('thumbnailBoard')
+            root.setPos(20.0 * (k + 1), 0, 0)  # 各个棋盘副本相互远离, 避免出现在其他图块的画面中
+            self.__chessboard['squareRoot'].instanceTo(root)
+            axis = root.attachNewNode('axisCameraPitching')
+            axis.setHpr(self.axisCameraPitching.getHpr())
+            lens = self.camLens.makeCopy()
+            lens.setAspectRatio(float(tileWidth) / tileHeight)
+            lens.setMinFov(36)  # 图块较小时仍能拍到完整的棋盘
+            camera = axis.attachNewNode(panda3d.core.Camera('thumbnailCamera', lens))
+            camera.setPos(self.camera.getPos())
+            region = self.win.makeDisplayRegion(
+                float(col) / columns, float(col + 1) / columns,
+                1.0 - float(row + 1) / rows, 1.0 - float(row) / rows)
+            region.setCamera(camera)
+            slots.append({
+                'root': root,
+                'pool': {},  # (color, name) -> [piece holder, ...]
+                'used': [],
+                'rect': (col * tileWidth, row * tileHeight, tileWidth, tileHeight),  # 截图中的像素位置(左上角为原点)
+            })
+        self.__thumbnailSlots = slots
+
+    def showThumbnailPosition(self, k, fen):
+        """在第 k 个图块的棋盘副本上摆出 FEN 描述的局面, 棋子节点取自对象池, 不够时才创建新节点"""
+        width, ranks, pieces = gamearena.parse_fen_placement(fen)
+        if (width, ranks) != (8, 8):
+            raise ValueError('thumbnails need an 8x8 position: {!r}'.format(fen))
+        slot = self.__thumbnailSlots[k]
+        for holder in slot['used']:
+            holder.stash()
+        slot['used'] = []
+        counts = {}
+        for square, letter in pieces:
+            color = 'WHITE' if letter.isupper() else 'BLACK'
+            key = (color, FEN_PIECE_NAMES[letter.lower()])
+            pool = slot['pool'].setdefault(key, [])
+            n = counts.get(key, 0)
+            counts[key] = n + 1
+            if n == len(pool):
+                holder = slot['root'].attachNewNode('pieceInstanceHolder')
+                holder.setColor(PieceColor[color])
+                if color == 'BLACK':
+                    holder.setH(180)
+                self.__pieceModels[color][key[1]].instanceTo(holder)
+                pool.append(holder)
+            holder = pool[n]
+            holder.setPos(MyChessboard.__squarePos(square.x + 8 * square.y))
+            holder.unstash()
+            slot['used'].append(holder)
+
+    def renderThumbnailBatch(self, positions):
+        """一次渲染最多 batchSize 个局面, 只做一次帧渲染和一次显存读回
+
+        :param positions: FEN 字符串列表, 长度不超过 setupThumbnailBatch() 指定的 batchSize
+        :return: 与 positions 一一对应的 PNMImage 列表
+        :rtype : list
+        """
+        slots = self.__thumbnailSlots
+        for k, slot in enumerate(slots):
+            if k < len(positions):
+                self.showThumbnailPosition(k, positions[k])
+                slot['root'].unstash()
+            else:
+                slot['root'].stash()  # 最后一批可能不满
+        self.graphicsEngine.renderFrame()
+        screenshot = panda3d.core.PNMImage()
+        if not self.win.getScreenshot(screenshot):
+            raise RuntimeError('failed to read back the offscreen buffer')
+        images = []
+        for k in range(len(positions)):
+            x, y, w, h = slots[k]['rect']
+            image = panda3d.core.PNMImage(w, h)
+            image.copySubImage(screenshot, 0, 0, x, y, w, h)
+            images.append(image)
+        return images
+
+    def profilerTask(self, task):
+        """每帧记录帧间隔, 统计图显示时每 0.25 秒刷新一次文字"""
+        if self.profiler.enabled:
+            self.profiler.add_sample('frame', panda3d.core.ClockObject.getGlobalClock().getDt() * 1e3)
+            if self.__profilerOverlay and task.time - self.__profilerOverlayTime >= 0.25:
+                self.__profilerOverlayTime = task.time
+                hits, misses, rate = self.getMoveCacheStats()
+                text = '{}\nmove cache: {} hits, {} misses ({:.0%})'.format(
+                    self.profiler.format_report(), hits, misses, rate)
+                engine = self.getEngineLatencyStats()
+                if engine is not None:
+                    text += '\nengine: {} moves, ponder {} hits {} misses, latency mean {:.0f} ms max {:.0f} ms'.format(
+                        *engine)
+                self.__profilerOverlay.setText(text)
+        return direct.task.Task.cont
+
+    def toggleProfilerOverlay(self):
+        """F3: 开始计时并显示统计图, 再按一次则停止计时并隐藏"""
+        if self.__profilerOverlay:
+            self.__profilerOverlay.destroy()
+            self.__profilerOverlay = None
+            self.profiler.enabled = False
+            return
+        self.profiler.clear()
+        self.profiler.enabled = True
+        self.__profilerOverlay = direct.gui.OnscreenText.OnscreenText(
+            text=self.profiler.format_report(),
+            parent=self.a2dBottomLeft, align=panda3d.core.TextNode.ALeft,
+            font=self.loader.loadFont('cmtt12'), mayChange=True,
+            style=1, fg=(1, 1, 0.6, 1), bg=(0, 0, 0, 0.5), pos=(0.06, 0.5), scale=.045)
+        self.__profilerOverlayTime = 0.0
+
+    def dumpProfilerCsv(self):
+        """F4: 导出当前保留的全部计时样本"""
+        path = self.__profileCsv or time.strftime('profile-%Y%m%d-%H%M%S.csv')
+        self.profiler.dump_csv(path)
+        print('profile saved to {}'.format(path))
+
     def __makeMarksAlwaysVisible(self):
         self.__marksAlwaysVisible = True
         if self.__dragging:
@@ -683,6 +1130,16 @@ class MyChessboard(direct.showbase.ShowBase.ShowBase):
             self.__makeMarksVisibleOnlyWhenSquareIsPointed()
 
 
+PROFILED_SECTIONS = ('frame', 'mouseTask', 'mouse1Pressed', 'mouse1Released', 'collision', 'validMoves', 'marks',
+                     'animation')
+
+PieceColor = {
+    'WHITE': (1.000, 1.000, 1.000, 1),  # RGB color for WHITE pieces
+    'BLACK': (0.150, 0.150, 0.150, 1),  # RGB color for BLACK pieces
+}
+
+FEN_PIECE_NAMES = {'k': 'king', 'q': 'queen', 'r': 'rook', 'b': 'bishop', 'n': 'knight', 'p': 'pawn'}
+
 MarkColor = {
     'STARTING_POINT': panda3d.core.LVecBase4f(0.5, 0.5, 0.5, 0.25),
     'ACCEPTABLE_MOVE': panda3d.core.LVecBase4f(0, 1, 1, 0.75),
@@ -690,16 +1147,162 @@ MarkColor = {
 }
 
 
-def mark_indexes_from_coordinates(coordinates):
-    result = []
-    for (x, y) in coordinates:
-        result.append(x + 8 * y)
-    return tuple(result)
+class PieceAnimationScheduler(object):
+    """全部棋子动画共用一个任务: 每帧一次遍历正在播放的动画, 没有动画时任务不运行
+
+    每个动画是一组并列数组中的一项(NodePath, 开始时刻, 时长, 起始弧度, 弧度增量, 高度, 是否循环),
+    结束的动画与最后一项交换后删除, 数组始终紧凑. 运动轨迹见 CustomizedPiece._vertical_oscillating_motion()
+
+    :param taskMgr: ShowBase.taskMgr
+    :param profiler: 可选的 HotPathProfiler, 统计每帧推进全部动画的耗时
+    """
+
+    def __init__(self, taskMgr, profiler=None):
+        self.__taskMgr = taskMgr
+        self.__profiler = profiler
+        self.__clock = panda3d.core.ClockObject.getGlobalClock()
+        self.__task = None
+        self.__slots = {}  # 动画的键 -> 数组下标
+        self.__keys = []
+        self.__nodes = []
+        self.__starts = []
+        self.__durations = []
+        self.__fromValues = []
+        self.__spans = []
+        self.__heights = []
+        self.__loops = []
+        self.__paused = {}  # 动画的键 -> (NodePath, 已播放的时长, 时长, 起始弧度, 终止弧度, 高度, 是否循环)
+
+    def __len__(self):
+        """正在播放的动画数量"""
+        return len(self.__keys)
+
+    def isRunning(self):
+        """调度任务是否在运行, 没有正在播放的动画时为 False"""
+        return self.__task is not None
+
+    def start(self, key, nodePath, duration, fromValue, toValue, height, loop=False, elapsed=0.0):
+        """开始播放, 同一个键的动画正在播放时从头(或 elapsed 处)重新开始
+
+        :param key: 动画的键, 例如 (棋子, 动画名称)
+        :param elapsed: 从第几秒开始播放
+        """
+        self.__paused.pop(key, None)
+        startTime = self.__clock.getFrameTime() - elapsed
+        slot = self.__slots.get(key)
+        if slot is None:
+            self.__slots[key] = len(self.__keys)
+            self.__keys.append(key)
+            self.__nodes.append(nodePath)
+            self.__starts.append(startTime)
+            self.__durations.append(duration)
+            self.__fromValues.append(fromValue)
+            self.__spans.append(toValue - fromValue)
+            self.__heights.append(height)
+            self.__loops.append(loop)
+        else:
+            self.__nodes[slot] = nodePath
+            self.__starts[slot] = startTime
+            self.__durations[slot] = duration
+            self.__fromValues[slot] = fromValue
+            self.__spans[slot] = toValue - fromValue
+            self.__heights[slot] = height
+            self.__loops[slot] = loop
+        if self.__task is None:
+            self.__task = self.__taskMgr.add(self.__update, 'PieceAnimationTask')
+
+    def stop(self, key):
+        """结束动画并直接跳到终点, 与 Interval.finish() 相同; 暂停的动画同样跳到终点"""
+        paused = self.__paused.pop(key, None)
+        if paused is not None:
+            nodePath, elapsed, duration, fromValue, toValue, height, loop = paused
+            CustomizedPiece._vertical_oscillating_motion(toValue, nodePath, height)
+            return
+        slot = self.__slots.get(key)
+        if slot is None:
+            return
+        CustomizedPiece._vertical_oscillating_motion(
+            self.__fromValues[slot] + self.__spans[slot], self.__nodes[slot], self.__heights[slot])
+        self.__remove(slot)
+
+    def pause(self, key):
+        """停在当前位置, resume() 之后继续"""
+        slot = self.__slots.get(key)
+        if slot is None:
+            return
+        self.__paused[key] = (self.__nodes[slot], self.__clock.getFrameTime() - self.__starts[slot],
+                              self.__durations[slot], self.__fromValues[slot],
+                              self.__fromValues[slot] + self.__spans[slot], self.__heights[slot], self.__loops[slot])
+        self.__remove(slot)
+
+    def resume(self, key):
+        """从暂停的位置继续; 没有暂停时不做任何事
+
+        :return: 是否恢复了暂停的动画
+        :rtype : bool
+        """
+        paused = self.__paused.pop(key, None)
+        if paused is None:
+            return False
+        nodePath, elapsed, duration, fromValue, toValue, height, loop = paused
+        self.start(key, nodePath, duration, fromValue, toValue, height, loop, elapsed)
+        return True
+
+    def __remove(self, slot):
+        """把最后一项移到 slot, 数组保持紧凑"""
+        last = len(self.__keys) - 1
+        del self.__slots[self.__keys[slot]]
+        for values in (self.__keys, self.__nodes, self.__starts, self.__durations, self.__fromValues, self.__spans,
+                       self.__heights, self.__loops):
+            values[slot] = values[last]
+            values.pop()
+        if slot < last:
+            self.__slots[self.__keys[slot]] = slot
+        if not self.__keys and self.__task is not None:
+            self.__taskMgr.remove(self.__task)
+            self.__task = None
+
+    def __update(self, task):
+        profiler = self.__profiler
+        started = profiler.start('animation') if profiler else None
+        now = self.__clock.getFrameTime()
+        cos = math.cos
+        finished = []
+        nodes, starts, durations = self.__nodes, self.__starts, self.__durations
+        fromValues, spans, heights, loops = self.__fromValues, self.__spans, self.__heights, self.__loops
+        for slot in range(len(nodes)):
+            fraction = (now - starts[slot]) / durations[slot]
+            if fraction >= 1.0:
+                if loops[slot]:
+                    fraction %= 1.0
+                else:
+                    fraction = 1.0
+                    finished.append(slot)
+            # 与 _vertical_oscillating_motion() 相同, 在循环内展开以省去每个动画一次函数调用
+            nodes[slot].setZ(heights[slot] * 0.5 * (1.0 - cos(fromValues[slot] + spans[slot] * fraction)))
+        for slot in reversed(finished):  # 从后往前删除, 交换过来的项都已经处理过
+            self.__remove(slot)
+        if profiler:
+            profiler.stop('animation', started)
+        if self.__task is None:
+            return direct.task.Task.done  # 最后一个动画已经结束, __remove() 已经移除了任务
+        return direct.task.Task.cont
 
 
 class CustomizedPiece(object):
-    def __init__(self, node_path, mask):
+    # 动画名称 -> (时长(秒), 起始弧度, 终止弧度); 悬停时升起到 HEIGHT 的高度, 落下时回到棋盘上
+    ANIMATIONS = {
+        'hovering': (0.4, 0.0, math.pi),
+        'landing': (0.125, -math.pi, 0.0),
+    }
+    HEIGHT = 0.25
+
+    def __init__(self, node_path, mask, scheduler):
+        """
+        :param scheduler: 播放动画的 PieceAnimationScheduler, 同一个棋盘上的全部棋子共用
+        """
         self.__np = node_path
+        self.__scheduler = scheduler
         b = node_path.getTightBounds()
         solid = panda3d.core.CollisionBox(b[0], b[1])
         self.__cb = panda3d.core.CollisionNode('pieceCollisionBox')
@@ -707,40 +1310,6 @@ class CustomizedPiece(object):
         self.__cb.setIntoCollideMask(mask)
         self.__box = node_path.attachNewNode(self.__cb)
 
-        hovering_interval = direct.interval.LerpInterval.LerpFunc(
-            self._vertical_oscillating_motion,  # function to call
-            duration=0.4,  # duration (in seconds)
-            fromData=0,  # starting value (in radians)
-            toData=math.pi,  # ending value
-            # Additional information to pass to self._osllicat
-            extraArgs=[self.__np, 0.25]
-        )
-        landing_interval = direct.interval.LerpInterval.LerpFunc(
-            self._vertical_oscillating_motion,  # function to call
-            duration=0.125,  # duration (in seconds)
-            fromData=-math.pi,  # starting value (in radians)
-            toData=0,  # ending value
-            # Additional information to pass to self._osllicat
-            extraArgs=[self.__np, 0.25]
-        )
-        self.__animations = {
-            'hovering': hovering_interval,
-            'landing': landing_interval,
-        }
-
-        self.pickerRay = panda3d.core.CollisionRay()
-        self.pickerRay.setOrigin(0.0, 0.0, 0.0)
-        self.pickerRay.setDirection(0, 0, -1)
-        self.collisionNode = panda3d.core.CollisionNode('pieceCollisionNode')
-        self.collisionNode.setFromCollideMask(mask)  # 注意是碰撞源(From)
-        self.collisionNode.setIntoCollideMask(panda3d.core.BitMask32.allOff())
-        self.collisionNode.addSolid(self.pickerRay)
-        self.collisionNP = self.__np.attachNewNode(self.collisionNode)
-        self.collisionNP.setPos(0, 0, 0)
-        self.picker = panda3d.core.CollisionTraverser()
-        self.handler = panda3d.core.CollisionHandlerQueue()
-        self.picker.addCollider(self.collisionNP, self.handler)
-
     @staticmethod
     def _vertical_oscillating_motion(rad, piece, height):
         """垂直方向上震荡往复运动
@@ -752,48 +1321,33 @@ class CustomizedPiece(object):
         wave_amplitude = height * 0.5
         piece.setZ(wave_amplitude * (1.0 - math.cos(rad)))
 
-    def loop(self, animName, restart=True):
+    def __start(self, animName, loop, restart):
         try:
-            interval = self.__animations[animName]
+            duration, fromValue, toValue = self.ANIMATIONS[animName]
         except KeyError:
-            pass
-        else:
-            if restart:
-                interval.loop()  # restart from the beginning
-            else:
-                interval.resume()  # continue from last position
+            return
+        key = (self, animName)
+        if not restart and self.__scheduler.resume(key):
+            return  # continue from last position
+        self.__scheduler.start(key, self.__np, duration, fromValue, toValue, self.HEIGHT, loop)
+
+    def loop(self, animName, restart=True):
+        self.__start(animName, True, restart)
 
     def play(self, animName, restart=True):
-        try:
-            interval = self.__animations[animName]
-        except KeyError:
-            pass
-        else:
-            if restart:
-                interval.start()  # start play from the beginning
-            else:
-                interval.resume()  # continue from last position
+        self.__start(animName, False, restart)
 
     def stop(self, animName=None):
-        if not animName:
-            for interval in self.__animations.values():
-                interval.finish()
-            return
-        try:
-            interval = self.__animations[animName]
-        except KeyError:
-            pass
-        else:
-            interval.finish()
+        """结束动画并跳到最后一帧"""
+        for name in (self.ANIMATIONS if not animName else (animName,)):
+            self.__scheduler.stop((self, name))
 
     def pause(self, animName=None):
-        intervals = self.__animations.values()
-        if not animName:
-            for interval in intervals:
-                interval.pause()
-        if animName in intervals:
-            interval = self.__animations[animName]
-            interval.pause()
+        for name in (self.ANIMATIONS if not animName else (animName,)):
+            self.__scheduler.pause((self, name))
+
+    def getPos(self, *args, **kwargs):
+        return self.__np.getPos(*args, **kwargs)
 
     def setPos(self, *args, **kwargs):
         self.__np.setPos(*args, **kwargs)
@@ -820,7 +1374,7 @@ class CustomizedPiece(object):
         self.__box.hide()
 
 
-def main():
+def attach_default_lights(render):
     # 创建背景光源
     ambientLight = panda3d.core.AmbientLight("ambientLight")
     ambientLight.setColor((.8, .8, .8, 1))
@@ -828,12 +1382,107 @@ def main():
     directionalLight = panda3d.core.DirectionalLight("directionalLight")
     directionalLight.setDirection(panda3d.core.LVector3(0, 45, -45))
     directionalLight.setColor((0.2, 0.2, 0.2, 1))
+    render.setLight(render.attachNewNode(ambientLight))  # 设置光源
+    render.setLight(render.attachNewNode(directionalLight))  # 设置光源
+
+
+def read_positions(stream):
+    """逐行读取 FEN, 忽略空行和 # 开头的注释行"""
+    for line in stream:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+def render_thumbnails(base, positions, outputDir, batchSize):
+    """按批次渲染局面缩略图并保存为 PNG 文件
+
+    :param base: 已经调用过 setupThumbnailBatch(batchSize) 的 MyChessboard
+    :param positions: FEN 字符串的可迭代对象, 可以是无限的数据流
+    :return: 图片数量, 耗时(秒)
+    :rtype : int, float
+    """
+    count = 0
+    start = time.time()
+    batch = []
+    for fen in positions:
+        batch.append(fen)
+        if len(batch) < batchSize:
+            continue
+        count = _save_thumbnail_batch(base, batch, outputDir, count)
+        batch = []
+    if batch:
+        count = _save_thumbnail_batch(base, batch, outputDir, count)
+    return count, time.time() - start
+
+
+def _save_thumbnail_batch(base, batch, outputDir, count):
+    for image in base.renderThumbnailBatch(batch):
+        count += 1
+        image.write(panda3d.core.Filename.fromOsSpecific(os.path.join(outputDir, '{:06d}.png'.format(count))))
+    return count
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Panda3D chessboard')
+    parser.add_argument('--thumbnails', metavar='FEN_FILE',
+                        help='离屏渲染缩略图模式: 逐行读取 FEN 局面(- 表示标准输入), 每个局面保存为一张 PNG')
+    parser.add_argument('--output-dir', default='.', help='缩略图保存目录')
+    parser.add_argument('--batch-size', type=int, default=16, help='每次帧渲染同时绘制的局面数量')
+    parser.add_argument('--tile-size', type=int, default=256, help='缩略图边长(像素)')
+    parser.add_argument('--engine', type=int, choices=(1, 2), metavar='PLAYER',
+                        help='人机对弈: 由引擎执棋的一方, 1 为白棋, 2 为黑棋')
+    parser.add_argument('--engine-depth', type=int, default=4, help='引擎的搜索深度(半回合)')
+    parser.add_argument('--no-ponder', action='store_true', help='轮到人走棋时引擎不在后台思考')
+    parser.add_argument('--journal', metavar='PATH', help='走棋日志文件, 已经存在时从中恢复上次的对局')
+    parser.add_argument('--record', metavar='PATH', help='把鼠标和按键输入录制到文件, Esc 退出时保存, 见 gamerecord')
+    parser.add_argument('--replay', metavar='PATH',
+                        help='离屏全速重放录制的输入, 报告各处理函数的耗时和结束局面; 棋子布局与录制结束时不同则退出码为 1')
+    parser.add_argument('--display', default='p3tinydisplay',
+                        help='缩略图和重放模式使用的显示模块, 默认 p3tinydisplay 为纯软件渲染, 不需要 X 服务器和 GPU')
+    args = parser.parse_args(argv)
+    if args.record and args.engine:
+        parser.error('--record: 引擎的应着不来自输入, 人机对弈无法重放')
+
+    if args.replay:
+        import gamerecord
+        recording = gamerecord.read_recording(args.replay)
+        panda3d.core.loadPrcFileData('', '\n'.join([
+            'load-display {}'.format(args.display),
+            'audio-library-name null',
+            'win-size {} {}'.format(recording.width, recording.height),  # 相同的宽高比才能拾取到相同的格子
+        ]))
+        base = MyChessboard(fStartDirect=False, windowType='offscreen')
+        attach_default_lights(base.render)
+        report = gamerecord.replay(base, recording)
+        print(gamerecord.format_report(report))
+        return 0 if report.matched is not False else 1
+
+    if not args.thumbnails:
+        base = MyChessboard(enginePlayer=args.engine, engineDepth=args.engine_depth, pondering=not args.no_ponder,
+                            journalPath=args.journal)
+        attach_default_lights(base.render)
+        if args.record:
+            base.startRecording(args.record)
+        base.run()
+        return
 
-    base = MyChessboard()
-    base.render.setLight(base.render.attachNewNode(ambientLight))  # 设置光源
-    base.render.setLight(base.render.attachNewNode(directionalLight))  # 设置光源
-    base.run()
+    columns = min(args.batch_size, 4)
+    rows = (args.batch_size + columns - 1) // columns
+    panda3d.core.loadPrcFileData('', '\n'.join([
+        'load-display {}'.format(args.display),
+        'audio-library-name null',
+        'win-size {} {}'.format(columns * args.tile_size, rows * args.tile_size),
+    ]))
+    base = MyChessboard(fStartDirect=False, windowType='offscreen')
+    attach_default_lights(base.render)
+    base.setupThumbnailBatch(args.batch_size, columns)
+    stream = sys.stdin if args.thumbnails == '-' else open(args.thumbnails)
+    with stream:
+        count, elapsed = render_thumbnails(base, read_positions(stream), args.output_dir, args.batch_size)
+    print('{} thumbnails in {:.2f} s: {:.1f} images/s'.format(count, elapsed, count / elapsed if elapsed else 0.0))
 
 
 if '__main__' == __name__:
-    main()
+    sys.exit(main())
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""硬件实例化(hardware instancing)方式绘制棋子
+
+同一种棋子(例如全部的兵)只提交一次绘制调用, 每个实例的位置、朝向和颜色通过 shader 的 uniform 数组传入.
+绘制调用的数量只与棋子种类数有关, 不随棋盘数量线性增长, 适合同屏显示多个棋盘(观战墙、锦标赛总览).
+
+不支持 shader 的渲染器(例如纯软件渲染的 p3tinydisplay)改用 FlattenedPieceRenderer: 每组棋子复制模型后合并成
+静态几何体, 接口与 InstancedPieceRenderer 相同, 用 new_piece_renderer() 按图形设备自动选择.
+"""
+from __future__ import print_function
+
+import math
+import panda3d.core
+import gamearena
+
+PIECE_NAMES = ('king', 'queen', 'rook', 'knight', 'bishop', 'pawn')
+
+PIECE_COLORS = {
+    1: (1.000, 1.000, 1.000, 1),  # 白方 PlayerID(1)
+    2: (0.150, 0.150, 0.150, 1),  # 黑方 PlayerID(2)
+}
+
+# 黑方棋子转头 180° 与白方面对面(与 MyChessboard 中的 piece_holder.setH(180) 一致)
+PIECE_HEADINGS = {
+    1: 0.0,
+    2: math.pi,
+}
+
+UNIT_MODEL_NAMES = (
+    (gamearena.KingUnit, 'king'),
+    (gamearena.QueenUnit, 'queen'),
+    (gamearena.RookUnit, 'rook'),
+    (gamearena.KnightUnit, 'knight'),
+    (gamearena.BishopUnit, 'bishop'),
+    (gamearena.AbstractPawnUnit, 'pawn'),
+)
+
+# 类型编码 -> 模型名称, 由 UNIT_MODEL_NAMES 和 gamearena.UNIT_TYPES 生成; 兵升变后已被替换为后, 不需要单独判断
+_MODEL_NAMES_BY_TYPE_CODE = dict(
+    (unit_type.type_code, next(name for base, name in UNIT_MODEL_NAMES if issubclass(unit_type, base)))
+    for unit_type in gamearena.UNIT_TYPES[1:])
+
+_VERTEX_SHADER = """
+#version 150
+const int MAX_INSTANCES = {max_instances};
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform vec4 instanceOffsets[MAX_INSTANCES];  // xyz: 棋子位置, w: 朝向(弧度)
+uniform vec4 instanceColors[MAX_INSTANCES];
+in vec4 p3d_Vertex;
+in vec3 p3d_Normal;
+out vec4 pieceColor;
+out vec3 pieceNormal;
+void main() {{
+    vec4 offset = instanceOffsets[gl_InstanceID];
+    float c = cos(offset.w);
+    float s = sin(offset.w);
+    mat3 rotation = mat3(c, s, 0, -s, c, 0, 0, 0, 1);
+    vec3 vertex = rotation * p3d_Vertex.xyz + offset.xyz;
+    gl_Position = p3d_ModelViewProjectionMatrix * vec4(vertex, 1);
+    pieceNormal = rotation * p3d_Normal;
+    pieceColor = instanceColors[gl_InstanceID];
+}}
+"""
+
+_FRAGMENT_SHADER = """
+#version 150
+uniform vec3 lightDirection;
+in vec4 pieceColor;
+in vec3 pieceNormal;
+out vec4 p3d_FragColor;
+void main() {
+    float diffuse = max(dot(normalize(pieceNormal), -lightDirection), 0.0);
+    p3d_FragColor = vec4(pieceColor.rgb * (0.8 + 0.2 * diffuse), pieceColor.a);
+}
+"""
+
+
+def load_piece_models(loader, path='models/default', names=PIECE_NAMES):
+    """:return: 棋子名称 -> 去掉颜色并合并成单个 Geom 的模型, 两种渲染方式共用"""
+    models = {}
+    for name in names:
+        model = loader.loadModel('{}/{}'.format(path, name))
+        model.clearColor()
+        model.flattenStrong()  # 合并成单个 Geom, 每个批次只需一次绘制调用
+        model.detachNode()
+        models[name] = model
+    return models
+
+
+def group_pieces_by_name(pieces):
+    """:return: name -> [(x, y, z, heading, color), ...]"""
+    by_name = {}
+    for name, x, y, z, heading, color in pieces:
+        by_name.setdefault(name, []).append((x, y, z, heading, color))
+    return by_name
+
+
+def new_piece_renderer(loader, parent, gsg, path='models/default', names=PIECE_NAMES):
+    """图形设备支持硬件实例化时返回 InstancedPieceRenderer, 否则返回 FlattenedPieceRenderer"""
+    if InstancedPieceRenderer.isSupported(gsg):
+        return InstancedPieceRenderer(loader, parent, path, names)
+    return FlattenedPieceRenderer(loader, parent, path, names)
+
+
+def model_name_of_unit(unit):
+    """查询 GameArena 中的单位应当使用哪一种棋子模型
+
+    :param unit: Unit 实例
+    :rtype : str
+    """
+    name = _MODEL_NAMES_BY_TYPE_CODE.get(unit.type_code)
+    if name is None:
+        raise ValueError('unknown unit type: {}'.format(type(unit).__name__))
+    return name
+
+
+def pieces_from_arena(arena, origin=(0.0, 0.0, 0.0)):
+    """将 GameArena 当前的棋子布局转换成 InstancedPieceRenderer 的实例参数
+
+    :param arena: GameArena 实例
+    :param origin: 棋盘顶面中心在渲染根节点下的坐标
+    :return: (name, x, y, z, heading, color) 六元组的列表
+    :rtype : list
+    """
+    xmax, ymax = arena.size
+    x0 = origin[0] - (xmax - 1) * 0.5
+    y0 = origin[1] - (ymax - 1) * 0.5
+    z0 = origin[2]
+    pieces = []
+    for unit_id, square, unit in arena.retrieve_units_on_board():
+        pieces.append((
+            model_name_of_unit(unit),
+            x0 + square.x,
+            y0 + square.y,
+            z0,
+            PIECE_HEADINGS.get(unit.owner, 0.0),
+            PIECE_COLORS.get(unit.owner, (1, 1, 1, 1)),
+        ))
+    return pieces
+
+
+class InstancedPieceRenderer(object):
+    """每种棋子一次绘制调用, 实例参数按组(通常一个棋盘为一组)提交
+
+    Usage:
+        renderer = InstancedPieceRenderer(base.loader, base.render)
+        renderer.setPieces(board_key, pieces_from_arena(arena))
+        renderer.flush()  # 只上传内容发生变化的实例槽位
+
+    每种棋子的全部实例紧凑地排在一个槽位数组中, 每组记录自己占用的槽位; 某组的棋子减少时把数组末尾的实例
+    搬进空出的槽位. flush() 只写入 setPieces() 改动过的槽位, 没有变化的棋盘不产生任何开销.
+    """
+    MAX_INSTANCES_PER_BATCH = 256  # 超出时自动拆分出下一个批次, 以免超过 uniform 数组长度限制
+
+    def __init__(self, loader, parent, path='models/default', names=PIECE_NAMES):
+        self.__root = parent.attachNewNode('instancedPieceRoot')
+        shader = panda3d.core.Shader.make(
+            panda3d.core.Shader.SL_GLSL,
+            _VERTEX_SHADER.format(max_instances=self.MAX_INSTANCES_PER_BATCH),
+            _FRAGMENT_SHADER
+        )
+        self.__root.setShader(shader)
+        light = panda3d.core.LVector3(0, 45, -45)  # 与 gamegui.main() 中的直射光源方向一致
+        light.normalize()
+        self.__root.setShaderInput('lightDirection', light)
+        self.__models = load_piece_models(loader, path, names)
+        self.__batches = dict((name, []) for name in names)  # name -> [(batch NodePath, offsets PTA, colors PTA), ...]
+        self.__instances = dict((name, []) for name in names)  # name -> 每个槽位的实例参数 (x, y, z, heading, color)
+        self.__owners = dict((name, []) for name in names)  # name -> 每个槽位的 (group, 该组槽位列表中的下标)
+        self.__slots = {}  # (group, name) -> 该组占用的槽位编号列表
+        self.__dirtySlots = dict((name, set()) for name in names)
+        self.__dirtyNames = set()  # 槽位内容或实例数量发生变化的棋子种类
+
+    @staticmethod
+    def isSupported(gsg):
+        """检查图形设备是否支持硬件实例化"""
+        return gsg.getSupportsGeometryInstancing() and gsg.getSupportsGlsl()
+
+    def getRoot(self):
+        return self.__root
+
+    def setPieces(self, group, pieces):
+        """替换一组棋子的实例参数, 只标记受影响的棋子种类, 等待 flush() 时统一上传
+
+        :param group: 任意可哈希的分组编号, 一般一个棋盘为一组
+        :param pieces: (name, x, y, z, heading, color) 六元组序列, 参见 pieces_from_arena()
+        """
+        by_name = group_pieces_by_name(pieces)
+        for name in self.__models:
+            self.__assign(group, name, by_name.get(name, ()))
+
+    def removeGroup(self, group):
+        for name in self.__models:
+            self.__assign(group, name, ())
+
+    def __assign(self, group, name, wanted):
+        """让 group 的 name 棋子恰好占用 len(wanted) 个槽位, 只标记内容变化的槽位"""
+        slots = self.__slots.get((group, name))
+        if slots is None:
+            if not wanted:
+                return
+            slots = self.__slots[(group, name)] = []
+        instances = self.__instances[name]
+        owners = self.__owners[name]
+        dirty = self.__dirtySlots[name]
+        if len(slots) != len(wanted):
+            self.__dirtyNames.add(name)
+        while len(slots) > len(wanted):
+            freed = slots.pop()
+            last = len(instances) - 1
+            if freed != last:
+                # 数组末尾的实例搬进空出的槽位
+                owner, index = owners[last]
+                self.__slots[(owner, name)][index] = freed
+                owners[freed] = owners[last]
+                instances[freed] = instances[last]
+                dirty.add(freed)
+            instances.pop()
+            owners.pop()
+            dirty.discard(last)
+        while len(slots) < len(wanted):
+            slots.append(len(instances))
+            owners.append((group, len(slots) - 1))
+            instances.append(None)
+        for slot, instance in zip(slots, wanted):
+            if instances[slot] != instance:
+                instances[slot] = instance
+                dirty.add(slot)
+                self.__dirtyNames.add(name)
+        if not slots:
+            del self.__slots[(group, name)]
+
+    def flush(self):
+        """只把改动过的槽位写入 uniform 数组, 并更新各批次的实例数量; 没有变化时不做任何事"""
+        for name in self.__dirtyNames:
+            self.__upload(name, self.__dirtySlots[name])
+            self.__dirtySlots[name].clear()
+        self.__dirtyNames.clear()
+
+    def getNumDrawCalls(self):
+        """当前每帧提交的实例化绘制调用次数(等于非空批次的数量)"""
+        count = 0
+        for batches in self.__batches.values():
+            for batch, offsets, colors in batches:
+                if not batch.isStashed():
+                    count += 1
+        return count
+
+    def __batchCounts(self, name):
+        """:return: 每个批次应有的实例数量"""
+        size = self.MAX_INSTANCES_PER_BATCH
+        total = len(self.__instances[name])
+        return [max(0, min(size, total - k * size)) for k in range(len(self.__batches[name]))]
+
+    def __upload(self, name, dirty):
+        batches = self.__batches[name]
+        instances = self.__instances[name]
+        size = self.MAX_INSTANCES_PER_BATCH
+        needed = (len(instances) + size - 1) // size
+        while len(batches) < needed:
+            batches.append(self.__newBatch(name))
+        for slot in dirty:
+            batch, offsets, colors = batches[slot // size]
+            x, y, z, heading, color = instances[slot]
+            offsets.setElement(slot % size, panda3d.core.LVecBase4f(x, y, z, heading))
+            colors.setElement(slot % size, panda3d.core.LVecBase4f(*color))
+        for (batch, offsets, colors), count in zip(batches, self.__batchCounts(name)):
+            if not count:
+                batch.stash()  # 空批次不提交绘制调用
+                continue
+            batch.setInstanceCount(count)
+            batch.unstash()
+
+    def __newBatch(self, name):
+        batch = self.__root.attachNewNode('instancedPieces-{}'.format(name))
+        self.__models[name].copyTo(batch)
+        # 实例分布在整个观战墙范围内, 模型自身的包围盒不能代表实例位置, 因此禁用视锥裁剪
+        batch.node().setBounds(panda3d.core.OmniBoundingVolume())
+        batch.node().setFinal(True)
+        offsets = panda3d.core.PTA_LVecBase4f.emptyArray(self.MAX_INSTANCES_PER_BATCH)
+        colors = panda3d.core.PTA_LVecBase4f.emptyArray(self.MAX_INSTANCES_PER_BATCH)
+        batch.setShaderInput('instanceOffsets', offsets)
+        batch.setShaderInput('instanceColors', colors)
+        return batch, offsets, colors
+
+
+class FlattenedPieceRenderer(object):
+    """不使用 shader 的后备方案, 接口与 InstancedPieceRenderer 相同: 每组棋子复制模型后合并成一个静态几何体
+
+    绘制调用的数量随组数线性增长, 但每组只有寥寥几个 Geom; flush() 只重建 setPieces() 改动过的组.
+    """
+
+    def __init__(self, loader, parent, path='models/default', names=PIECE_NAMES):
+        self.__root = parent.attachNewNode('flattenedPieceRoot')
+        # 与 shader 相同的光照: 0.8 的环境光加 0.2 的直射光
+        ambient = panda3d.core.AmbientLight('flattenedPieceAmbient')
+        ambient.setColor((0.8, 0.8, 0.8, 1))
+        directional = panda3d.core.DirectionalLight('flattenedPieceLight')
+        directional.setDirection(panda3d.core.LVector3(0, 45, -45))
+        directional.setColor((0.2, 0.2, 0.2, 1))
+        self.__root.setLight(self.__root.attachNewNode(ambient))
+        self.__root.setLight(self.__root.attachNewNode(directional))
+        self.__models = load_piece_models(loader, path, names)
+        self.__groups = {}  # group key -> pieces 元组
+        self.__nodes = {}  # group key -> 合并后的 NodePath
+        self.__dirtyGroups = set()
+
+    @staticmethod
+    def isSupported(gsg):
+        return True
+
+    def getRoot(self):
+        return self.__root
+
+    def setPieces(self, group, pieces):
+        pieces = tuple(pieces)
+        if self.__groups.get(group) != pieces:
+            self.__groups[group] = pieces
+            self.__dirtyGroups.add(group)
+
+    def removeGroup(self, group):
+        if self.__groups.pop(group, None) is not None:
+            self.__dirtyGroups.add(group)
+
+    def flush(self):
+        """重建改动过的组, 没有变化时不做任何事"""
+        for group in self.__dirtyGroups:
+            node = self.__nodes.pop(group, None)
+            if node is not None:
+                node.removeNode()
+            pieces = self.__groups.get(group)
+            if pieces:
+                self.__nodes[group] = self.__build(group, pieces)
+        self.__dirtyGroups.clear()
+
+    def getNumDrawCalls(self):
+        count = 0
+        for node in self.__nodes.values():
+            for np in node.findAllMatches('**/+GeomNode'):
+                count += np.node().getNumGeoms()
+        return count
+
+    def __build(self, group, pieces):
+        node = self.__root.attachNewNode('flattenedPieces-{}'.format(group))
+        for name, x, y, z, heading, color in pieces:
+            holder = node.attachNewNode(name)
+            holder.setPosHpr(x, y, z, math.degrees(heading), 0, 0)  # 与 shader 中绕 z 轴的旋转方向相同
+            holder.setColor(*color)
+            self.__models[name].copyTo(holder)
+        node.clearModelNodes()  # 否则每个棋子的 ModelRoot 都会被保留下来, 无法合并
+        node.flattenStrong()  # 颜色和变换烘焙进顶点, 合并成少量 Geom
+        return node
+
+
+def main():
+    """显示标准开局的实例化渲染效果, 不支持实例化时显示合并几何体的后备方案"""
+    import direct.showbase.ShowBase
+    base = direct.showbase.ShowBase.ShowBase()
+    base.disableMouse()
+    base.camera.setPos(0, -12, 12)
+    base.camera.lookAt(0, 0, 0)
+    arena = gamearena.new_standard_chess_arena()
+    renderer = new_piece_renderer(base.loader, base.render, base.win.getGsg())
+    renderer.setPieces(0, pieces_from_arena(arena))
+    renderer.flush()
+    base.run()
+
+
+if '__main__' == __name__:
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""只追加的走棋日志: 客户端或服务器崩溃之后重放日志恢复对局
+
+GameArena 的状态只存在于内存中. GameArena.attach_journal() 之后, 每一步 move_unit_to_somewhere() /
+move_unit_to_index() 都追加一条记录到日志文件; 恢复时从日志开头的 FEN 局面开始重放全部走法.
+
+文件格式(小端):
+    文件头   FILE_HEADER: 魔数 b'CHJL', 版本
+    记录     RECORD_HEADER: 内容长度(uint32), 内容的 CRC32(uint32); 内容的第一个字节是记录类型
+        REC_FEN   UTF-8 编码的 FEN, 只出现一次, 紧跟在文件头之后
+        REC_MOVE  MOVE_BODY: 起点格子编号(复活时为 NO_SQUARE), 终点格子编号, 单位编码
+
+写入: 每条记录立即 os.write() 交给操作系统, 进程崩溃不会丢失已经走过的棋; fsync 由 GroupCommit 后台线程
+每隔 window 秒对这段时间内写过的全部日志统一执行一次(组提交), 断电最多丢失 window 秒内的走法.
+window=0 时每条记录都同步 fsync, window=None 时从不 fsync.
+
+恢复: 逐条校验长度和 CRC, 遇到写了一半或损坏的记录就停止, 之后的内容丢弃; 续写时先截断这部分.
+
+Usage:
+    journal = GameJournal('game.journal', fen=gamearena.fen_of_arena(arena, side_to_move=white))
+    arena.attach_journal(journal)
+    ...
+    arena, contents = recover_arena('game.journal')
+"""
+from __future__ import print_function
+
+import collections
+import os
+import struct
+import threading
+import zlib
+
+import gamearena
+
+FILE_MAGIC = b'CHJL'
+VERSION = 2  # 版本 2 的格子编号为 uint32, 稀疏竞技场可以超过 65536 格
+FILE_HEADER = struct.Struct('<4sH')
+RECORD_HEADER = struct.Struct('<II')  # 内容长度, CRC32
+MOVE_BODY = struct.Struct('<BIII')  # 记录类型, 起点, 终点, 单位编码
+MAX_RECORD_SIZE = 1 << 16  # 超过这个长度的记录视为损坏
+
+REC_FEN = 1
+REC_MOVE = 2
+
+NO_SQUARE = 0xFFFFFFFF  # 复活的单位没有起点格子
+DEFAULT_WINDOW = 0.05  # 默认的组提交间隔(秒)
+
+JournalContents = collections.namedtuple('JournalContents', ['fen', 'moves', 'length', 'discarded'])
+"""fen: 初始局面; moves: [(起点格子编号或 None, 终点格子编号, 单位编码)];
+length: 有效内容的字节数; discarded: 末尾写了一半或损坏而被丢弃的字节数"""
+
+
+def encode_record(payload):
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload) & 0xffffffff) + payload
+
+
+def read_journal(path):
+    """读取日志, 末尾不完整的记录不算错误(崩溃时正在写入), 文件头或 FEN 记录损坏时上报 ValueError 异常
+
+    :rtype : JournalContents
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < FILE_HEADER.size:
+        raise ValueError('journal too short: {}'.format(path))
+    magic, version = FILE_HEADER.unpack_from(data, 0)
+    if magic != FILE_MAGIC or version != VERSION:
+        raise ValueError('not a game journal: {}'.format(path))
+    fen = None
+    moves = []
+    offset = FILE_HEADER.size
+    while offset + RECORD_HEADER.size <= len(data):
+        length, crc = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        payload = data[start:start + length]
+        if not 0 < length <= MAX_RECORD_SIZE or len(payload) < length or zlib.crc32(payload) & 0xffffffff != crc:
+            break
+        kind = payload[0]
+        if kind == REC_MOVE and fen is not None and length == MOVE_BODY.size:
+            kind, fr, to, unit_id = MOVE_BODY.unpack(payload)
+            moves.append((None if fr == NO_SQUARE else fr, to, unit_id))
+        elif kind == REC_FEN and fen is None:
+            fen = payload[1:].decode('utf-8')
+        else:
+            break  # 不认识的记录, 当作损坏处理
+        offset = start + length
+    if fen is None:
+        raise ValueError('journal has no FEN record: {}'.format(path))
+    return JournalContents(fen, moves, offset, len(data) - offset)
+
+
+def replay(arena, moves):
+    """在 arena 上重放日志中的走法; 日志已经过 CRC 校验, 这里不再检查走法是否合法, 只核对起点上的单位"""
+    for fr, to, unit_id in moves:
+        if fr is not None and arena.find_unit_id_on_index(fr) != unit_id:
+            raise ValueError('journal does not match the position: unit {} is not on square {}'.format(unit_id, fr))
+        arena.move_unit_to_index(gamearena.GameArena.UnitID(unit_id), to)
+
+
+def recover_arena(path, sparse=False):
+    """从日志重建竞技场
+
+    :return: 重放全部走法之后的竞技场, 日志内容
+    :rtype : GameArena, JournalContents
+    """
+    contents = read_journal(path)
+    arena = gamearena.new_arena_from_fen(contents.fen, sparse=sparse)
+    replay(arena, contents.moves)
+    return arena, contents
+
+
+class GroupCommit(object):
+    """后台刷盘线程: 收集 window 秒内写过的日志, 统一 fsync 一次; 多个日志(例如服务器的全部会话)可以共用
+
+    :param window: 持久化窗口(秒), 断电时最多丢失这段时间内的走法
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.window = window
+        self.__lock = threading.Lock()
+        self.__dirty = set()
+        self.__wakeup = threading.Event()
+        self.__closing = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name='JournalFlusher')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def mark_dirty(self, journal):
+        with self.__lock:
+            wake = not self.__dirty
+            self.__dirty.add(journal)
+        if wake:
+            self.__wakeup.set()
+
+    def __run(self):
+        while not self.__closing.is_set():
+            self.__wakeup.wait()
+            self.__closing.wait(self.window)  # 等待这段时间内的其余写入, 关闭时提前结束
+            self.__wakeup.clear()
+            self.__sync_dirty()
+
+    def __sync_dirty(self):
+        with self.__lock:
+            dirty, self.__dirty = self.__dirty, set()
+        for journal in dirty:
+            journal.sync()
+
+    def close(self):
+        """停止后台线程, 此前写入的记录全部 fsync"""
+        self.__closing.set()
+        self.__wakeup.set()
+        self.__thread.join()
+        self.__sync_dirty()
+
+
+class GameJournal(object):
+    """一个对局的日志文件, 通过 GameArena.attach_journal() 挂到竞技场上
+
+    :param path: 日志文件路径
+    :param fen: 初始局面, 新建日志(覆盖已有文件); None 表示续写已有的日志, 先截断末尾损坏的记录
+    :param window: 组提交间隔(秒), 0 表示每条记录都同步 fsync, None 表示从不 fsync; 指定 committer 时忽略
+    :param committer: 共用的 GroupCommit, 默认为这个日志单独创建一个
+    """
+
+    max_squares = NO_SQUARE  # 格子编号 0..NO_SQUARE-1 才能写进 MOVE_BODY, 由 GameArena.attach_journal() 检查
+
+    def __init__(self, path, fen=None, window=DEFAULT_WINDOW, committer=None):
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__unsynced = False
+        self.records = 0  # 本次打开之后追加的走法记录数量
+        self.fsyncs = 0
+        if fen is None:
+            contents = read_journal(path)
+            self.fen = contents.fen
+            self.__fd = os.open(path, os.O_WRONLY)
+            os.ftruncate(self.__fd, contents.length)
+            os.lseek(self.__fd, 0, os.SEEK_END)
+        else:
+            self.fen = fen
+            self.__fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            os.write(self.__fd, FILE_HEADER.pack(FILE_MAGIC, VERSION) +
+                     encode_record(bytes(bytearray([REC_FEN])) + fen.encode('utf-8')))
+        self.__own_committer = committer is None and bool(window)
+        self.__committer = GroupCommit(window) if self.__own_committer else committer
+        self.__sync_each = committer is None and window == 0
+        self.__unsynced = True
+        self.sync()  # 文件头和截断立即落盘
+
+    def record_move(self, fr, to, unit_id):
+        """追加一条走法记录, 由 GameArena.move_unit_to_index() 调用
+
+        :param fr: 起点格子编号, 复活的单位为 None
+        """
+        os.write(self.__fd, encode_record(MOVE_BODY.pack(REC_MOVE, NO_SQUARE if fr is None else fr, to, unit_id)))
+        self.records += 1
+        if self.__sync_each:
+            self.__unsynced = True
+            self.sync()
+        elif self.__committer is not None and not self.__unsynced:
+            self.__unsynced = True
+            self.__committer.mark_dirty(self)
+
+    def sync(self):
+        """立即把已经写入的记录 fsync 到磁盘"""
+        with self.__lock:
+            if self.__fd is None or not self.__unsynced:
+                return
+            self.__unsynced = False
+            os.fsync(self.__fd)
+            self.fsyncs += 1
+
+    def close(self):
+        if self.__own_committer:
+            self.__committer.close()
+        self.sync()
+        with self.__lock:
+            if self.__fd is not None:
+                os.close(self.__fd)
+                self.__fd = None
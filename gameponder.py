@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""后台思考(pondering): 轮到对手走棋时, 引擎在子进程中预先搜索对手最可能的应着之后的局面
+
+引擎走完一步后, 取这一步搜索结果的主要变例(PV)中的第二步作为对手应着的预测, 在子进程中搜索预测应着之后的局面.
+对手真正走棋后:
+    命中   局面与预测一致, 正在进行(或已经完成)的搜索直接继续使用, 不需要重新开始
+    未命中 设置 stop_event 中止后台搜索, 丢弃它的结果, 重新搜索实际局面;
+           子进程中的引擎实例常驻, 置换表在多次搜索之间保留, 中止的搜索已经写入的条目仍然有用
+
+感知延迟指从对手走棋到引擎给出走法之间的时间, 后台搜索在对手走棋之前已经完成时为 0.
+本模块不依赖 panda3d, 3D 客户端和测试脚本都可以使用.
+
+Usage:
+    engine = PonderingEngine(black, {'depth': 4})
+    engine.opponent_moved(arena)   # 对手走棋之后, 开始(或继续)为 black 搜索
+    result = engine.poll()         # 搜索未完成时返回 None
+    ...                            # 在 arena 上走 result.move
+    engine.start_pondering(arena)  # 引擎走棋之后, 开始猜测对手的应着
+    engine.close()
+"""
+from __future__ import print_function
+
+import collections
+import concurrent.futures
+import multiprocessing
+import pickle
+import time
+
+import gameengine
+
+PonderStats = collections.namedtuple('PonderStats', ['moves', 'hits', 'misses', 'mean', 'maximum'])
+
+_engine = None  # 子进程中常驻的 gameengine.Engine, 见 _init_worker()
+_stop_event = None
+
+
+def _init_worker(stop_event, engine_params):
+    global _engine, _stop_event
+    _engine = gameengine.Engine(**engine_params)
+    _stop_event = stop_event
+
+
+def _search(arena_bytes, player):
+    """在子进程中执行; 被中止时返回最后一次完整完成的迭代的结果, 由调用者决定是否丢弃
+
+    :rtype : gameengine.SearchResult
+    """
+    return _engine.search(pickle.loads(arena_bytes), player, stop_event=_stop_event)
+
+
+def _stamp_finished(future):
+    future.finished_at = time.perf_counter()  # 在主进程的管理线程中调用, 记录结果到达的时刻
+
+
+class PonderingEngine(object):
+    """在一个子进程中为 player 一方搜索, 轮到对手走棋时后台思考
+
+    同一时刻最多只有一个后台搜索. 调用者负责区分轮到哪一方走棋:
+    对手走棋后调用 opponent_moved(), 引擎的走法落子后调用 start_pondering().
+
+    :param player: 引擎一方的 PlayerID
+    :param engine_params: gameengine.Engine 的构造参数
+    :param pondering: False 表示不做后台思考, 对手走棋后才开始搜索, 用于对比感知延迟
+    """
+
+    def __init__(self, player, engine_params=None, pondering=True):
+        self.player = player
+        self.pondering = pondering
+        self.__stop_event = multiprocessing.Event()
+        self.__executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=1, initializer=_init_worker, initargs=(self.__stop_event, dict(engine_params or {})))
+        self.__future = None
+        self.__key = None  # 当前后台搜索的局面 gameengine.position_key()
+        self.__pondering = False  # 当前后台搜索是否为猜测对手应着之后的局面
+        self.__requested_at = None  # 轮到引擎走棋的时刻, None 表示还没有轮到引擎
+        self.__last_result = None
+        self.__hits = 0
+        self.__misses = 0
+        self.latencies = []  # 每步棋的感知延迟(秒)
+
+    def __submit(self, arena, player):
+        # 在主线程中序列化, 进程池的后台线程稍后发送时 arena 可能已经被修改
+        future = self.__executor.submit(_search, pickle.dumps(arena, pickle.HIGHEST_PROTOCOL), player)
+        future.add_done_callback(_stamp_finished)
+        self.__future = future
+        self.__key = gameengine.position_key(arena, player)
+
+    def __abort(self):
+        """中止后台搜索并等待子进程空闲, 结果丢弃"""
+        if self.__future is None:
+            return
+        self.__stop_event.set()
+        try:
+            concurrent.futures.wait([self.__future])
+        finally:
+            self.__stop_event.clear()
+        self.__future = None
+        self.__key = None
+        self.__pondering = False
+
+    def start_thinking(self, arena):
+        """轮到引擎走棋, 立即开始搜索 arena 局面(没有可用的后台思考结果时使用)"""
+        self.__abort()
+        self.__requested_at = time.perf_counter()
+        self.__submit(arena, self.player)
+
+    def start_pondering(self, arena):
+        """引擎的走法已经落子, arena 为轮到对手走棋的局面; 按上一步的主要变例猜测对手的应着并开始后台搜索
+
+        :return: 预测的对手应着(打包的走法), 无法预测或不做后台思考时返回 None
+        """
+        self.__abort()
+        self.__requested_at = None
+        pv = self.__last_result.pv if self.__last_result is not None else ()
+        if not self.pondering or len(pv) < 2:
+            return None
+        predicted = pv[1]
+        opponent = gameengine.opponent_of(arena, self.player)
+        if opponent is None or predicted not in arena.retrieve_packed_legal_moves(opponent):
+            return None  # 主要变例来自置换表时可能已经不适用于当前局面
+        child = arena.copy()
+        gameengine.apply_move(child, predicted)
+        self.__submit(child, self.player)
+        self.__pondering = True
+        return predicted
+
+    def opponent_moved(self, arena):
+        """对手已经走棋, arena 为轮到引擎走棋的局面
+
+        :return: 后台思考是否命中
+        :rtype : bool
+        """
+        if self.__pondering:
+            if self.__key == gameengine.position_key(arena, self.player):
+                self.__hits += 1
+                self.__pondering = False
+                self.__requested_at = time.perf_counter()
+                return True
+            self.__misses += 1
+        self.start_thinking(arena)
+        return False
+
+    def poll(self):
+        """轮到引擎走棋且搜索已经完成时返回结果, 否则返回 None; 每个结果只返回一次
+
+        :rtype : gameengine.SearchResult
+        """
+        future = self.__future
+        if self.__requested_at is None or future is None or not future.done():
+            return None
+        result = future.result()
+        finished_at = getattr(future, 'finished_at', None) or time.perf_counter()
+        self.latencies.append(max(0.0, finished_at - self.__requested_at))
+        self.__future = None
+        self.__key = None
+        self.__requested_at = None
+        self.__last_result = result
+        return result
+
+    def wait(self, timeout=None):
+        """阻塞直到 poll() 有结果
+
+        :rtype : gameengine.SearchResult
+        """
+        if self.__future is not None:
+            concurrent.futures.wait([self.__future], timeout=timeout)
+        return self.poll()
+
+    def stats(self):
+        """
+        :return: 引擎走棋次数, 后台思考命中次数, 未命中次数, 平均和最大感知延迟(毫秒)
+        :rtype : PonderStats
+        """
+        latencies = self.latencies
+        mean = sum(latencies) / len(latencies) * 1e3 if latencies else 0.0
+        maximum = max(latencies) * 1e3 if latencies else 0.0
+        return PonderStats(len(latencies), self.__hits, self.__misses, mean, maximum)
+
+    def close(self):
+        """中止后台搜索并结束子进程"""
+        self.__abort()
+        self.__executor.shutdown(wait=True)
@@ -0,0 +1,114 @@
+# -*-encoding:utf8;-*-
+"""客户端热点路径计时
+
+每个被统计的代码段保存最近若干次的耗时, 用于在屏幕上显示滚动直方图或导出 CSV;
+同时在同名的 PStatCollector 上计时, 连接 pstats 工具后可以看到相同的数据.
+"""
+from __future__ import print_function
+
+import collections
+import csv
+import time
+import panda3d.core
+
+# 直方图分桶上限(毫秒), 最后一个桶收集所有更慢的样本
+HISTOGRAM_BUCKETS = (0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0)
+HISTOGRAM_GLYPHS = ' .:-=+*#'
+
+
+class HotPathProfiler(object):
+    """Usage:
+        t = profiler.start('mouseTask')
+        ...  # 被统计的代码段
+        profiler.stop('mouseTask', t)
+
+    未启用时 start() 返回 None, stop() 立即返回, 开销只有两次方法调用
+    """
+
+    def __init__(self, names, window=300, prefix='Chess'):
+        """
+        :param names: 代码段名称列表, 决定屏幕显示顺序
+        :param window: 每个代码段保留的最近样本数量
+        :param prefix: PStats 中的父级收集器名称
+        """
+        self.enabled = False
+        self.__names = tuple(names)
+        self.__samples = dict((name, collections.deque(maxlen=window)) for name in self.__names)
+        self.__collectors = dict(
+            (name, panda3d.core.PStatCollector('{}:{}'.format(prefix, name))) for name in self.__names)
+
+    @property
+    def names(self):
+        return self.__names
+
+    def start(self, name):
+        if not self.enabled:
+            return None
+        self.__collectors[name].start()
+        return time.perf_counter()
+
+    def stop(self, name, started):
+        if started is None:
+            return
+        self.__samples[name].append((time.perf_counter() - started) * 1e3)
+        self.__collectors[name].stop()
+
+    def add_sample(self, name, milliseconds):
+        """记录一个在别处测得的耗时(例如帧间隔)"""
+        if self.enabled:
+            self.__samples[name].append(milliseconds)
+
+    def set_window(self, window):
+        """改变每个代码段保留的样本数量, 已有的样本只保留最近的部分(例如重放录制的输入时保留全部帧)"""
+        for name in self.__names:
+            self.__samples[name] = collections.deque(self.__samples[name], maxlen=window)
+
+    def clear(self):
+        for samples in self.__samples.values():
+            samples.clear()
+
+    def summary(self, name):
+        """
+        :return: 样本数, 平均值, p95, 最大值(毫秒)
+        :rtype : int, float, float, float
+        """
+        samples = sorted(self.__samples[name])
+        if not samples:
+            return 0, 0.0, 0.0, 0.0
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        return len(samples), sum(samples) / len(samples), p95, samples[-1]
+
+    def histogram(self, name):
+        """按 HISTOGRAM_BUCKETS 分桶计数
+
+        :rtype : list
+        """
+        counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        for value in self.__samples[name]:
+            k = 0
+            while k < len(HISTOGRAM_BUCKETS) and value >= HISTOGRAM_BUCKETS[k]:
+                k += 1
+            counts[k] += 1
+        return counts
+
+    def format_report(self):
+        """生成等宽字体显示的多行文本, 每行一个代码段: 统计值 + 直方图"""
+        lines = ['{:<14} {:>5} {:>8} {:>8} {:>8}  |<{}ms .. >={}ms|'.format(
+            'section', 'n', 'mean', 'p95', 'max', HISTOGRAM_BUCKETS[0], HISTOGRAM_BUCKETS[-1])]
+        for name in self.__names:
+            n, mean, p95, worst = self.summary(name)
+            counts = self.histogram(name)
+            peak = max(counts) or 1
+            bars = ''.join(
+                HISTOGRAM_GLYPHS[(len(HISTOGRAM_GLYPHS) - 1) * c // peak] if c else ' ' for c in counts)
+            lines.append('{:<14} {:>5} {:>8.3f} {:>8.3f} {:>8.3f}  |{}|'.format(name, n, mean, p95, worst, bars))
+        return '\n'.join(lines)
+
+    def dump_csv(self, path):
+        """导出全部样本: 每行 section, index, milliseconds"""
+        with open(path, 'w', newline='') as f:  # csv 模块自己写行尾, 否则 Windows 上每行之后多一个空行
+            writer = csv.writer(f)
+            writer.writerow(['section', 'index', 'milliseconds'])
+            for name in self.__names:
+                for index, value in enumerate(self.__samples[name]):
+                    writer.writerow([name, index, '{:.6f}'.format(value)])
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""客户端输入录制和无界面重放: 录下一局的鼠标和按键输入, 之后离屏全速重放, 用作可重复的性能和正确性测试
+
+录制: MyChessboard.startRecording() 之后, inputTask 每帧写一条帧记录(帧间隔)和一条鼠标位置记录,
+MyChessboard 响应的按键事件(RECORDED_EVENTS)按发生顺序写在所属的帧之后; quit() 时写入结束局面.
+鼠标坐标量化为 int16, 录制时 mouseTask 看到的也是量化之后的坐标, 重放的拾取结果与录制时一致.
+界面控件(Show moves 复选框)和 F3/F4 不录制, 它们不改变局面; 人机对弈时引擎的应着不来自输入, 不能录制.
+
+重放: replay() 把全局时钟切换为从属模式, 逐帧设置录制的帧时间后调用 taskMgr.step(), 动画与录制时逐帧一致;
+鼠标位置和按键事件由 inputTask 从录制文件取出, 按键事件经 messenger 发送, 与真实输入走相同的处理函数.
+不等待真实时间, 帧率只受处理速度限制.
+
+文件格式(小端):
+    文件头  FILE_HEADER: 魔数 b'CHIR', 版本, 窗口宽度, 窗口高度; 之后是初始局面 FEN (STRING)
+    记录    第一个字节是记录类型
+        REC_FRAME       FRAME_BODY: 帧间隔(秒), 每帧一条, 在这一帧的其余记录之前
+        REC_MOUSE       MOUSE_BODY: 鼠标位置 x, y, -1..1 量化为 -32767..32767
+        REC_MOUSE_SAME  鼠标位置与上一条 REC_MOUSE 相同, 鼠标静止时每帧只占一个字节
+        REC_NO_MOUSE    鼠标不在窗口中
+        REC_EVENT       EVENT_BODY: 事件在 RECORDED_EVENTS 中的下标
+        REC_END         结束局面 FEN (STRING), 重放结束时与之核对; 录制进程崩溃时没有这条记录
+    STRING 为 uint16 字节数加 UTF-8 内容
+
+Usage:
+    python main.py --record session.input            # 正常下棋, Esc 退出时保存
+    python main.py --replay session.input            # 离屏重放, 报告各处理函数的耗时和结束局面
+"""
+from __future__ import print_function
+
+import collections
+import struct
+import time
+
+FILE_MAGIC = b'CHIR'
+VERSION = 1
+FILE_HEADER = struct.Struct('<4sHHH')  # 魔数, 版本, 窗口宽度, 窗口高度
+STRING_LENGTH = struct.Struct('<H')
+FRAME_BODY = struct.Struct('<f')
+MOUSE_BODY = struct.Struct('<hh')
+EVENT_BODY = struct.Struct('<B')
+
+REC_FRAME = 1
+REC_MOUSE = 2
+REC_MOUSE_SAME = 3
+REC_NO_MOUSE = 4
+REC_EVENT = 5
+REC_END = 6
+
+MOUSE_SCALE = 32767
+
+# MyChessboard 响应的输入事件, 文件中保存的是下标, 只能在末尾追加
+RECORDED_EVENTS = ('mouse1', 'mouse1-up', 'mouse3', 'mouse3-up', 'wheel_up', 'wheel_down', 'page_up', 'page_down')
+
+# 重放报告中的处理函数耗时, 即 MyChessboard.profiler 中的同名代码段
+REPORTED_SECTIONS = ('mouseTask', 'mouse1Pressed', 'mouse1Released', 'collision', 'validMoves', 'marks', 'animation')
+
+Recording = collections.namedtuple('Recording', ['width', 'height', 'fen', 'frames', 'final_fen'])
+"""frames: [(帧间隔, 鼠标位置 (x, y) 或 None, 这一帧的事件名称元组)]; final_fen: 结束局面, 录制未正常结束时为 None"""
+
+ReplayReport = collections.namedtuple(
+    'ReplayReport', ['frames', 'events', 'seconds', 'sections', 'fen', 'expected_fen', 'matched'])
+"""sections: [(名称, 样本数, 平均值, p95, 最大值)], 耗时单位为毫秒, 'step' 为每帧 taskMgr.step() 的总耗时;
+fen: 重放结束时的局面; expected_fen: 录制结束时的局面, 未知时为 None;
+matched: 两者的棋子布局是否相同, 未知时为 None (不限制走棋顺序时客户端不记录轮到哪一方, 只比较布局)"""
+
+
+def quantize(value):
+    return max(-MOUSE_SCALE, min(MOUSE_SCALE, int(round(value * MOUSE_SCALE))))
+
+
+def quantize_mouse(mouse):
+    """:return: 量化之后再还原的鼠标位置, 与重放时读到的坐标完全相同"""
+    if mouse is None:
+        return None
+    return quantize(mouse[0]) / float(MOUSE_SCALE), quantize(mouse[1]) / float(MOUSE_SCALE)
+
+
+def encode_string(text):
+    data = text.encode('utf-8')
+    return STRING_LENGTH.pack(len(data)) + data
+
+
+def decode_string(data, offset):
+    """:return: 字符串, 之后的偏移量"""
+    length, = STRING_LENGTH.unpack_from(data, offset)
+    start = offset + STRING_LENGTH.size
+    if start + length > len(data):
+        raise struct.error('truncated string')
+    return data[start:start + length].decode('utf-8'), start + length
+
+
+class InputRecorder(object):
+    """把输入写入录制文件, 由 MyChessboard.startRecording() 创建
+
+    :param path: 录制文件路径, 已经存在时覆盖
+    :param width: 窗口宽度(像素), 重放时使用相同的宽高比, 鼠标坐标才能拾取到相同的格子
+    :param height: 窗口高度(像素)
+    :param fen: 开始录制时的局面
+    """
+
+    def __init__(self, path, width, height, fen):
+        self.path = path
+        self.frames = 0
+        self.events = 0
+        self.__last = None  # 上一条 REC_MOUSE 的量化坐标
+        self.__file = open(path, 'wb')
+        self.__file.write(FILE_HEADER.pack(FILE_MAGIC, VERSION, width, height) + encode_string(fen))
+
+    def record_frame(self, dt, mouse):
+        """每帧开始时调用一次
+
+        :param dt: 帧间隔(秒)
+        :param mouse: 鼠标位置 (x, y), 鼠标不在窗口中时为 None
+        :return: 量化之后的鼠标位置, 调用者应当使用这个坐标
+        """
+        self.frames += 1
+        record = bytearray([REC_FRAME]) + FRAME_BODY.pack(dt)
+        if mouse is None:
+            record.append(REC_NO_MOUSE)
+        else:
+            quantized = (quantize(mouse[0]), quantize(mouse[1]))
+            if quantized == self.__last:
+                record.append(REC_MOUSE_SAME)
+            else:
+                record.append(REC_MOUSE)
+                record += MOUSE_BODY.pack(*quantized)
+                self.__last = quantized
+        self.__file.write(record)
+        return quantize_mouse(mouse)
+
+    def record_event(self, name):
+        self.events += 1
+        self.__file.write(bytearray([REC_EVENT]) + EVENT_BODY.pack(RECORDED_EVENTS.index(name)))
+
+    def close(self, fen=None):
+        """:param fen: 结束时的局面, 写入 REC_END 供重放核对"""
+        if self.__file is None:
+            return
+        if fen is not None:
+            self.__file.write(bytearray([REC_END]) + encode_string(fen))
+        self.__file.close()
+        self.__file = None
+
+
+def read_recording(path):
+    """读取录制文件, 末尾写了一半的记录忽略(录制进程崩溃), 文件头损坏或出现未知记录时上报 ValueError 异常
+
+    :rtype : Recording
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        magic, version, width, height = FILE_HEADER.unpack_from(data, 0)
+        fen, offset = decode_string(data, FILE_HEADER.size)
+    except struct.error:
+        raise ValueError('input recording too short: {}'.format(path))
+    if magic != FILE_MAGIC or version != VERSION:
+        raise ValueError('not an input recording: {}'.format(path))
+    frames = []
+    final_fen = None
+    dt = mouse = events = None
+    last = None
+    try:
+        while offset < len(data):
+            kind = data[offset]
+            offset += 1
+            if kind == REC_FRAME:
+                if dt is not None:
+                    frames.append((dt, mouse, tuple(events)))
+                dt, = FRAME_BODY.unpack_from(data, offset)
+                offset += FRAME_BODY.size
+                mouse, events = None, []
+            elif dt is None:
+                raise ValueError('input recording has a record outside of frames: {}'.format(path))
+            elif kind == REC_MOUSE:
+                x, y = MOUSE_BODY.unpack_from(data, offset)
+                offset += MOUSE_BODY.size
+                last = mouse = (x / float(MOUSE_SCALE), y / float(MOUSE_SCALE))
+            elif kind == REC_MOUSE_SAME:
+                mouse = last
+            elif kind == REC_NO_MOUSE:
+                mouse = None
+            elif kind == REC_EVENT:
+                index, = EVENT_BODY.unpack_from(data, offset)
+                offset += EVENT_BODY.size
+                if index >= len(RECORDED_EVENTS):
+                    raise ValueError('unknown event {} in input recording: {}'.format(index, path))
+                events.append(RECORDED_EVENTS[index])
+            elif kind == REC_END:
+                final_fen, offset = decode_string(data, offset)
+                break
+            else:
+                raise ValueError('unknown record type {} in input recording: {}'.format(kind, path))
+    except struct.error:
+        pass  # 最后一条记录不完整, 之前的帧仍然有效
+    if dt is not None:
+        frames.append((dt, mouse, tuple(events)))
+    return Recording(width, height, fen, frames, final_fen)
+
+
+class InputPlayback(object):
+    """MyChessboard.setInputSource() 的输入来源: 由 replay() 逐帧设置当前帧的鼠标位置和事件"""
+
+    def __init__(self):
+        self.mouse = None
+        self.events = ()
+
+    def next_frame(self):
+        """由 inputTask 每帧调用一次
+
+        :return: 鼠标位置, 这一帧的事件名称
+        """
+        mouse, events = self.mouse, self.events
+        self.events = ()
+        return mouse, events
+
+
+def replay(base, recording):
+    """在 base 上全速重放录制的输入
+
+    :param base: 刚创建的 MyChessboard, 通常为离屏窗口, 窗口大小应与录制时相同
+    :param recording: read_recording() 的返回值
+    :rtype : ReplayReport
+    """
+    import panda3d.core
+    import gameprofiler
+
+    fen = base.getPositionFen()
+    if fen.split()[0] != recording.fen.split()[0]:
+        raise ValueError('the recording does not start from the current position')
+    playback = InputPlayback()
+    base.setInputSource(playback)
+    clock = panda3d.core.ClockObject.getGlobalClock()
+    mode = clock.getMode()
+    clock.setMode(panda3d.core.ClockObject.MSlave)
+    profiler = base.profiler
+    profiler.set_window(len(recording.frames))
+    profiler.clear()
+    profiler.enabled = True
+    steps = gameprofiler.HotPathProfiler(['step'], window=len(recording.frames))
+    steps.enabled = True
+    events = 0
+    frameTime = clock.getFrameTime()
+    started = time.perf_counter()
+    try:
+        for dt, mouse, names in recording.frames:
+            frameTime += dt
+            clock.setFrameTime(frameTime)
+            clock.setDt(dt)
+            playback.mouse, playback.events = mouse, names
+            events += len(names)
+            stepStarted = steps.start('step')
+            base.taskMgr.step()
+            steps.stop('step', stepStarted)
+    finally:
+        elapsed = time.perf_counter() - started
+        profiler.enabled = False
+        base.setInputSource(None)
+        clock.setMode(mode)
+    sections = [('step',) + steps.summary('step')]
+    sections += [(name,) + profiler.summary(name) for name in REPORTED_SECTIONS if name in profiler.names]
+    fen = base.getPositionFen()
+    matched = None if recording.final_fen is None else fen.split()[0] == recording.final_fen.split()[0]
+    return ReplayReport(len(recording.frames), events, elapsed, sections, fen, recording.final_fen, matched)
+
+
+def format_report(report):
+    lines = ['{} frames, {} events in {:.2f} s: {:.0f} frames/s'.format(
+        report.frames, report.events, report.seconds, report.frames / report.seconds if report.seconds else 0.0)]
+    lines.append('{:<16} {:>6} {:>9} {:>9} {:>9}'.format('section', 'n', 'mean ms', 'p95 ms', 'max ms'))
+    for name, count, mean, p95, worst in report.sections:
+        lines.append('{:<16} {:>6} {:>9.3f} {:>9.3f} {:>9.3f}'.format(name, count, mean, p95, worst))
+    lines.append('final position: {}'.format(report.fen))
+    if report.expected_fen is not None:
+        lines.append('recorded final: {} ({})'.format(
+            report.expected_fen, 'match' if report.matched else 'MISMATCH'))
+    return '\n'.join(lines)
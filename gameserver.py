@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""基于 asyncio 的多对局服务器, 一个进程托管大量 GameArena 会话
+
+通信协议(所有整数均为网络字节序):
+    帧       = 长度(uint16) + 内容
+    请求内容 = 操作码(uint8) + 会话编号(uint32) + 请求编号(uint32) + 参数
+    应答内容 = 操作码(uint8) + 请求编号(uint32) + 状态码(uint8) + 数据
+
+    OP_NEW    参数: 可选的 FEN(UTF-8), 省略时为标准开局     数据: 新会话编号(uint32)
+    OP_QUERY  参数: 起点格子(uint16)                        数据: 全部合法终点格子(uint16 数组)
+    OP_MOVE   参数: 起点格子(uint16) + 终点格子(uint16)      数据: 合法走法可能发生变化的棋子所在格子(uint16 数组);
+              格子太多, 一帧放不下时已经走棋, 应答 STATUS_BOARD_CHANGED 而不带数据, 客户端应重新查询全部棋子
+    OP_CLOSE  参数: 无                                      数据: 无
+
+格子编号为 x + y * 棋盘宽度, OP_NEW 的棋盘最多 MAX_BOARD_SQUARES 格, 否则应答 STATUS_BAD_REQUEST. 客户端收到 OP_MOVE 应答后只需重新查询应答中列出的格子, 其余棋子的走法不变. 同一个事件循环周期内产生的全部应答合并成一次 transport.write().
+
+Usage:
+    python gameserver.py --port 7878
+    python gameserver.py --unix /tmp/chess.sock
+"""
+from __future__ import print_function
+
+import asyncio
+import os
+import struct
+import sys
+import gamearena
+import gamejournal
+
+OP_NEW = 1
+OP_QUERY = 2
+OP_MOVE = 3
+OP_CLOSE = 4
+
+STATUS_OK = 0
+STATUS_NO_SESSION = 1
+STATUS_EMPTY_SQUARE = 2
+STATUS_ILLEGAL_MOVE = 3
+STATUS_BAD_REQUEST = 4
+STATUS_TOO_MANY_SESSIONS = 5
+STATUS_BOARD_CHANGED = 6
+
+FRAME_LENGTH = struct.Struct('!H')
+REQUEST_HEADER = struct.Struct('!BII')
+RESPONSE_HEADER = struct.Struct('!BIB')
+SESSION = struct.Struct('!I')
+SQUARE = struct.Struct('!H')
+MOVE = struct.Struct('!HH')
+MAX_BOARD_SQUARES = 1 << 16  # 格子编号必须放得进 SQUARE (uint16)
+MAX_REPLY_SQUARES = ((1 << 16) - 1 - RESPONSE_HEADER.size) // SQUARE.size  # 一个应答帧最多能列出的格子数
+
+
+def encode_frame(payload):
+    return FRAME_LENGTH.pack(len(payload)) + payload
+
+
+def encode_request(opcode, session_id, request_id, body=b''):
+    return encode_frame(REQUEST_HEADER.pack(opcode, session_id, request_id) + body)
+
+
+def encode_response(opcode, request_id, status, body=b''):
+    return encode_frame(RESPONSE_HEADER.pack(opcode, request_id, status) + body)
+
+
+def encode_squares(squares):
+    """把格子编号序列编码成 uint16 数组"""
+    return struct.pack('!{}H'.format(len(squares)), *squares)
+
+
+def decode_squares(body):
+    """把应答数据还原成格子编号的元组"""
+    return struct.unpack('!{}H'.format(len(body) // 2), body)
+
+
+def check_fen(fen):
+    """检查客户端提供的 FEN, 在创建竞技场之前拒绝空的棋盘和过大的棋盘, 不合格时上报 ValueError 异常"""
+    width, ranks, pieces = gamearena.parse_fen_placement(fen)
+    if not 1 <= width or not 1 <= ranks or width * ranks > MAX_BOARD_SQUARES:
+        raise ValueError('unsupported board size {}x{}'.format(width, ranks))
+
+
+class FrameDecoder(object):
+    """从字节流中切分出完整的帧, 服务器和客户端共用"""
+
+    def __init__(self):
+        self.__buffer = bytearray()
+
+    def feed(self, data):
+        """
+        :return: 本次可以取出的全部帧内容
+        :rtype : list
+        """
+        buf = self.__buffer
+        buf += data
+        frames = []
+        offset = 0
+        while len(buf) - offset >= FRAME_LENGTH.size:
+            length, = FRAME_LENGTH.unpack_from(buf, offset)
+            end = offset + FRAME_LENGTH.size + length
+            if end > len(buf):
+                break
+            frames.append(bytes(buf[offset + FRAME_LENGTH.size:end]))
+            offset = end
+        del buf[:offset]
+        return frames
+
+
+class GameSessionRegistry(object):
+    """按会话编号管理 GameArena
+
+    :param journal_dir: 每个会话的走棋日志所在目录, 创建时从其中的日志恢复上次未关闭的会话; None 表示不记录日志
+    :param journal_window: 日志的组提交间隔(秒), 全部会话共用一个刷盘线程
+    """
+
+    def __init__(self, max_sessions=100000, journal_dir=None, journal_window=gamejournal.DEFAULT_WINDOW):
+        self.__sessions = {}
+        self.__next_id = 1
+        self.__max_sessions = max_sessions
+        self.__journal_dir = journal_dir
+        self.__journals = {}
+        self.__journal_window = journal_window
+        self.__committer = None
+        if journal_dir is not None:
+            self.__committer = gamejournal.GroupCommit(journal_window) if journal_window else None
+            self.__recover_sessions()
+
+    def __journal_path(self, session_id):
+        return os.path.join(self.__journal_dir, 'session-{}.journal'.format(session_id))
+
+    def __recover_sessions(self):
+        """重放目录中的全部日志, 会话编号保持不变"""
+        for name in sorted(os.listdir(self.__journal_dir)):
+            if not (name.startswith('session-') and name.endswith('.journal')):
+                continue
+            digits = name[len('session-'):-len('.journal')]
+            session_id = int(digits) if digits.isascii() and digits.isdigit() else None
+            if session_id is None or str(session_id) != digits or session_id >= 1 << 32:
+                print('skipping journal {}: not a session journal name'.format(name), file=sys.stderr)
+                continue
+            path = self.__journal_path(session_id)
+            try:
+                arena, contents = gamejournal.recover_arena(path)
+            except ValueError as e:
+                print('skipping journal {}: {}'.format(path, e), file=sys.stderr)
+                continue
+            self.__sessions[session_id] = arena
+            self.__attach_journal(session_id, arena, self.__open_journal(session_id))
+            self.__next_id = max(self.__next_id, session_id + 1)
+
+    def __open_journal(self, session_id, fen=None):
+        return gamejournal.GameJournal(self.__journal_path(session_id), fen=fen, window=self.__journal_window,
+                                       committer=self.__committer)
+
+    def __attach_journal(self, session_id, arena, journal):
+        arena.attach_journal(journal)
+        self.__journals[session_id] = journal
+
+    def __len__(self):
+        return len(self.__sessions)
+
+    def new_session(self, fen=None):
+        """
+        :return: 会话编号, 超过上限时返回 None
+        """
+        if len(self.__sessions) >= self.__max_sessions:
+            return None
+        arena = gamearena.new_arena_from_fen(fen) if fen else gamearena.new_standard_chess_arena()
+        session_id = self.__next_id
+        self.__next_id += 1
+        self.__sessions[session_id] = arena
+        if self.__journal_dir is not None:
+            self.__attach_journal(session_id, arena,
+                                  self.__open_journal(session_id, fen or gamearena.STANDARD_CHESS_FEN))
+        return session_id
+
+    def get(self, session_id):
+        return self.__sessions.get(session_id)
+
+    def close(self, session_id):
+        """结束会话, 对局已经正常结束, 日志文件一起删除"""
+        journal = self.__journals.pop(session_id, None)
+        if journal is not None:
+            journal.close()
+            os.remove(journal.path)
+        return self.__sessions.pop(session_id, None) is not None
+
+    def shutdown(self):
+        """停止刷盘线程并关闭全部日志, 日志文件保留, 下次启动时恢复这些会话"""
+        if self.__committer is not None:
+            self.__committer.close()
+        for journal in self.__journals.values():
+            journal.close()
+        self.__journals.clear()
+
+    def handle(self, payload):
+        """处理一个请求帧
+
+        :return: 完整的应答帧
+        :rtype : bytes
+        """
+        if len(payload) < REQUEST_HEADER.size:
+            return encode_response(0, 0, STATUS_BAD_REQUEST)
+        opcode, session_id, request_id = REQUEST_HEADER.unpack_from(payload)
+        body = payload[REQUEST_HEADER.size:]
+        try:
+            if opcode == OP_NEW:
+                return self.__handle_new(request_id, body)
+            arena = self.__sessions.get(session_id)
+            if arena is None:
+                return encode_response(opcode, request_id, STATUS_NO_SESSION)
+            if opcode == OP_QUERY:
+                return self.__handle_query(arena, request_id, body)
+            if opcode == OP_MOVE:
+                return self.__handle_move(arena, request_id, body)
+            if opcode == OP_CLOSE:
+                self.close(session_id)
+                return encode_response(opcode, request_id, STATUS_OK)
+        except (ValueError, struct.error):
+            pass
+        return encode_response(opcode, request_id, STATUS_BAD_REQUEST)
+
+    def __handle_new(self, request_id, body):
+        fen = body.decode('utf-8') if body else None
+        if fen is not None:
+            check_fen(fen)
+        session_id = self.new_session(fen)
+        if session_id is None:
+            return encode_response(OP_NEW, request_id, STATUS_TOO_MANY_SESSIONS)
+        return encode_response(OP_NEW, request_id, STATUS_OK, SESSION.pack(session_id))
+
+    @staticmethod
+    def __handle_query(arena, request_id, body):
+        index, = SQUARE.unpack(body)
+        unit_id = arena.find_unit_id_on_index(index)
+        if not unit_id:
+            return encode_response(OP_QUERY, request_id, STATUS_EMPTY_SQUARE)
+        destinations = arena.retrieve_legal_destinations_of_unit(unit_id)
+        return encode_response(OP_QUERY, request_id, STATUS_OK, encode_squares(destinations))
+
+    @staticmethod
+    def __handle_move(arena, request_id, body):
+        fr, to = MOVE.unpack(body)
+        unit_id = arena.find_unit_id_on_index(fr)
+        if not unit_id:
+            return encode_response(OP_MOVE, request_id, STATUS_EMPTY_SQUARE)
+        if to not in arena.retrieve_legal_destinations_of_unit(unit_id):
+            return encode_response(OP_MOVE, request_id, STATUS_ILLEGAL_MOVE)
+        restricted = arena.retrieve_restricted_units()
+        arena.move_unit_to_index(unit_id, to)
+        squares = []
+        for changed in arena.changed_units | restricted | arena.retrieve_restricted_units():
+            try:
+                squares.append(arena.find_index_from_unit_id(changed))
+            except ValueError:
+                continue  # 被吃掉的棋子
+        if len(squares) > MAX_REPLY_SQUARES:
+            # 棋已经走了, 不能再应答 STATUS_BAD_REQUEST, 否则客户端和服务器的局面不一致
+            return encode_response(OP_MOVE, request_id, STATUS_BOARD_CHANGED)
+        squares.sort()
+        return encode_response(OP_MOVE, request_id, STATUS_OK, encode_squares(squares))
+
+
+class GameServerProtocol(asyncio.Protocol):
+    """一个客户端连接, 应答在本轮事件循环结束后合并发送"""
+
+    def __init__(self, registry):
+        self.__registry = registry
+        self.__decoder = FrameDecoder()
+        self.__pending = []
+        self.__transport = None
+
+    def connection_made(self, transport):
+        self.__transport = transport
+
+    def connection_lost(self, exc):
+        self.__transport = None
+
+    def data_received(self, data):
+        frames = self.__decoder.feed(data)
+        if not frames:
+            return
+        if not self.__pending:
+            asyncio.get_running_loop().call_soon(self.__flush)
+        handle = self.__registry.handle
+        self.__pending += [handle(payload) for payload in frames]
+
+    def __flush(self):
+        if self.__transport is not None and self.__pending:
+            self.__transport.write(b''.join(self.__pending))
+        self.__pending = []
+
+
+async def serve(registry, host='127.0.0.1', port=7878, path=None):
+    """启动服务器, 返回 asyncio.Server 对象; 指定 path 时监听 Unix 域套接字"""
+    loop = asyncio.get_running_loop()
+    if path:
+        return await loop.create_unix_server(lambda: GameServerProtocol(registry), path)
+    return await loop.create_server(lambda: GameServerProtocol(registry), host, port)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='GameArena multi-game server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7878, help='0 表示由系统分配端口')
+    parser.add_argument('--unix', metavar='PATH', help='改为监听 Unix 域套接字')
+    parser.add_argument('--max-sessions', type=int, default=100000)
+    parser.add_argument('--journal-dir', metavar='DIR', help='每个会话写一个走棋日志, 启动时恢复目录中的会话')
+    parser.add_argument('--journal-window', type=float, default=gamejournal.DEFAULT_WINDOW,
+                        help='日志的组提交间隔(秒), 0 表示每步棋都 fsync')
+    args = parser.parse_args(argv)
+    registry = GameSessionRegistry(args.max_sessions, args.journal_dir, args.journal_window)
+
+    async def run():
+        server = await serve(registry, args.host, args.port, args.unix)
+        for sock in server.sockets:
+            print('listening on {}'.format(sock.getsockname()))
+        sys.stdout.flush()
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        registry.shutdown()
+
+
+if '__main__' == __name__:
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""共享内存局面批处理: 多进程分析局面时不再 pickle GameArena
+
+把 GameArena 交给工作进程时, pickle 要序列化全部 Unit 实例、走法缓存和 Square 元组, 开销比分析本身还大.
+这里改为把局面写成固定布局的二进制记录, 放进 multiprocessing.shared_memory 中的环形缓冲区:
+生产者(主进程的喂料线程)写入局面, 工作进程直接在共享内存中读取局面并写回结果, 消费者按写入顺序取回结果.
+
+共享内存布局(小端):
+    头部   64 字节  HEADER: 魔数, 版本, 槽位数量, 槽位大小, 已领取的序号(tail)
+    槽位   SLOT_SIZE 字节 * 槽位数量
+        SLOT_HEADER  状态, 走棋一方, 棋盘宽度, 横行数量, 序号
+        SLOT_RESULT  分数, 合法走法数量, 搜索节点数, 最佳走法(打包的走法)
+        格子         MAX_SQUARES 个, 每个 2 字节: 单位类型编码, 所属玩家 | 已走过标志(最高位); 空格子为 0
+
+槽位状态: SLOT_EMPTY -> SLOT_FILLED(生产者写入局面) -> SLOT_DONE(工作进程写入结果) -> SLOT_EMPTY(消费者取走结果)
+三个信号量分别记录空闲槽位、待分析的局面和已完成的结果, 工作进程之间用一把锁分配序号.
+
+Usage:
+    with AnalysisPool(workers=4, depth=2) as pool:
+        for result in pool.analyze_stream((arena, player) for arena, player in positions):
+            print(result.seq, result.score, result.legal_moves)
+"""
+from __future__ import print_function
+
+import collections
+import multiprocessing
+import os
+import struct
+import threading
+
+from multiprocessing import shared_memory
+
+import gamearena
+import gameengine
+
+MAGIC = b'CHSM'
+VERSION = 1
+MAX_SQUARES = 128  # 最大棋盘格子数, 例如 8x8 国际象棋或 9x10 中国象棋
+MOVED_FLAG = 0x80  # 格子第二个字节的最高位: 单位已经走过
+
+HEADER = struct.Struct('<4sHHIQ')  # 魔数, 版本, 槽位数量, 槽位大小, tail
+HEADER_SIZE = 64
+TAIL_OFFSET = 12
+SLOT_HEADER = struct.Struct('<BBBBIQ')  # 状态, 走棋一方, 宽度, 横行数量, 保留, 序号
+SLOT_RESULT = struct.Struct('<iIIQ')  # 分数, 合法走法数量, 节点数, 最佳走法
+CELLS_OFFSET = SLOT_HEADER.size + SLOT_RESULT.size
+SLOT_SIZE = (CELLS_OFFSET + 2 * MAX_SQUARES + 63) // 64 * 64
+
+SLOT_EMPTY = 0
+SLOT_FILLED = 1
+SLOT_DONE = 2
+
+AnalysisResult = collections.namedtuple('AnalysisResult', ['seq', 'score', 'legal_moves', 'nodes', 'move'])
+
+
+def encode_position(buf, offset, arena, player):
+    """把局面写入 buf[offset:offset + SLOT_SIZE] 的局面部分, 不修改槽位状态和结果
+
+    :param buf: 可写的 memoryview
+    """
+    width, ranks = arena.size
+    if width * ranks > MAX_SQUARES:
+        raise ValueError('board too large for shared memory slot: {}x{}'.format(width, ranks))
+    header = SLOT_HEADER.unpack_from(buf, offset)
+    SLOT_HEADER.pack_into(buf, offset, header[0], player, width, ranks, 0, header[5])
+    cells = offset + CELLS_OFFSET
+    buf[cells:cells + 2 * width * ranks] = bytes(2 * width * ranks)
+    for index, type_code, owner, moved in arena.position_key():
+        buf[cells + 2 * index] = type_code
+        buf[cells + 2 * index + 1] = owner | (MOVED_FLAG if moved else 0)
+
+
+def decode_position(buf, offset):
+    """encode_position() 的逆操作, 直接读取共享内存
+
+    :return: 新建的竞技场, 走棋一方
+    :rtype : GameArena, GameArena.PlayerID
+    """
+    state, player, width, ranks, reserved, seq = SLOT_HEADER.unpack_from(buf, offset)
+    arena = gamearena.GameArena(width, ranks)
+    cells = offset + CELLS_OFFSET
+    for index in range(width * ranks):
+        type_code = buf[cells + 2 * index]
+        if type_code:
+            owner = buf[cells + 2 * index + 1]
+            arena.new_unit_recruited_by_player(
+                gamearena.GameArena.PlayerID(owner & ~MOVED_FLAG), arena.square_of_index(index),
+                gamearena.UNIT_TYPES[type_code], bool(owner & MOVED_FLAG))
+    return arena, gamearena.GameArena.PlayerID(player)
+
+
+def analyze(arena, player, engine, depth):
+    """工作进程中对一个局面的分析, 共享内存和 pickle 两种传输方式使用同一个函数
+
+    :param depth: 0 表示只做静态评估并统计合法走法
+    :return: 分数, 合法走法数量, 节点数, 最佳走法(没有时为 0)
+    :rtype : int, int, int, int
+    """
+    moves = arena.retrieve_packed_legal_moves(player)
+    if depth <= 0 or not moves:
+        return engine.evaluate(arena, player, moves), len(moves), 1, 0
+    result = engine.search(arena, player, depth=depth)
+    return result.score, len(moves), result.nodes, result.move or 0
+
+
+class PositionRing(object):
+    """共享内存中的环形缓冲区; 创建者负责 unlink, 工作进程按名称连接
+
+    :param slots: 槽位数量, 同时在途的局面数量不会超过它
+    :param name: 连接已有的共享内存时使用
+    """
+
+    def __init__(self, slots=64, name=None):
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + slots * SLOT_SIZE)
+            self.owner = True
+            HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, slots, SLOT_SIZE, 0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+            magic, version, slots, slot_size, tail = HEADER.unpack_from(self.shm.buf, 0)
+            if magic != MAGIC or version != VERSION or slot_size != SLOT_SIZE:
+                raise ValueError('incompatible shared memory layout: {}'.format(name))
+        self.name = self.shm.name
+        self.slots = slots
+        self.buf = self.shm.buf
+
+    def offset_of(self, seq):
+        return HEADER_SIZE + (seq % self.slots) * SLOT_SIZE
+
+    def state_of(self, seq):
+        """:return: 序号 seq 所在槽位的状态, 槽位已被其他序号占用时返回 None"""
+        offset = self.offset_of(seq)
+        state, player, width, ranks, reserved, slot_seq = SLOT_HEADER.unpack_from(self.buf, offset)
+        return state if slot_seq == seq else None
+
+    def set_state(self, offset, state):
+        self.buf[offset] = state
+
+    def take_tail(self):
+        """工作进程领取下一个序号, 调用者必须持有锁"""
+        tail = struct.unpack_from('<Q', self.buf, TAIL_OFFSET)[0]
+        struct.pack_into('<Q', self.buf, TAIL_OFFSET, tail + 1)
+        return tail
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _worker_main(name, lock, filled, done, closing, depth):
+    """工作进程: 领取局面, 分析, 把结果写回同一个槽位"""
+    ring = PositionRing(name=name)
+    engine = gameengine.Engine(depth=max(depth, 1), tt_size=0)
+    try:
+        while True:
+            filled.acquire()
+            if closing.is_set():
+                break
+            with lock:
+                seq = ring.take_tail()
+            offset = ring.offset_of(seq)
+            arena, player = decode_position(ring.buf, offset)
+            score, legal_moves, nodes, move = analyze(arena, player, engine, depth)
+            SLOT_RESULT.pack_into(ring.buf, offset + SLOT_HEADER.size, score, legal_moves, nodes, move)
+            ring.set_state(offset, SLOT_DONE)
+            done.release()
+    finally:
+        ring.close()
+
+
+class AnalysisPool(object):
+    """生产者/消费者: analyze_stream() 的喂料线程把局面写入空闲槽位, 工作进程分析, 调用者按输入顺序取回结果
+
+    :param workers: 工作进程数量, 默认为 CPU 核数
+    :param slots: 环形缓冲区的槽位数量
+    :param depth: 搜索深度, 0 表示只做静态评估
+    """
+
+    def __init__(self, workers=None, slots=64, depth=0):
+        self.ring = PositionRing(slots)
+        self.__free = multiprocessing.Semaphore(slots)
+        self.__filled = multiprocessing.Semaphore(0)
+        self.__done = multiprocessing.Semaphore(0)
+        self.__closing = multiprocessing.Event()
+        self.__next_seq = 0  # 下一个局面的序号, 与共享内存中的 tail 保持一致
+        lock = multiprocessing.Lock()
+        self.__workers = [
+            multiprocessing.Process(target=_worker_main, name='AnalysisWorker',
+                                    args=(self.ring.name, lock, self.__filled, self.__done, self.__closing, depth))
+            for k in range(workers or os.cpu_count() or 1)]
+        for worker in self.__workers:
+            worker.daemon = True
+            worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def analyze_stream(self, positions):
+        """
+        :param positions: (arena, player) 的可迭代对象, 例如正在进行的对局的局面流, 按需读取
+        :return: 按输入顺序产生 AnalysisResult; 中途放弃时已经送出的局面仍会分析完, 结果丢弃
+        """
+        ring = self.ring
+        first = self.__next_seq
+        feeder_state = {'produced': first, 'finished': False, 'error': None}
+        stopping = threading.Event()
+
+        def feed():
+            seq = first
+            try:
+                for arena, player in positions:
+                    self.__free.acquire()
+                    if stopping.is_set():
+                        self.__free.release()  # 没有使用这个槽位
+                        break
+                    offset = ring.offset_of(seq)
+                    SLOT_HEADER.pack_into(ring.buf, offset, SLOT_EMPTY, 0, 0, 0, 0, seq)
+                    encode_position(ring.buf, offset, arena, player)
+                    ring.set_state(offset, SLOT_FILLED)  # 局面写完之后才标记, 工作进程不会读到一半
+                    seq += 1
+                    feeder_state['produced'] = seq
+                    self.__filled.release()
+            except Exception as e:
+                feeder_state['error'] = e
+            finally:
+                feeder_state['finished'] = True
+                self.__done.release()  # 唤醒可能正在等待的消费者
+
+        def take(seq):
+            """等待序号 seq 的结果并释放槽位"""
+            while ring.state_of(seq) != SLOT_DONE:
+                # 每完成一个结果释放一次, 醒来后重新检查; 超时只是防止错过喂料线程结束的信号
+                self.__done.acquire(timeout=0.1)
+            offset = ring.offset_of(seq)
+            result = AnalysisResult(seq - first, *SLOT_RESULT.unpack_from(ring.buf, offset + SLOT_HEADER.size))
+            ring.set_state(offset, SLOT_EMPTY)
+            self.__free.release()
+            return result
+
+        feeder = threading.Thread(target=feed, name='AnalysisFeeder')
+        feeder.daemon = True
+        feeder.start()
+        seq = first
+        try:
+            while True:
+                if seq < feeder_state['produced']:
+                    result = take(seq)
+                    seq += 1
+                    yield result
+                elif feeder_state['finished']:
+                    break
+                else:
+                    self.__done.acquire(timeout=0.1)  # 等喂料线程读取下一个局面
+        finally:
+            stopping.set()
+            self.__free.release()  # 喂料线程可能正在等待空闲槽位
+            feeder.join()
+            self.__free.acquire()
+            while seq < feeder_state['produced']:
+                take(seq)  # 中途放弃时回收仍在分析的槽位
+                seq += 1
+            self.__next_seq = seq
+        if feeder_state['error'] is not None:
+            raise feeder_state['error']
+
+    def close(self):
+        """通知工作进程退出并释放共享内存"""
+        if self.ring is None:
+            return
+        self.__closing.set()
+        for worker in self.__workers:
+            self.__filled.release()
+        for worker in self.__workers:
+            worker.join()
+        self.ring.close()
+        self.ring = None
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""观战墙: 在同一个窗口中同时显示多盘对局
+
+每盘棋由各自的 GameArena 驱动, 全部棋盘方格合并成一个静态几何体, 全部棋子共用一个 InstancedPieceRenderer;
+不支持 shader 的渲染器(p3tinydisplay 软件渲染)改用 FlattenedPieceRenderer, 见 gameinstancing.new_piece_renderer().
+没有收到更新的棋盘在每帧中没有任何开销, 只有被 notifyChanged() 标记过的棋盘才会重新提交棋子实例.
+"""
+from __future__ import print_function
+
+import math
+import sys
+import panda3d.core
+import direct.showbase.ShowBase
+import direct.task.Task
+import gamearena
+import gameinstancing
+
+
+class SpectatorBoard(object):
+    """观战墙上的一个棋盘, 只记录位置和对应的 GameArena, 不持有任何场景图节点"""
+
+    def __init__(self, key, arena, origin):
+        self.key = key
+        self.arena = arena
+        self.origin = origin
+
+
+class SpectatorWall(direct.showbase.ShowBase.ShowBase):
+    def __init__(self, arenas, columns=None, spacing=9.0, fStartDirect=False, windowType=None):
+        """
+        :param arenas: GameArena 列表, 每个 GameArena 对应一个棋盘
+        :param columns: 每行显示几个棋盘, 默认尽量排成正方形
+        :param spacing: 相邻两个棋盘中心之间的距离(一个方格的边长为 1)
+        """
+        direct.showbase.ShowBase.ShowBase.__init__(self, fStartDirect=fStartDirect, windowType=windowType)
+        self.disableMouse()
+        count = len(arenas)
+        if not columns:
+            columns = int(math.ceil(math.sqrt(count)))
+        rows = (count + columns - 1) // columns
+        self.__boards = []
+        for k, arena in enumerate(arenas):
+            x = (k % columns - (columns - 1) * 0.5) * spacing
+            y = ((rows - 1) * 0.5 - k // columns) * spacing
+            self.__boards.append(SpectatorBoard(k, arena, (x, y, 0.0)))
+
+        self.__wallRoot = self.render.attachNewNode('spectatorWall')
+        self.__defaultSquares(self.__wallRoot)
+        self.__pieces = gameinstancing.new_piece_renderer(self.loader, self.__wallRoot, self.win.getGsg())
+        self.__dirty = set(range(count))  # 首帧需要提交全部棋盘
+        self.__defaultCamera(columns * spacing, rows * spacing)
+        self.taskMgr.add(self.refreshTask, 'SpectatorRefreshTask')
+        self.accept('escape', sys.exit)
+
+    @property
+    def boards(self):
+        return tuple(self.__boards)
+
+    def notifyChanged(self, key):
+        """通知观战墙第 key 个棋盘的 GameArena 已经发生变化, 下一帧刷新该棋盘的棋子"""
+        self.__dirty.add(key)
+
+    def applyMove(self, key, unit_id, square):
+        """在第 key 个棋盘上走一步棋, 并在下一帧刷新该棋盘"""
+        self.__boards[key].arena.move_unit_to_somewhere(unit_id, square)
+        self.__dirty.add(key)
+
+    def refreshTask(self, task):
+        """只处理被标记过的棋盘, 没有更新时直接返回"""
+        if self.__dirty:
+            for key in self.__dirty:
+                board = self.__boards[key]
+                self.__pieces.setPieces(key, gameinstancing.pieces_from_arena(board.arena, board.origin))
+            self.__dirty.clear()
+            self.__pieces.flush()
+        return direct.task.Task.cont
+
+    def getNumDrawCalls(self):
+        """棋子的绘制调用次数加上棋盘方格的绘制调用次数"""
+        geoms = 0
+        for np in self.__squares.findAllMatches('**/+GeomNode'):
+            geoms += np.node().getNumGeoms()
+        return self.__pieces.getNumDrawCalls() + geoms
+
+    def __defaultSquares(self, parent):
+        """为全部棋盘创建方格, 然后合并成一个静态几何体"""
+        white = (1, 1, 1, 1)
+        black = (0.3, 0.3, 0.3, 1)
+        colors = {1: white, 0: black}
+        square = self.loader.loadModel('models/square')
+        square.clearModelNodes()  # 否则每个方格的 ModelRoot 都会被保留下来, 无法合并
+        self.__squares = parent.attachNewNode('spectatorSquares')
+        for board in self.__boards:
+            xmax, ymax = board.arena.size
+            for y in range(ymax):
+                for x in range(xmax):
+                    holder = self.__squares.attachNewNode('square')
+                    holder.setPos(board.origin[0] + x - (xmax - 1) * 0.5,
+                                  board.origin[1] + y - (ymax - 1) * 0.5,
+                                  board.origin[2])
+                    holder.setColor(colors[(x + y) % 2])
+                    square.copyTo(holder)  # 共享实例(instanceTo)的节点无法合并, 因此每格复制一份
+        self.__squares.flattenStrong()  # 合并后全部棋盘方格只需极少量的绘制调用
+
+    def __defaultCamera(self, width, height):
+        """正交投影俯视整面观战墙"""
+        lens = panda3d.core.OrthographicLens()
+        aspect = self.getAspectRatio() if self.win else 1.0
+        if width / aspect >= height:
+            lens.setFilmSize(width, width / aspect)
+        else:
+            lens.setFilmSize(height * aspect, height)
+        lens.setNearFar(1, 100)
+        self.cam.node().setLens(lens)
+        self.camera.setPos(0, 0, 50)
+        self.camera.setHpr(0, -90, 0)
+
+
+def main():
+    boards = 16
+    if len(sys.argv) > 1:
+        boards = int(sys.argv[1])
+    wall = SpectatorWall([gamearena.new_standard_chess_arena() for k in range(boards)])
+    wall.run()
+
+
+if '__main__' == __name__:
+    main()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""引擎自对弈比赛: 两种引擎配置在进程池中轮流执白对弈, 用序贯概率比检验(SPRT)提前结束
+
+每局棋的结果在完成时立即以 JSON 行的形式写入输出文件, 中途停止也不会丢失已经下完的对局.
+每个开局局面下两局, 双方交换先后手. 比赛结束时报告每分钟对局数和每种配置的搜索速度(节点/秒).
+
+引擎配置的写法为 名称:参数=值,参数=值, 参数即 gameengine.Engine 的构造参数, 例如:
+    python gametournament.py --engine new:depth=2 --engine old:depth=2,ordering=0 --games 200 --workers 4
+
+SPRT 检验的假设为 H0: A 比 B 强 elo0, H1: A 比 B 强 elo1; 对数似然比越过上界时接受 H1, 越过下界时接受 H0.
+
+Usage:
+    python gametournament.py --engine A:depth=2 --engine B:depth=1 [--openings FILE] [--games 100]
+                             [--workers N] [--output tournament.jsonl] [--elo0 0] [--elo1 50]
+                             [--alpha 0.05] [--beta 0.05] [--max-plies 200]
+"""
+from __future__ import print_function
+
+import collections
+import concurrent.futures
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+import gamearena
+import gameengine
+
+WHITE = gamearena.WHITE
+BLACK = gamearena.BLACK
+
+# 没有指定开局文件时使用的开局局面
+DEFAULT_OPENINGS = (
+    gamearena.STANDARD_CHESS_FEN,
+    'rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w - - 0 2',
+    'rnbqkbnr/pp1ppppp/8/2p5/4P3/8/PPPP1PPP/RNBQKBNR w - - 0 2',
+    'rnbqkbnr/ppp1pppp/8/3p4/3P4/8/PPP1PPPP/RNBQKBNR w - - 0 2',
+    'rnbqkb1r/pppppppp/5n2/8/2P5/8/PP1PPPPP/RNBQKBNR w - - 1 2',
+    'rnbqkbnr/pppp1ppp/4p3/8/3PP3/8/PPP2PPP/RNBQKBNR b - - 0 2',
+)
+
+EngineSpec = collections.namedtuple('EngineSpec', ['name', 'params'])
+
+_stop_event = None  # 工作进程中的 multiprocessing.Event, 比赛提前结束时由主进程设置, 见 _init_worker()
+
+
+def parse_engine_spec(text):
+    """名称:参数=值,参数=值 -> EngineSpec, 数值参数自动转换为 int 或 float
+
+    :rtype : EngineSpec
+    """
+    name, _, options = text.partition(':')
+    params = {}
+    for option in filter(None, options.split(',')):
+        key, _, value = option.partition('=')
+        for convert in (int, float):
+            try:
+                value = convert(value)
+                break
+            except ValueError:
+                continue
+        params[key.strip().replace('-', '_')] = value
+    return EngineSpec(name, params)
+
+
+def load_openings(path):
+    """每行一个 FEN, 忽略空行和 # 开头的注释行
+
+    :rtype : list
+    """
+    openings = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                openings.append(line)
+    return openings
+
+
+def _init_worker(stop_event):
+    global _stop_event
+    _stop_event = stop_event
+
+
+def play_game(task):
+    """在工作进程中下一局棋
+
+    :param task: dict(game, opening, white, black, max_plies), white 和 black 为 EngineSpec 元组
+    :return: 可以直接写成 JSON 的对局记录, result 为 '1-0', '0-1' 或 '1/2-1/2'; 比赛已经结束时返回 None
+    :rtype : dict
+    """
+    started = time.perf_counter()
+    fen = task['opening']
+    arena = gamearena.new_arena_from_fen(fen)
+    fields = fen.split()
+    side = BLACK if len(fields) > 1 and fields[1] == 'b' else WHITE
+    specs = {WHITE: EngineSpec(*task['white']), BLACK: EngineSpec(*task['black'])}
+    engines = dict((player, gameengine.Engine(name=spec.name, **spec.params)) for player, spec in specs.items())
+    stats = dict((player, {'nodes': 0, 'seconds': 0.0}) for player in specs)
+    repetitions = collections.Counter()
+    moves = []
+    result, reason = '1/2-1/2', 'max plies'
+    for ply in range(task['max_plies']):
+        if _stop_event is not None and _stop_event.is_set():
+            return None
+        key = gameengine.position_key(arena, side)
+        repetitions[key] += 1
+        if repetitions[key] >= 3:
+            reason = 'repetition'
+            break
+        if all(unit.royal for unit_id, square, unit in arena.retrieve_units_on_board()):
+            reason = 'insufficient material'
+            break
+        search = engines[side].search(arena, side, stop_event=_stop_event)
+        stats[side]['nodes'] += search.nodes
+        stats[side]['seconds'] += search.elapsed
+        if search.move is None:
+            if arena.is_in_check(side):
+                result, reason = ('0-1' if side == WHITE else '1-0'), 'checkmate'
+            else:
+                reason = 'stalemate'
+            break
+        moves.append(gamearena.format_coordinate_move(arena, search.move))
+        gameengine.apply_move(arena, search.move)
+        side = BLACK if side == WHITE else WHITE
+    return {
+        'game': task['game'],
+        'opening': fen,
+        'white': specs[WHITE].name,
+        'black': specs[BLACK].name,
+        'result': result,
+        'reason': reason,
+        'plies': len(moves),
+        'moves': ' '.join(moves),
+        'final_fen': gamearena.fen_of_arena(arena, side_to_move=side),
+        'nodes': {specs[WHITE].name: stats[WHITE]['nodes'], specs[BLACK].name: stats[BLACK]['nodes']},
+        'search_seconds': {specs[WHITE].name: stats[WHITE]['seconds'], specs[BLACK].name: stats[BLACK]['seconds']},
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def score_of(record, name):
+    """对局结果换算成 name 一方的得分: 1, 0.5 或 0"""
+    if record['result'] == '1/2-1/2':
+        return 0.5
+    white_won = record['result'] == '1-0'
+    return 1.0 if white_won == (record['white'] == name) else 0.0
+
+
+def elo_to_score(elo):
+    return 1.0 / (1.0 + 10.0 ** (-elo / 400.0))
+
+
+def sprt_llr(wins, draws, losses, elo0, elo1):
+    """按正态近似计算广义 SPRT 的对数似然比
+
+    :rtype : float
+    """
+    n = wins + draws + losses
+    if n == 0:
+        return 0.0
+    mean = (wins + 0.5 * draws) / n
+    variance = (wins * (1 - mean) ** 2 + draws * (0.5 - mean) ** 2 + losses * mean ** 2) / n
+    if variance == 0:
+        return 0.0  # 全胜, 全负或全部和棋时方差为零, 先不做判断
+    s0, s1 = elo_to_score(elo0), elo_to_score(elo1)
+    return n * (s1 - s0) * (2 * mean - s0 - s1) / (2 * variance)
+
+
+def sprt_bounds(alpha, beta):
+    """
+    :return: 下界(接受 H0), 上界(接受 H1)
+    :rtype : float, float
+    """
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+def elo_estimate(wins, draws, losses):
+    n = wins + draws + losses
+    if n == 0:
+        return 0.0
+    score = (wins + 0.5 * draws) / n
+    score = min(max(score, 1e-3), 1 - 1e-3)
+    return -400.0 * math.log10(1.0 / score - 1.0)
+
+
+def build_tasks(specs, openings, games, max_plies):
+    """每个开局下两局, 交换先后手; 开局按顺序循环使用"""
+    a, b = specs
+    tasks = []
+    for game in range(games):
+        opening = openings[(game // 2) % len(openings)]
+        white, black = (a, b) if game % 2 == 0 else (b, a)
+        tasks.append({'game': game + 1, 'opening': opening, 'white': tuple(white), 'black': tuple(black),
+                      'max_plies': max_plies})
+    return tasks
+
+
+def run_tournament(specs, openings, games, workers, output, elo0, elo1, alpha, beta, max_plies, log=sys.stdout):
+    """
+    :return: 汇总信息
+    :rtype : dict
+    """
+    a, b = specs
+    lower, upper = sprt_bounds(alpha, beta)
+    wins = draws = losses = 0
+    llr = 0.0
+    decision = None
+    nodes = collections.Counter()
+    seconds = collections.Counter()
+    finished = 0
+    started = time.perf_counter()
+    tasks = build_tasks(specs, openings, games, max_plies)
+    stop_event = multiprocessing.Event()
+    with open(output, 'w') as out, concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(stop_event,)) as executor:
+        futures = [executor.submit(play_game, task) for task in tasks]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                record = future.result()
+                if record is None:
+                    continue
+                out.write(json.dumps(record, sort_keys=True) + '\n')
+                out.flush()
+                finished += 1
+                score = score_of(record, a.name)
+                if score == 1.0:
+                    wins += 1
+                elif score == 0.5:
+                    draws += 1
+                else:
+                    losses += 1
+                for name in (a.name, b.name):
+                    nodes[name] += record['nodes'][name]
+                    seconds[name] += record['search_seconds'][name]
+                llr = sprt_llr(wins, draws, losses, elo0, elo1)
+                log.write('game {:>4} {:>8} {:>8} {:<8} {:<22} +{} ={} -{} LLR {:+.2f} [{:+.2f}, {:+.2f}]\n'.format(
+                    record['game'], record['white'], record['black'], record['result'], record['reason'],
+                    wins, draws, losses, llr, lower, upper))
+                log.flush()
+                if llr >= upper:
+                    decision = 'H1'
+                elif llr <= lower:
+                    decision = 'H0'
+                if decision:
+                    break
+        finally:
+            # 尚未开始的对局直接取消, 正在进行的对局在下一步棋时放弃
+            stop_event.set()
+            for future in futures:
+                future.cancel()
+    elapsed = time.perf_counter() - started
+    return {
+        'games': finished,
+        'wins': wins, 'draws': draws, 'losses': losses,
+        'elo': elo_estimate(wins, draws, losses),
+        'llr': llr,
+        'decision': decision,
+        'elapsed': elapsed,
+        'games_per_minute': finished / elapsed * 60.0 if elapsed else 0.0,
+        'nodes_per_second': dict((name, nodes[name] / seconds[name] if seconds[name] else 0.0)
+                                 for name in (a.name, b.name)),
+    }
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--engine', action='append', required=True, type=parse_engine_spec,
+                        help='名称:参数=值,... 必须指定两次')
+    parser.add_argument('--openings', help='开局 FEN 文件, 每行一个')
+    parser.add_argument('--games', type=int, default=100, help='最多下多少局')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', default='tournament.jsonl')
+    parser.add_argument('--elo0', type=float, default=0.0)
+    parser.add_argument('--elo1', type=float, default=50.0)
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--beta', type=float, default=0.05)
+    parser.add_argument('--max-plies', type=int, default=200, help='超过该步数判和')
+    args = parser.parse_args(argv)
+    if len(args.engine) != 2 or args.engine[0].name == args.engine[1].name:
+        parser.error('exactly two --engine options with different names are required')
+
+    openings = load_openings(args.openings) if args.openings else list(DEFAULT_OPENINGS)
+    summary = run_tournament(args.engine, openings, args.games, args.workers, args.output,
+                             args.elo0, args.elo1, args.alpha, args.beta, args.max_plies)
+    a, b = args.engine
+    print('{} vs {}: +{} ={} -{} in {} games, elo {:+.1f}, LLR {:+.2f}, {}'.format(
+        a.name, b.name, summary['wins'], summary['draws'], summary['losses'], summary['games'], summary['elo'],
+        summary['llr'], {'H1': 'H1 accepted', 'H0': 'H0 accepted'}.get(summary['decision'], 'no decision')))
+    print('{:.1f} games/minute ({:.1f} s)'.format(summary['games_per_minute'], summary['elapsed']))
+    for name, nps in sorted(summary['nodes_per_second'].items()):
+        print('{}: {:.0f} nodes/s'.format(name, nps))
+
+
+if '__main__' == __name__:
+    main()
@@ -1,7 +1,22 @@
 # coding:utf8
-import Pmw
-import gamegui
+"""程序入口
+
+    python main.py [图形界面的参数]     启动 Panda3D 棋盘, 见 gamegui.main()
+    python main.py rules [参数]         只加载规则模块, 见 rules.py; 不导入 panda3d
+
+图形界面和规则入口都在函数内部导入, 运行规则入口的进程不承担图形界面的导入开销.
+"""
+import sys
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == 'rules':
+        import rules
+        return rules.main(argv[1:])
+    import gamegui
+    return gamegui.main(argv)
 
 
 if '__main__' == __name__:
-    gamegui.main()
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""只依赖 gamearena 的规则入口: 校验走法序列, 输出局面, 不导入 panda3d 和其他可选依赖
+
+供短生命周期的校验进程使用; 图形界面的入口是 main.py, 它也可以用 python main.py rules ... 转到这里.
+
+单个局面:
+    python rules.py [--fen FEN] [MOVE ...]
+    依次走 MOVE(坐标记法, 例如 e2e4), 输出最终局面的 FEN, 是否被将军, 以及轮到走棋一方的全部合法走法
+
+批量校验:
+    python rules.py --batch < positions.txt
+    每行一个局面 'FEN' 或 'FEN; e2e4 e7e5 ...', 每行输出一个 JSON 对象:
+    {"fen": 最终局面, "legal": [合法走法], "check": 是否被将军, "error": 出错信息或 null}
+"""
+from __future__ import print_function
+
+import sys
+
+import gamearena
+
+WHITE = gamearena.WHITE
+BLACK = gamearena.BLACK
+IllegalMoveError = gamearena.IllegalMoveError
+
+
+def play(fen, moves):
+    """从 fen 开始依次走 moves
+
+    :param moves: 坐标记法的走法列表
+    :return: 最终局面, 轮到走棋的一方
+    :rtype : GameArena, GameArena.PlayerID
+    """
+    fields = fen.split()
+    arena = gamearena.new_arena_from_fen(fen)
+    side = BLACK if len(fields) > 1 and fields[1] == 'b' else WHITE
+    for text in moves:
+        side = gamearena.apply_coordinate_move(arena, side, text)
+    return arena, side
+
+
+def describe(arena, side):
+    """:return: 局面的 FEN, 合法走法(坐标记法), 是否被将军"""
+    legal = sorted(gamearena.format_coordinate_move(arena, move)
+                   for move in arena.retrieve_packed_legal_moves(side))
+    return {
+        'fen': gamearena.fen_of_arena(arena, WHITE, side),
+        'legal': legal,
+        'check': arena.is_in_check(side),
+    }
+
+
+def check_line(line):
+    """批量模式的一行: 'FEN' 或 'FEN; 走法 ...'
+
+    :rtype : dict
+    """
+    fen, _, moves = line.partition(';')
+    try:
+        report = describe(*play(fen.strip(), moves.split()))
+        report['error'] = None
+    except (ValueError, IndexError, KeyError) as e:
+        report = {'fen': None, 'legal': [], 'check': False, 'error': str(e) or type(e).__name__}
+    return report
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='validate moves with gamearena, without the GUI')
+    parser.add_argument('--fen', default=gamearena.STANDARD_CHESS_FEN)
+    parser.add_argument('--batch', action='store_true', help='read "FEN[; moves]" lines from stdin, write JSON lines')
+    parser.add_argument('moves', nargs='*', help='moves in coordinate notation, e.g. e2e4')
+    args = parser.parse_args(argv)
+
+    if args.batch:
+        import json
+        for line in sys.stdin:
+            if line.strip():
+                print(json.dumps(check_line(line), sort_keys=True))
+        return 0
+    try:
+        report = describe(*play(args.fen, args.moves))
+    except (IllegalMoveError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(report['fen'])
+    print('check' if report['check'] else 'no check')
+    print(' '.join(report['legal']))
+    return 0
+
+
+if '__main__' == __name__:
+    sys.exit(main())
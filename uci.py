@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*-encoding:utf8;-*-
+"""UCI 协议适配器: 通过标准输入输出与国际象棋图形界面或测试工具对接, 不依赖 panda3d
+
+规则由 gamearena 实现, 搜索由 gameengine 实现. 与完整的国际象棋规则相比:
+王車易位和吃过路兵尚未实现(收到这类走法时报告 info string 并忽略后续走法), 兵升变总是变成后,
+升变为其他棋子的走法(例如 e7e8n)同样按非法走法处理.
+
+position 命令按增量处理: 基准局面不变并且新的走法列表以上一次的走法列表开头时, 只在常驻的 GameArena 上
+走新增的几步, 不从头重放. 搜索在工作线程中进行, 主线程始终在读取命令, stop 和 isready 在几毫秒内得到回复.
+
+支持的命令: uci, isready, ucinewgame, setoption name Depth value N, position, go, stop, quit
+go 的参数: depth, movetime, wtime, btime, winc, binc, movestogo, infinite
+
+Usage:
+    python uci.py
+"""
+from __future__ import print_function
+
+import sys
+import threading
+
+import gamearena
+import gameengine
+
+ENGINE_NAME = 'chessgame'
+ENGINE_AUTHOR = 'liuqun'
+DEFAULT_DEPTH = 4
+MAX_DEPTH = 64  # go infinite 时的搜索深度, 实际由 stop 命令结束
+
+WHITE = gamearena.WHITE
+BLACK = gamearena.BLACK
+
+# 打包走法写成坐标记法, 兵升变总是变成后
+format_uci_move = gamearena.format_coordinate_move
+
+
+def format_score(score):
+    """:return: UCI 的 score 字段, 'cp 35' 或 'mate -3'"""
+    if abs(score) >= gameengine.MATE_SCORE - MAX_DEPTH * 2:
+        plies = gameengine.MATE_SCORE - abs(score)
+        moves = (plies + 1) // 2
+        return 'mate {}'.format(moves if score > 0 else -moves)
+    return 'cp {}'.format(score)
+
+
+class UciAdapter(object):
+    """UCI 命令解释器; handle() 在读取命令的线程中调用, 搜索在单独的工作线程中进行
+
+    :param output: 带 write() 和 flush() 的对象, 工作线程和主线程共用, 每一行输出都加锁
+    """
+
+    def __init__(self, output=sys.stdout):
+        self.__output = output
+        self.__output_lock = threading.Lock()
+        self.__engine = gameengine.Engine(depth=DEFAULT_DEPTH)
+        self.__base = None  # 上一次 position 命令的基准局面: 'startpos' 或 FEN 字符串
+        self.__moves = []  # 已经在 self.arena 上走过的走法(UCI 字符串)
+        self.arena = None
+        self.side = WHITE
+        self.__search_thread = None
+        self.__stop_event = threading.Event()
+        self.__replayed = 0  # 统计: 处理 position 命令时实际走棋的步数
+        self.__set_position('startpos', [])
+
+    def send(self, line):
+        with self.__output_lock:
+            self.__output.write(line + '\n')
+            self.__output.flush()
+
+    def handle(self, line):
+        """处理一行命令
+
+        :return: 收到 quit 时返回 False
+        :rtype : bool
+        """
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == 'uci':
+            self.send('id name {}'.format(ENGINE_NAME))
+            self.send('id author {}'.format(ENGINE_AUTHOR))
+            self.send('option name Depth type spin default {} min 1 max {}'.format(DEFAULT_DEPTH, MAX_DEPTH))
+            self.send('uciok')
+        elif command == 'isready':
+            self.send('readyok')  # 搜索在工作线程中进行, 这里不需要等待
+        elif command == 'ucinewgame':
+            self.__stop_search()
+            if self.__engine.tt is not None:
+                self.__engine.tt.clear()
+            self.__set_position('startpos', [])
+        elif command == 'setoption':
+            self.__set_option(args)
+        elif command == 'position':
+            self.__stop_search()
+            self.__position(args)
+        elif command == 'go':
+            self.__stop_search()
+            self.__go(args)
+        elif command == 'stop':
+            self.__stop_search()
+        elif command == 'quit':
+            self.__stop_search()
+            return False
+        else:
+            self.send('info string unknown command: {}'.format(command))
+        return True
+
+    @property
+    def replayed_moves(self):
+        """处理 position 命令时累计实际走过的步数, 增量处理时只计入新增的走法"""
+        return self.__replayed
+
+    def __set_option(self, args):
+        text = ' '.join(args)
+        name, _, value = text.partition(' value ')
+        name = name.replace('name', '', 1).strip().lower()
+        if name == 'depth':
+            self.__engine.depth = max(1, min(MAX_DEPTH, int(value)))
+        else:
+            self.send('info string unknown option: {}'.format(name))
+
+    def __position(self, args):
+        if not args:
+            return
+        if args[0] == 'startpos':
+            base, rest = 'startpos', args[1:]
+        elif args[0] == 'fen':
+            rest = args[1:]
+            end = rest.index('moves') if 'moves' in rest else len(rest)
+            base, rest = ' '.join(rest[:end]), rest[end:]
+        else:
+            self.send('info string invalid position command')
+            return
+        moves = rest[1:] if rest and rest[0] == 'moves' else []
+        if base == self.__base and moves[:len(self.__moves)] == self.__moves:
+            self.__apply_moves(moves[len(self.__moves):])  # 只走新增的几步
+        else:
+            self.__set_position(base, moves)
+
+    def __set_position(self, base, moves):
+        fen = gamearena.STANDARD_CHESS_FEN if base == 'startpos' else base
+        fields = fen.split()
+        self.arena = gamearena.new_arena_from_fen(fen)
+        self.side = BLACK if len(fields) > 1 and fields[1] == 'b' else WHITE
+        self.__base = base
+        self.__moves = []
+        self.__apply_moves(moves)
+
+    def __apply_moves(self, moves):
+        for text in moves:
+            try:
+                self.side = gamearena.apply_coordinate_move(self.arena, self.side, text)
+            except gamearena.IllegalMoveError:
+                self.send('info string illegal move {}, ignoring the rest'.format(text))
+                break
+            self.__moves.append(text)
+            self.__replayed += 1
+
+    def __go(self, args):
+        options = {}
+        infinite = False
+        k = 0
+        while k < len(args):
+            if args[k] == 'infinite':
+                infinite = True
+                k += 1
+            elif args[k] in ('depth', 'movetime', 'wtime', 'btime', 'winc', 'binc', 'movestogo') and k + 1 < len(args):
+                options[args[k]] = int(args[k + 1])
+                k += 2
+            else:
+                k += 1
+        depth = options.get('depth', MAX_DEPTH if infinite else None)
+        time_limit = None
+        if 'movetime' in options:
+            time_limit = options['movetime'] / 1000.0
+        elif not infinite:
+            remaining, increment = ('wtime', 'winc') if self.side == WHITE else ('btime', 'binc')
+            if remaining in options:
+                # 剩余时间平均分配给之后的若干步, 再加上一半的加秒
+                moves_to_go = options.get('movestogo', 30)
+                time_limit = (options[remaining] / float(max(moves_to_go, 1)) + options.get(increment, 0) / 2.0) / 1000.0
+        self.__stop_event.clear()
+        self.__search_thread = threading.Thread(
+            target=self.__search, args=(depth, time_limit, infinite), name='UciSearch')
+        self.__search_thread.daemon = True
+        self.__search_thread.start()
+
+    def __search(self, depth, time_limit, infinite):
+        """工作线程: 搜索期间主线程不会修改 self.arena, 修改之前会先调用 __stop_search()"""
+        arena = self.arena
+
+        def report(result):
+            elapsed = max(result.elapsed, 1e-6)
+            self.send('info depth {} score {} nodes {} time {} nps {} pv {}'.format(
+                result.depth, format_score(result.score), result.nodes, int(elapsed * 1000),
+                int(result.nodes / elapsed), ' '.join(self.__format_pv(arena, result.pv))))
+
+        result = self.__engine.search(arena, self.side, depth=depth, stop_event=self.__stop_event,
+                                      time_limit=time_limit, on_iteration=report)
+        if infinite:
+            self.__stop_event.wait()  # go infinite 必须等到 stop 才能给出 bestmove
+        self.send('bestmove {}'.format(format_uci_move(arena, result.move) if result.move is not None else '0000'))
+
+    @staticmethod
+    def __format_pv(arena, pv):
+        arena = arena.copy()
+        for move in pv:
+            if arena.find_unit_on_index(gamearena.unpack_move(move)[0]) is None:
+                break  # 来自置换表的走法可能已经不适用
+            yield format_uci_move(arena, move)
+            gameengine.apply_move(arena, move)
+
+    def __stop_search(self):
+        """中止正在进行的搜索并等待工作线程输出 bestmove"""
+        thread = self.__search_thread
+        if thread is None:
+            return
+        self.__stop_event.set()
+        thread.join()
+        self.__search_thread = None
+
+
+def main():
+    adapter = UciAdapter()
+    # 逐行读取, 不使用 for line in sys.stdin, 避免 Python 2 的文件迭代器预读缓冲导致命令延迟
+    while True:
+        line = sys.stdin.readline()
+        if not line or not adapter.handle(line):
+            break
+
+
+if '__main__' == __name__:
+    main()